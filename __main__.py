@@ -1,5 +1,4 @@
 import argparse
-import covid_variant
 
 
 __version__ = '1.1.1-beta'
@@ -12,8 +11,29 @@ REQUIRED = [
         'keys': ['-1', '--fq1'],
         'properties': {
             'type': str,
-            'required': True,
-            'help': 'path to read 1 fastq file',
+            'required': False,
+            'help': 'path to read 1 fastq file (required unless --sample-sheet, --cohort-vcf or --serve is given)',
+        }
+    },
+    {
+        'keys': ['-s', '--sample-sheet'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': '''path to a csv sample sheet with columns sample_id, fq1, fq2 (fq2 optional),
+to run all samples in batch mode instead of -1/-2 (default: %(default)s)''',
+        }
+    },
+    {
+        'keys': ['--cohort-vcf'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': '''path to a multi-sample VCF (plain, gzip or bcf) with genotypes on NC_045512.2,
+to report the spike protein mutations and matched variants of all samples instead of -1/-2,
+written to outdir/{sample_id} and summarized in outdir/summary.csv (default: %(default)s)''',
         }
     },
 ]
@@ -60,7 +80,196 @@ OPTIONAL = [
             'type': int,
             'required': False,
             'default': 4,
-            'help': 'number of CPU threads (default: %(default)s)',
+            'help': 'number of CPU threads, in batch and server mode the total for all samples (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--threads-per-sample'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 4,
+            'help': 'number of CPU threads for each sample in batch and server mode (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--pipelined'],
+        'properties': {
+            'action': 'store_true',
+            'help': '''in batch mode, overlap stages of consecutive samples, e.g. trimming one sample while another is in variant calling,
+with multi-threaded stages sharing the --threads budget''',
+        }
+    },
+    {
+        'keys': ['--serve'],
+        'properties': {
+            'action': 'store_true',
+            'help': '''run as a long-lived HTTP server on --host:--port, which keeps the reference, the bowtie2 index
+and the variant table warm in threads // threads-per-sample worker processes;
+submit a sample with POST /jobs and a JSON body {"fq1": ..., "fq2": ..., "wait": true} plus any option to override,
+and get its status and result as JSON from GET /jobs/<job_id>''',
+        }
+    },
+    {
+        'keys': ['--host'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': '127.0.0.1',
+            'help': 'host address of the server mode (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--port'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 8000,
+            'help': 'port of the server mode (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--single-pass-sampling'],
+        'properties': {
+            'action': 'store_true',
+            'help': '''subsample fastq reads to the target coverage in a single pass over the input (uses sampling scheme v1),
+with a second pass only if the sampled coverage deviates from the target by more than 5%%''',
+        }
+    },
+    {
+        'keys': ['--sampling-scheme'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'choices': ['v1', 'v2', 'hash'],
+            'default': 'v1',
+            'help': '''v1: per-read sampling, reproducible with earlier versions
+v2: block-based vectorized sampling, faster but selects different reads for the same seed
+hash: keep reads by a seeded hash of the read name, in parallel worker processes,
+independent of the read order and the number of threads
+(default: %(default)s)''',
+        }
+    },
+    {
+        'keys': ['--depth-normalization'],
+        'properties': {
+            'action': 'store_true',
+            'help': '''cap the read bases of each 200-bp genome window at the target coverage, instead of sampling all reads
+with one genome-wide fraction, for amplicon data with uneven depth (overrides --single-pass-sampling)''',
+        }
+    },
+    {
+        'keys': ['--unordered-input'],
+        'properties': {
+            'action': 'store_true',
+            'help': '''declare that reads are not ordered by genome position (e.g. instrument-native order),
+so that trimming stops reading input once the trimmed reads reach --target-coverage,
+instead of trimming all reads and subsampling (overrides the other sampling options)''',
+        }
+    },
+    {
+        'keys': ['--intermediate-codec'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'choices': ['none', 'gzip', 'zstd'],
+            'default': 'gzip',
+            'help': 'compression of intermediate fastq files, zstd requires the zstandard package (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--compression-level'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': None,
+            'help': 'compression level of intermediate fastq files, the codec default if not given (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--stream-mapping'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'pipe bowtie2 output directly into samtools sort, without writing intermediate SAM/BAM files',
+        }
+    },
+    {
+        'keys': ['--calling-regions'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 1,
+            'help': 'split the genome into this number of overlapping regions for concurrent variant calling (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--variant-caller'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'choices': ['bcftools', 'pileup'],
+            'default': 'bcftools',
+            'help': '''bcftools: bcftools mpileup | bcftools call --ploidy 1
+pileup: in-process haploid caller counting bases with NumPy, --calling-regions is ignored
+(default: %(default)s)''',
+        }
+    },
+    {
+        'keys': ['--thread-profile'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': '''thread profile json file from "python covid_variant/benchmark.py --profile-threads",
+which caps the threads of each tool at the number it can use (default: %(default)s)''',
+        }
+    },
+    {
+        'keys': ['--index-cache-dir'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'directory to cache the bowtie2 index and the parsed reference across runs (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--workdir-backend'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'choices': ['disk', 'memory'],
+            'default': 'disk',
+            'help': '''disk: intermediate files in a new workdir in the current directory
+memory: intermediate files in /dev/shm (RAM-backed) if their estimated size fits within --memory-budget,
+otherwise falls back to local scratch ($TMPDIR, otherwise /tmp), then to disk; ignored if --workdir is given
+(default: %(default)s)''',
+        }
+    },
+    {
+        'keys': ['--memory-budget'],
+        'properties': {
+            'type': float,
+            'required': False,
+            'default': 4.0,
+            'help': 'GB of intermediate files allowed in memory for each sample, with --workdir-backend memory (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['-w', '--workdir'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'path to the working directory, a new one in the current directory if not given (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--resume'],
+        'properties': {
+            'action': 'store_true',
+            'help': '''record completed stages in the workdir, and skip stages already completed with identical inputs;
+use together with --workdir (and --debug to keep the workdir of successful runs)''',
         }
     },
     {
@@ -117,15 +326,61 @@ class EntryPoint:
 
     def run(self):
         args = self.parser.parse_args()
-        covid_variant.main(
-            fq1=args.fq1,
-            fq2=args.fq2,
-            outdir=args.outdir,
+        if args.fq1 is None and args.sample_sheet == 'None' and args.cohort_vcf == 'None' and not args.serve:
+            self.parser.error('either -1/--fq1, -s/--sample-sheet, --cohort-vcf or --serve is required')
+
+        import covid_variant  # imported after parsing, so that --help and --version do not pay for pandas, numpy, etc.
+
+        options = dict(
             tolerate_missing=args.tolerate_missing,
             target_coverage=args.target_coverage,
-            threads=args.threads,
+            single_pass_sampling=args.single_pass_sampling,
+            sampling_scheme=args.sampling_scheme,
+            depth_normalization=args.depth_normalization,
+            unordered_input=args.unordered_input,
+            intermediate_codec=args.intermediate_codec,
+            compression_level=args.compression_level,
+            stream_mapping=args.stream_mapping,
+            calling_regions=args.calling_regions,
+            variant_caller=args.variant_caller,
+            thread_profile=args.thread_profile,
+            index_cache_dir=args.index_cache_dir,
+            workdir_backend=args.workdir_backend,
+            memory_budget=args.memory_budget,
+            resume=args.resume,
             debug=args.debug)
 
+        if args.cohort_vcf != 'None':
+            covid_variant.main_cohort(
+                vcf=args.cohort_vcf,
+                outdir=args.outdir,
+                tolerate_missing=args.tolerate_missing,
+                debug=args.debug)
+        elif args.serve:
+            covid_variant.main_serve(
+                host=args.host,
+                port=args.port,
+                outdir=args.outdir,
+                threads=args.threads,
+                threads_per_sample=args.threads_per_sample,
+                options=options)
+        elif args.sample_sheet != 'None':
+            covid_variant.main_batch(
+                sample_sheet=args.sample_sheet,
+                outdir=args.outdir,
+                threads=args.threads,
+                threads_per_sample=args.threads_per_sample,
+                pipelined=args.pipelined,
+                options=options)
+        else:
+            covid_variant.main(
+                fq1=args.fq1,
+                fq2=args.fq2,
+                outdir=args.outdir,
+                workdir=args.workdir,
+                threads=args.threads,
+                **options)
+
 
 if __name__ == '__main__':
     EntryPoint().main()
@@ -0,0 +1,190 @@
+import argparse
+
+
+PROG = 'python covid_variant/benchmark.py'
+DESCRIPTION = 'Benchmark Covid Variant end-to-end on synthetic SARS-CoV-2 reads with B.1.1.7 mutations'
+OPTIONAL = [
+    {
+        'keys': ['-o', '--outdir'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'benchmark_outdir',
+            'help': 'path to the output directory (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--coverages'],
+        'properties': {
+            'type': float,
+            'nargs': '+',
+            'required': False,
+            'default': [50, 500, 2000],
+            'help': 'coverages of simulated reads, one benchmark run for each (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--read-length'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 150,
+            'help': 'length of simulated reads (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--unpaired'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'simulate unpaired instead of paired-end reads',
+        }
+    },
+    {
+        'keys': ['--error-rate'],
+        'properties': {
+            'type': float,
+            'required': False,
+            'default': 0.001,
+            'help': 'per-base substitution error rate of simulated reads (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--target-coverage'],
+        'properties': {
+            'type': float,
+            'required': False,
+            'default': 10000,
+            'help': 'target coverage passed to the pipeline (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--variant-caller'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'choices': ['bcftools', 'pileup'],
+            'default': 'bcftools',
+            'help': 'variant caller to benchmark (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--unordered-input'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'benchmark the early-stop trimming of unordered input instead of trimming and sampling',
+        }
+    },
+    {
+        'keys': ['-t', '--threads'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 4,
+            'help': 'number of CPU threads (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--profile-threads'],
+        'properties': {
+            'type': int,
+            'nargs': '+',
+            'required': False,
+            'default': [],
+            'help': '''run each coverage with each of these thread counts instead of --threads,
+and write the useful threads of each tool to <outdir>/thread_profile.json''',
+        }
+    },
+    {
+        'keys': ['--thread-profile'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'thread profile json file to run with (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--label'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': None,
+            'help': 'label of this benchmark, e.g. the version or commit being measured (default: the date of the benchmark)',
+        }
+    },
+    {
+        'keys': ['--compare'],
+        'properties': {
+            'type': str,
+            'nargs': 2,
+            'required': False,
+            'metavar': ('BASELINE_JSON', 'CONTENDER_JSON'),
+            'help': 'compare two benchmark json files instead of running a benchmark',
+        }
+    },
+    {
+        'keys': ['-d', '--debug'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'debug mode, keep simulated reads and intermediate files',
+        }
+    },
+    {
+        'keys': ['-h', '--help'],
+        'properties': {
+            'action': 'help',
+            'help': 'show this help message',
+        }
+    },
+]
+
+
+class EntryPoint:
+
+    parser: argparse.ArgumentParser
+
+    def main(self):
+        self.set_parser()
+        self.add_optional_arguments()
+        self.run()
+
+    def set_parser(self):
+        self.parser = argparse.ArgumentParser(
+            prog=PROG,
+            description=DESCRIPTION,
+            add_help=False,
+            formatter_class=argparse.RawTextHelpFormatter)
+
+    def add_optional_arguments(self):
+        group = self.parser.add_argument_group('optional arguments')
+        for item in OPTIONAL:
+            group.add_argument(*item['keys'], **item['properties'])
+
+    def run(self):
+        args = self.parser.parse_args()
+        from covid_variant.benchmark import Benchmark, compare_benchmarks  # after parsing, for a fast --help
+
+        if args.compare is not None:
+            df = compare_benchmarks(*args.compare)
+            print(df.to_string(index=False))
+            return
+
+        json_path = Benchmark().main(
+            outdir=args.outdir,
+            coverages=args.coverages,
+            read_length=args.read_length,
+            paired=not args.unpaired,
+            error_rate=args.error_rate,
+            target_coverage=args.target_coverage,
+            variant_caller=args.variant_caller,
+            unordered_input=args.unordered_input,
+            threads=args.threads,
+            profile_threads=args.profile_threads,
+            thread_profile=None if args.thread_profile == 'None' else args.thread_profile,
+            label=args.label,
+            debug=args.debug)
+        print(f'Benchmark results written to {json_path}')
+
+
+if __name__ == '__main__':
+    EntryPoint().main()
@@ -1,9 +1,10 @@
 from os import makedirs
 from shutil import rmtree
-from typing import Optional
 from os.path import exists, dirname
+from tempfile import gettempdir
+from typing import Optional, Dict, Any
 from .template import Settings
-from .covid_variant import CovidVariant
+from .workdir import ResolveWorkdirBackend, MEMORY, SCRATCH, MEMORY_ROOT
 
 
 def get_temp_path(prefix: str = 'temp', suffix: str = '') -> str:
@@ -16,6 +17,21 @@ def get_temp_path(prefix: str = 'temp', suffix: str = '') -> str:
     return path
 
 
+def make_temp_dir(prefix: str = 'temp') -> str:
+    """
+    Same naming as get_temp_path(), but the directory is created right away,
+    so that concurrent processes never obtain the same path
+    """
+    i = 0
+    while True:
+        path = f'{prefix}_{i:06d}'
+        try:
+            makedirs(path)
+            return path
+        except FileExistsError:
+            i += 1
+
+
 class Main:
 
     fq1: str
@@ -23,8 +39,24 @@ class Main:
     outdir: str
     tolerate_missing: float
     target_coverage: float
+    single_pass_sampling: bool
+    sampling_scheme: str
+    depth_normalization: bool
+    unordered_input: bool
+    intermediate_codec: str
+    compression_level: Optional[int]
     threads: int
+    stream_mapping: bool
+    calling_regions: int
+    variant_caller: str
+    thread_profile: Optional[str]
+    index_cache_dir: Optional[str]
+    workdir_backend: str
+    memory_budget: float
+    workdir: Optional[str]
+    resume: bool
     debug: bool
+    thread_budget: Optional[Any]  # ThreadBudget, not imported to keep the package import light
 
     settings: Settings
     gbk: str
@@ -37,30 +69,101 @@ class Main:
             outdir: str,
             tolerate_missing: float,
             target_coverage: float,
+            single_pass_sampling: bool,
+            sampling_scheme: str,
+            depth_normalization: bool,
+            unordered_input: bool,
+            intermediate_codec: str,
+            compression_level: Optional[int],
             threads: int,
-            debug: bool):
+            stream_mapping: bool,
+            calling_regions: int,
+            variant_caller: str,
+            thread_profile: str,
+            index_cache_dir: str,
+            workdir_backend: str,
+            memory_budget: float,
+            workdir: str,
+            resume: bool,
+            debug: bool,
+            thread_budget: Optional[Any] = None):
+        """
+        memory_budget:
+            GB, the largest estimated intermediate size for the workdir to be placed in memory
+
+        thread_budget:
+            Shared by samples in pipelined batch mode, not exposed on the command line
+        """
 
         self.fq1 = fq1
         self.fq2 = None if fq2 == 'None' else fq2
         self.outdir = outdir
         self.tolerate_missing = tolerate_missing
         self.target_coverage = target_coverage
+        self.single_pass_sampling = single_pass_sampling
+        self.sampling_scheme = sampling_scheme
+        self.depth_normalization = depth_normalization
+        self.unordered_input = unordered_input
+        self.intermediate_codec = intermediate_codec
+        self.compression_level = compression_level
         self.threads = threads
+        self.stream_mapping = stream_mapping
+        self.calling_regions = calling_regions
+        self.variant_caller = variant_caller
+        self.thread_profile = None if thread_profile == 'None' else thread_profile
+        self.index_cache_dir = None if index_cache_dir == 'None' else index_cache_dir
+        self.workdir_backend = workdir_backend
+        self.memory_budget = memory_budget
+        self.workdir = None if workdir == 'None' else workdir
+        self.resume = resume
         self.debug = debug
+        self.thread_budget = thread_budget
 
         self.set_settings()
         self.makedirs()
         self.set_reference_paths()
-        self.execute()
-        self.clean_up()
+        try:
+            self.execute()
+            self.clean_up()
+        finally:
+            self.release_memory()
 
     def set_settings(self):
+        if self.workdir is None:
+            backend = ResolveWorkdirBackend(debug=self.debug).main(
+                backend=self.workdir_backend,
+                memory_budget=int(self.memory_budget * 2 ** 30),
+                fqs=[self.fq1, self.fq2],
+                intermediate_codec=self.intermediate_codec,
+                stream_mapping=self.stream_mapping)
+            prefix = {
+                MEMORY: f'{MEMORY_ROOT}/covid_variant_workdir',
+                SCRATCH: f'{gettempdir()}/covid_variant_workdir',
+            }.get(backend, 'workdir')
+            workdir = make_temp_dir(prefix=prefix)
+        else:
+            backend, workdir = 'disk', self.workdir  # a given workdir is used as is
+
         self.settings = Settings(
-            workdir=get_temp_path(prefix='workdir'),
+            workdir=workdir,
             outdir=self.outdir,
             threads=self.threads,
             debug=self.debug,
-            mock=False)
+            mock=False,
+            workdir_backend=backend,
+            stream_mapping=self.stream_mapping,
+            index_cache_dir=self.index_cache_dir,
+            resume=self.resume,
+            calling_regions=self.calling_regions,
+            variant_caller=self.variant_caller,
+            single_pass_sampling=self.single_pass_sampling,
+            sampling_scheme=self.sampling_scheme,
+            depth_normalization=self.depth_normalization,
+            unordered_input=self.unordered_input,
+            intermediate_codec=self.intermediate_codec,
+            compression_level=self.compression_level,
+            thread_profile=self.thread_profile,
+            thread_budget=self.thread_budget)
 
     def makedirs(self):
         for d in [self.settings.workdir, self.settings.outdir]:
@@ -72,6 +175,8 @@ class Main:
         self.covid_variant_csv = f'{ref_dir}/variants.csv'
 
     def execute(self):
+        from .covid_variant import CovidVariant  # heavy dependencies (pandas, numpy, Biopython) are loaded only to run
+
         CovidVariant(self.settings).main(
             gbk=self.gbk,
             fq1=self.fq1,
@@ -84,6 +189,13 @@ class Main:
         if not self.debug:
             rmtree(self.settings.workdir)
 
+    def release_memory(self):
+        """
+        A failed run keeps its workdir for inspection, unless it is in memory, where it would hold RAM
+        """
+        if self.settings.workdir_backend == MEMORY and not self.debug and exists(self.settings.workdir):
+            rmtree(self.settings.workdir)
+
 
 def main(
         fq1: str,
@@ -91,7 +203,22 @@ def main(
         outdir: str,
         tolerate_missing: float,
         target_coverage: float,
+        single_pass_sampling: bool,
+        sampling_scheme: str,
+        depth_normalization: bool,
+        unordered_input: bool,
+        intermediate_codec: str,
+        compression_level: Optional[int],
         threads: int,
+        stream_mapping: bool,
+        calling_regions: int,
+        variant_caller: str,
+        thread_profile: str,
+        index_cache_dir: str,
+        workdir_backend: str,
+        memory_budget: float,
+        workdir: str,
+        resume: bool,
         debug: bool):
 
     Main().main(
@@ -100,5 +227,82 @@ def main(
         outdir=outdir,
         tolerate_missing=tolerate_missing,
         target_coverage=target_coverage,
+        single_pass_sampling=single_pass_sampling,
+        sampling_scheme=sampling_scheme,
+        depth_normalization=depth_normalization,
+        unordered_input=unordered_input,
+        intermediate_codec=intermediate_codec,
+        compression_level=compression_level,
         threads=threads,
+        stream_mapping=stream_mapping,
+        calling_regions=calling_regions,
+        variant_caller=variant_caller,
+        thread_profile=thread_profile,
+        index_cache_dir=index_cache_dir,
+        workdir_backend=workdir_backend,
+        memory_budget=memory_budget,
+        workdir=workdir,
+        resume=resume,
         debug=debug)
+
+
+def main_batch(
+        sample_sheet: str,
+        outdir: str,
+        threads: int,
+        threads_per_sample: int,
+        pipelined: bool,
+        options: Dict[str, Any]):
+
+    from .batch import Batch  # imported here because .batch imports Main from this module
+
+    Batch().main(
+        sample_sheet=sample_sheet,
+        outdir=outdir,
+        threads=threads,
+        threads_per_sample=threads_per_sample,
+        pipelined=pipelined,
+        options=options)
+
+
+def main_serve(
+        host: str,
+        port: int,
+        outdir: str,
+        threads: int,
+        threads_per_sample: int,
+        options: Dict[str, Any]):
+
+    from .server import serve  # imported here because .server imports Main from this module via .batch
+
+    serve(
+        host=host,
+        port=port,
+        outdir=outdir,
+        threads=threads,
+        threads_per_sample=threads_per_sample,
+        options=options)
+
+
+def main_cohort(
+        vcf: str,
+        outdir: str,
+        tolerate_missing: float,
+        debug: bool):
+
+    from .cohort import Cohort  # heavy dependencies are loaded only to run
+
+    ref_dir = f'{dirname(dirname(__file__))}/reference'
+    makedirs(outdir, exist_ok=True)
+    settings = Settings(
+        workdir=outdir,
+        outdir=outdir,
+        threads=1,
+        debug=debug,
+        mock=False)
+
+    Cohort(settings).main(
+        vcf=vcf,
+        gbk=f'{ref_dir}/NC_045512.2.gb',
+        covid_variant_csv=f'{ref_dir}/variants.csv',
+        tolerate_missing=tolerate_missing)
@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import multiprocessing
+import pandas as pd
+from contextlib import redirect_stdout
+from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, Future, as_completed
+from .budget import ThreadBudget
+from . import Main
+
+
+SAMPLE_ID = 'sample_id'
+FQ1 = 'fq1'
+FQ2 = 'fq2'
+LOG_FILENAME = 'covid_variant.log'
+RESULT_FILENAME = 'result.txt'
+SUMMARY_FILENAME = 'summary.csv'
+TIMING_FILENAME = 'timing.json'
+SPIKE_PREFIX = 'Spike protein mutations: '
+MATCH_PREFIX = 'Match: '
+
+
+class Batch:
+
+    PIPELINE_DEPTH = 2  # samples in flight per threads_per_sample slot in pipelined mode
+
+    sample_sheet: str
+    outdir: str
+    threads: int
+    threads_per_sample: int
+    pipelined: bool
+    options: Dict[str, Any]
+
+    sample_df: pd.DataFrame
+    status: Dict[str, str]
+    start_end: Dict[str, Tuple[float, float]]
+    wall_time: float
+    summary_df: pd.DataFrame
+
+    def main(
+            self,
+            sample_sheet: str,
+            outdir: str,
+            threads: int,
+            threads_per_sample: int,
+            pipelined: bool,
+            options: Dict[str, Any]):
+        """
+        pipelined:
+            Overlap stages of different samples under the thread budget,
+            instead of running threads // threads_per_sample samples side by side
+
+        options:
+            keyword arguments passed to Main.main() for every sample,
+            other than fq1, fq2, outdir, workdir and threads
+        """
+
+        self.sample_sheet = sample_sheet
+        self.outdir = outdir
+        self.threads = threads
+        self.threads_per_sample = min(threads_per_sample, threads)
+        self.pipelined = pipelined
+        self.options = options
+
+        self.read_sample_sheet()
+        self.makedirs()
+        start = time.time()
+        if self.pipelined:
+            self.execute_pipelined()
+        else:
+            self.execute()
+        self.wall_time = time.time() - start
+        self.write_summary()
+        self.write_timing()
+
+    def read_sample_sheet(self):
+        df = pd.read_csv(self.sample_sheet, dtype=str)
+        if FQ2 not in df.columns:
+            df[FQ2] = None
+        for c in [SAMPLE_ID, FQ1]:
+            assert c in df.columns, f'Column "{c}" not found in sample sheet "{self.sample_sheet}"'
+        assert df[SAMPLE_ID].is_unique, f'Duplicated {SAMPLE_ID} in sample sheet "{self.sample_sheet}"'
+        self.sample_df = df
+
+    def makedirs(self):
+        os.makedirs(self.outdir, exist_ok=True)
+
+    def execute(self):
+        """
+        Samples are run in separate processes, each with threads_per_sample threads,
+        so that the total never exceeds the thread budget
+        """
+        max_workers = max(1, self.threads // self.threads_per_sample)
+        self.run_samples(max_workers=max_workers, thread_budget=None)
+
+    def execute_pipelined(self):
+        """
+        More samples than threads // threads_per_sample are run at the same time.
+        Each stage reserves the threads it keeps busy (threads_per_sample for trimming and mapping,
+        one for single-threaded stages) from a budget shared by all samples, so that a multi-threaded stage
+        of one sample runs while other samples are in single-threaded stages
+        """
+        slots = max(1, self.threads // self.threads_per_sample)
+        max_workers = min(len(self.sample_df), self.PIPELINE_DEPTH * slots, self.threads)
+        with multiprocessing.Manager() as manager:
+            budget = ThreadBudget(manager=manager, total=self.threads)
+            self.run_samples(max_workers=max_workers, thread_budget=budget)
+
+    def run_samples(self, max_workers: int, thread_budget: Optional[ThreadBudget]):
+        self.status = {}
+        self.start_end = {}
+        with ProcessPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {}
+            for i, row in self.sample_df.iterrows():
+                future = executor.submit(
+                    run_sample,
+                    fq1=row[FQ1],
+                    fq2=None if pd.isna(row[FQ2]) else row[FQ2],
+                    outdir=f'{self.outdir}/{row[SAMPLE_ID]}',
+                    threads=self.threads_per_sample,
+                    options=self.options,
+                    thread_budget=thread_budget)
+                futures[future] = row[SAMPLE_ID]
+            self.collect(futures)
+
+    def collect(self, futures: Dict[Future, str]):
+        for future in as_completed(futures):
+            sample_id = futures[future]
+            try:
+                self.start_end[sample_id] = future.result()
+                self.status[sample_id] = 'Done'
+            except Exception as e:
+                self.status[sample_id] = f'Failed: {e!r}'
+            print(f'{sample_id}\t{self.status[sample_id]}', flush=True)
+
+    def write_summary(self):
+        self.summary_df = SummarizeResults().main(
+            outdir=self.outdir,
+            sample_ids=list(self.sample_df[SAMPLE_ID]),
+            status=self.status)
+        self.summary_df.to_csv(f'{self.outdir}/{SUMMARY_FILENAME}', index=False)
+
+    def write_timing(self):
+        n_done = len(self.start_end)
+        samples = [
+            {
+                'sample_id': sample_id,
+                'start': start,
+                'end': end,
+                'latency': end - start,
+            }
+            for sample_id, (start, end) in sorted(self.start_end.items(), key=lambda item: item[1])
+        ]
+        latencies = sorted(s['latency'] for s in samples)
+        data = {
+            'pipelined': self.pipelined,
+            'threads': self.threads,
+            'threads_per_sample': self.threads_per_sample,
+            'wall_time': self.wall_time,
+            'samples_done': n_done,
+            'samples_per_hour': n_done / self.wall_time * 3600 if self.wall_time > 0 else None,
+            'median_latency': latencies[len(latencies) // 2] if latencies else None,
+            'samples': samples,
+        }
+        with open(f'{self.outdir}/{TIMING_FILENAME}', 'w') as fh:
+            json.dump(data, fh, indent=2)
+        print(f'{n_done} samples done in {self.wall_time:.1f} seconds', flush=True)
+
+
+def run_sample(
+        fq1: str,
+        fq2: Optional[str],
+        outdir: str,
+        threads: int,
+        options: Dict[str, Any],
+        thread_budget: Optional[ThreadBudget] = None) -> Tuple[float, float]:
+    """
+    Returns the start and end time of the sample
+    """
+    start = time.time()
+    os.makedirs(outdir, exist_ok=True)
+    with open(f'{outdir}/{LOG_FILENAME}', 'w') as fh:
+        with redirect_stdout(fh):
+            Main().main(
+                fq1=fq1,
+                fq2='None' if fq2 is None else fq2,
+                outdir=outdir,
+                workdir=f'{outdir}/workdir' if options['resume'] else 'None',  # fixed workdir to resume from
+                threads=threads,
+                thread_budget=thread_budget,
+                **options)
+    return start, time.time()
+
+
+class SummarizeResults:
+
+    COLUMNS = [
+        'Sample ID',
+        'Spike Protein Mutations',
+        'Match',
+        'Status',
+    ]
+
+    outdir: str
+    sample_ids: List[str]
+    status: Dict[str, str]
+
+    def main(
+            self,
+            outdir: str,
+            sample_ids: List[str],
+            status: Dict[str, str]) -> pd.DataFrame:
+
+        self.outdir = outdir
+        self.sample_ids = sample_ids
+        self.status = status
+
+        rows = [self.summarize_one(sample_id) for sample_id in self.sample_ids]
+        return pd.DataFrame(data=rows, columns=self.COLUMNS)
+
+    def summarize_one(self, sample_id: str) -> list:
+        spike_mutations, match = read_result_txt(f'{self.outdir}/{sample_id}/{RESULT_FILENAME}')
+        return [sample_id, spike_mutations, match, self.status.get(sample_id)]
+
+
+def read_result_txt(result_txt: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Returns the spike protein mutations and the matched variants reported in result_txt, None if not found
+    """
+    spike_mutations, match = None, None
+    if os.path.exists(result_txt):
+        with open(result_txt) as fh:
+            for line in fh:
+                line = line.rstrip('\r\n')
+                if line.startswith(SPIKE_PREFIX):
+                    spike_mutations = line[len(SPIKE_PREFIX):]
+                elif line.startswith(MATCH_PREFIX):
+                    match = line[len(MATCH_PREFIX):]
+    return spike_mutations, match
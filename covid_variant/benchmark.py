@@ -0,0 +1,270 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import functools
+import pandas as pd
+from os.path import dirname
+from datetime import datetime
+from typing import List, Dict, Any, Callable, Optional
+from .threads import BuildThreadProfile
+from .template import Settings, RESOURCE_USAGE_FILENAME
+from .covid_variant import CovidVariant
+from .pipeline import VariantCallingPipeline
+from .simulate import SimulateReads, b_1_1_7_cds_edit_df
+
+
+BENCHMARK_FILENAME = 'benchmark.json'
+THREAD_PROFILE_FILENAME = 'thread_profile.json'
+
+
+class StageTimer:
+    """
+    Records the wall time of named stage methods of a processor instance,
+    by shadowing the bound methods with timed wrappers
+    """
+
+    seconds: Dict[str, float]
+
+    def __init__(self):
+        self.seconds = {}
+
+    def wrap(self, obj: Any, stages: List[str]):
+        for name in stages:
+            setattr(obj, name, self.timed(getattr(obj, name)))
+
+    def timed(self, method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                name = method.__name__
+                self.seconds[name] = self.seconds.get(name, 0.) + time.perf_counter() - start
+        return wrapper
+
+
+class TimedVariantCallingPipeline(VariantCallingPipeline):
+
+    STAGES = ['write_fna', 'trimming', 'early_stop_trimming', 'sampling', 'mapping', 'variant_calling']
+
+    def __init__(self, settings: Settings, timer: StageTimer):
+        super().__init__(settings=settings)
+        timer.wrap(obj=self, stages=self.STAGES)
+
+
+class TimedCovidVariant(CovidVariant):
+
+    STAGES = ['process_vcf', 'read_gbk', 'mutate', 'compare_wt_and_mutant_cdses', 'report_result']
+
+    timer: StageTimer
+
+    def __init__(self, settings: Settings, timer: StageTimer):
+        super().__init__(settings=settings)
+        self.timer = timer
+        timer.wrap(obj=self, stages=self.STAGES)
+
+    def variant_calling_pipeline(self):
+        self.vcf = TimedVariantCallingPipeline(self.settings, timer=self.timer).main(
+            gbk=self.gbk,
+            fq1=self.fq1,
+            fq2=self.fq2,
+            target_coverage=self.target_coverage)
+
+
+class Benchmark:
+
+    STAGES = TimedVariantCallingPipeline.STAGES + TimedCovidVariant.STAGES
+
+    outdir: str
+    coverages: List[float]
+    read_length: int
+    paired: bool
+    error_rate: float
+    target_coverage: float
+    variant_caller: str
+    unordered_input: bool
+    threads: int
+    profile_threads: List[int]
+    thread_profile: Optional[str]
+    label: Optional[str]
+    debug: bool
+
+    gbk: str
+    covid_variant_csv: str
+    runs: List[Dict[str, Any]]
+
+    def main(
+            self,
+            outdir: str,
+            coverages: List[float],
+            read_length: int,
+            paired: bool,
+            error_rate: float,
+            target_coverage: float,
+            variant_caller: str,
+            unordered_input: bool,
+            threads: int,
+            profile_threads: List[int],
+            thread_profile: Optional[str],
+            label: Optional[str],
+            debug: bool) -> str:
+        """
+        label:
+            Recorded in the benchmark json file, the date of the benchmark if None
+
+        profile_threads:
+            If given, each coverage is run with each of these thread counts instead of threads,
+            and a thread profile is built from the resource usage of all runs
+
+        thread_profile:
+            Thread profile json file to run with
+
+        Returns the path of the benchmark json file
+        """
+
+        self.outdir = outdir
+        self.coverages = coverages
+        self.read_length = read_length
+        self.paired = paired
+        self.error_rate = error_rate
+        self.target_coverage = target_coverage
+        self.variant_caller = variant_caller
+        self.unordered_input = unordered_input
+        self.threads = threads
+        self.profile_threads = profile_threads
+        self.thread_profile = thread_profile
+        self.label = label
+        self.debug = debug
+
+        self.set_reference_paths()
+        os.makedirs(self.outdir, exist_ok=True)
+        thread_counts = self.profile_threads if self.profile_threads else [self.threads]
+        self.runs = [self.run(coverage=c, threads=t) for t in thread_counts for c in self.coverages]
+        if self.profile_threads:
+            self.build_thread_profile()
+        return self.write_json()
+
+    def set_reference_paths(self):
+        ref_dir = f'{dirname(dirname(__file__))}/reference'
+        self.gbk = f'{ref_dir}/NC_045512.2.gb'
+        self.covid_variant_csv = f'{ref_dir}/variants.csv'
+
+    def run(self, coverage: float, threads: int) -> Dict[str, Any]:
+        rundir = f'{self.outdir}/coverage_{coverage:g}x_threads_{threads}'
+        settings = Settings(
+            workdir=f'{rundir}/workdir',
+            outdir=rundir,
+            threads=threads,
+            debug=self.debug,
+            mock=False,
+            variant_caller=self.variant_caller,
+            unordered_input=self.unordered_input,
+            thread_profile=self.thread_profile)
+        os.makedirs(settings.workdir, exist_ok=True)
+
+        simulator = SimulateReads(settings)
+        fq1, fq2 = simulator.main(
+            gbk=self.gbk,
+            cds_edit_df=b_1_1_7_cds_edit_df(),
+            coverage=coverage,
+            read_length=self.read_length,
+            paired=self.paired,
+            prefix=f'{settings.workdir}/simulated',
+            error_rate=self.error_rate)
+
+        timer = StageTimer()
+        start = time.perf_counter()
+        TimedCovidVariant(settings, timer=timer).main(
+            gbk=self.gbk,
+            fq1=fq1,
+            fq2=fq2,
+            covid_variant_csv=self.covid_variant_csv,
+            tolerate_missing=0.1,
+            target_coverage=self.target_coverage)
+        total = time.perf_counter() - start
+
+        if not self.debug:
+            shutil.rmtree(settings.workdir)
+
+        return {
+            'coverage': coverage,
+            'threads': threads,
+            'resource_usage': f'{rundir}/{RESOURCE_USAGE_FILENAME}',
+            'reads': simulator.n_reads,
+            'bases': simulator.n_bases,
+            'total': throughput(total, simulator.n_reads, simulator.n_bases),
+            'stages': {
+                s: throughput(timer.seconds[s], simulator.n_reads, simulator.n_bases)
+                for s in self.STAGES if s in timer.seconds
+            },
+        }
+
+    def build_thread_profile(self):
+        json_path = f'{self.outdir}/{THREAD_PROFILE_FILENAME}'
+        tools = BuildThreadProfile().main(
+            resource_usage_jsonls=[run['resource_usage'] for run in self.runs],
+            json_path=json_path)
+        print(f'Thread profile written to {json_path}: {tools}', flush=True)
+
+    def write_json(self) -> str:
+        date = datetime.now().isoformat(timespec='seconds')
+        data = {
+            'label': date if self.label is None else self.label,
+            'date': date,
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'thread_profile': self.thread_profile,
+            'read_length': self.read_length,
+            'paired': self.paired,
+            'error_rate': self.error_rate,
+            'target_coverage': self.target_coverage,
+            'variant_caller': self.variant_caller,
+            'unordered_input': self.unordered_input,
+            'runs': self.runs,
+        }
+        json_path = f'{self.outdir}/{BENCHMARK_FILENAME}'
+        with open(json_path, 'w') as fh:
+            json.dump(data, fh, indent=2)
+        return json_path
+
+
+def throughput(seconds: float, reads: int, bases: int) -> Dict[str, float]:
+    return {
+        'seconds': seconds,
+        'reads_per_second': reads / seconds if seconds > 0 else float('inf'),
+        'bases_per_second': bases / seconds if seconds > 0 else float('inf'),
+    }
+
+
+def compare_benchmarks(baseline_json: str, contender_json: str) -> pd.DataFrame:
+    """
+    Per-coverage, per-threads, per-stage wall time of two benchmark json files,
+    speedup > 1 means the contender is faster
+    """
+    seconds = []
+    for json_path in [baseline_json, contender_json]:
+        with open(json_path) as fh:
+            data = json.load(fh)
+        d = {}
+        for run in data['runs']:
+            key = (run['coverage'], run['threads'])
+            d[key + ('total',)] = run['total']['seconds']
+            for stage, t in run['stages'].items():
+                d[key + (stage,)] = t['seconds']
+        seconds.append(d)
+
+    baseline, contender = seconds
+    keys = [k for k in baseline if k in contender]
+    return pd.DataFrame(data={
+        'Coverage': [c for c, _, _ in keys],
+        'Threads': [t for _, t, _ in keys],
+        'Stage': [s for _, _, s in keys],
+        'Baseline Seconds': [baseline[k] for k in keys],
+        'Contender Seconds': [contender[k] for k in keys],
+        'Speedup': [baseline[k] / contender[k] if contender[k] > 0 else float('inf') for k in keys],
+    })
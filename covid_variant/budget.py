@@ -0,0 +1,47 @@
+from contextlib import contextmanager
+from multiprocessing.managers import SyncManager
+from typing import Optional, Iterator
+
+
+class ThreadBudget:
+    """
+    A pool of thread tokens shared by processes, backed by a multiprocessing manager
+
+    Stages of concurrently running samples reserve as many tokens as the threads they use,
+    so the total number of busy threads never exceeds the budget.
+    """
+
+    total: int
+
+    def __init__(self, manager: SyncManager, total: int):
+        self.total = total
+        self.__condition = manager.Condition()
+        self.__available = manager.Value('i', total)
+
+    def acquire(self, n: int):
+        n = min(n, self.total)
+        with self.__condition:
+            while self.__available.value < n:
+                self.__condition.wait()
+            self.__available.value -= n
+
+    def release(self, n: int):
+        n = min(n, self.total)
+        with self.__condition:
+            self.__available.value += n
+            self.__condition.notify_all()
+
+
+@contextmanager
+def reserve_threads(budget: Optional[ThreadBudget], n: int) -> Iterator[None]:
+    """
+    Hold n tokens of budget for the duration of the context, a no-op if budget is None
+    """
+    if budget is None:
+        yield
+        return
+    budget.acquire(n)
+    try:
+        yield
+    finally:
+        budget.release(n)
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+from typing import List, Iterator, Tuple, Optional
+
+
+POSITION = 'Position'
+TYPE = 'Type'
+BASE = 'Base'
+COLUMNS = [POSITION, TYPE, BASE]
+SUBSTITUTE, DELETE, INSERT = 0, 1, 2
+TYPES = ['substitute', 'delete', 'insert']  # indexed by the type codes
+
+
+class CdsEdits:
+    """
+    Compact store of the genomic edits in cds_edit.csv
+
+    positions:
+        int64, 1-based genomic position of each edit, sorted (stable, so edits at the same position keep their order)
+
+    types:
+        int8, SUBSTITUTE, DELETE or INSERT of each edit
+
+    bases:
+        uint8, the substituted or inserted bases of all edits packed into one buffer (none for deletions)
+
+    offsets:
+        int64, the bases of edit i are bases[offsets[i]:offsets[i + 1]]
+
+    order:
+        int64, the input row of each edit, such that to_df() and to_csv() keep the input order
+
+    slice() finds a genomic interval by binary search, and returns views of the arrays without copying,
+    with the packed bases shared by all slices.
+    """
+
+    positions: np.ndarray
+    types: np.ndarray
+    bases: np.ndarray
+    offsets: np.ndarray
+    order: np.ndarray
+
+    def __init__(
+            self,
+            positions: np.ndarray,
+            types: np.ndarray,
+            bases: np.ndarray,
+            offsets: np.ndarray,
+            order: Optional[np.ndarray] = None):
+        """
+        order:
+            np.arange(len(positions)) if None, i.e. the input is already sorted
+        """
+        assert len(offsets) == len(positions) + 1
+        self.positions = positions
+        self.types = types
+        self.bases = bases
+        self.offsets = offsets
+        self.order = np.arange(len(positions), dtype=np.int64) if order is None else order
+
+    @classmethod
+    def from_df(cls, df: pd.DataFrame) -> 'CdsEdits':
+        """
+        df:
+            With columns Position, Type and Base, as in cds_edit.csv
+        """
+        order = np.argsort(df[POSITION].to_numpy(dtype=np.int64), kind='stable')
+        positions = df[POSITION].to_numpy(dtype=np.int64)[order]
+        types = np.array([TYPES.index(t) for t in df[TYPE]], dtype=np.int8)[order]
+        bases = [b if isinstance(b, str) else '' for b in df[BASE]]  # NaN for deletions
+        bases = [bases[i] for i in order]
+
+        offsets = np.zeros(len(bases) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in bases], out=offsets[1:])
+        return cls(
+            positions=positions,
+            types=types,
+            bases=np.frombuffer(''.join(bases).encode(), dtype=np.uint8),
+            offsets=offsets,
+            order=order.astype(np.int64))
+
+    @classmethod
+    def read_csv(cls, csv: str) -> 'CdsEdits':
+        return cls.from_df(pd.read_csv(csv, dtype={BASE: object}))
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @property
+    def nbytes(self) -> int:
+        return self.positions.nbytes + self.types.nbytes + self.bases.nbytes + self.offsets.nbytes + self.order.nbytes
+
+    def slice(self, start: int, end: int) -> 'CdsEdits':
+        """
+        Edits within start..end, 1-based inclusive
+        """
+        i = np.searchsorted(self.positions, start, side='left')
+        j = np.searchsorted(self.positions, end, side='right')
+        return CdsEdits(
+            positions=self.positions[i:j],
+            types=self.types[i:j],
+            bases=self.bases,
+            offsets=self.offsets[i:j + 1],
+            order=self.order[i:j])
+
+    def base(self, i: int) -> str:
+        return self.bases[self.offsets[i]:self.offsets[i + 1]].tobytes().decode()
+
+    def iter_type(self, type_code: int) -> Iterator[Tuple[int, str]]:
+        """
+        Yields the position and the bases of each edit of the type
+        """
+        for i in np.flatnonzero(self.types == type_code):
+            yield int(self.positions[i]), self.base(i)
+
+    def to_df(self) -> pd.DataFrame:
+        """
+        Edits in the input order
+        """
+        rows = np.argsort(self.order, kind='stable')
+        bases: List[object] = [np.nan if self.types[i] == DELETE else self.base(i) for i in rows]
+        return pd.DataFrame(data={
+            POSITION: self.positions[rows],
+            TYPE: np.array(TYPES, dtype=object)[self.types[rows]],
+            BASE: bases,
+        }, columns=COLUMNS)
+
+    def to_csv(self, csv: str):
+        self.to_df().to_csv(csv, index=False)
@@ -0,0 +1,152 @@
+import os
+import json
+import hashlib
+from typing import List, Dict, Any, Callable, Optional, Tuple
+from .template import Processor, Settings
+
+
+CHECKPOINT_DIRNAME = 'checkpoints'
+HASH_CHUNK_SIZE = 2 ** 20
+
+
+class Checkpoint(Processor):
+    """
+    Skip a stage that was completed by a previous run with identical inputs and parameters
+
+    A stage is a method of a processor object that reads its inputs from, and writes its outputs to,
+    attributes of that object, e.g. VariantCallingPipeline.trimming() reads and sets self.fq1 and self.fq2.
+    For each completed stage, {workdir}/checkpoints/{stage}.json records
+    the SHA-256 of the input and output files, and the stage parameters.
+    A rerun in the same workdir skips the stage if the inputs, the parameters and the outputs are unchanged,
+    and restores the output attributes from the manifest.
+
+    Only active if settings.resume is True.
+    """
+
+    obj: Any
+    stage: Callable[[], None]
+    inputs: List[str]
+    outputs: List[str]
+    params: Dict[str, Any]
+
+    manifest_json: str
+
+    def __init__(self, settings: Settings):
+        super().__init__(settings=settings)
+
+    def main(
+            self,
+            obj: Any,
+            stage: Callable[[], None],
+            inputs: List[str],
+            outputs: List[str],
+            params: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        obj:
+            The object owning the stage method
+
+        stage:
+            Bound method of obj
+
+        inputs:
+            Attribute names of obj holding input file paths (or None)
+
+        outputs:
+            Attribute names of obj holding output file paths (or None), set by the stage
+
+        params:
+            JSON-serializable parameters that affect the outputs
+
+        Returns True if the stage was skipped
+        """
+
+        self.obj = obj
+        self.stage = stage
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = {} if params is None else params
+
+        if not self.settings.resume:
+            self.stage()
+            return False
+
+        self.set_manifest_json()
+        if self.is_completed():
+            self.restore_outputs()
+            self.logger.info(f'Skip {self.stage.__name__}(), which was completed with identical inputs')
+            return True
+
+        self.stage()
+        self.write_manifest()
+        return False
+
+    def set_manifest_json(self):
+        d = f'{self.workdir}/{CHECKPOINT_DIRNAME}'
+        os.makedirs(d, exist_ok=True)
+        self.manifest_json = f'{d}/{self.obj.__class__.__name__}.{self.stage.__name__}.json'
+
+    def is_completed(self) -> bool:
+        if not os.path.exists(self.manifest_json):
+            return False
+
+        with open(self.manifest_json) as fh:
+            manifest = json.load(fh)
+
+        if manifest['params'] != json.loads(json.dumps(self.params)):
+            return False
+
+        for name in self.inputs:
+            if manifest['inputs'][name]['sha256'] != get_sha256(getattr(self.obj, name)):
+                return False
+
+        for name in self.outputs:
+            item = manifest['outputs'][name]
+            if item['path'] is not None and not os.path.exists(item['path']):
+                return False
+            if item['sha256'] != get_sha256(item['path']):
+                return False
+
+        return True
+
+    def restore_outputs(self):
+        with open(self.manifest_json) as fh:
+            manifest = json.load(fh)
+        for name in self.outputs:
+            setattr(self.obj, name, manifest['outputs'][name]['path'])
+
+    def write_manifest(self):
+        manifest = {
+            'stage': f'{self.obj.__class__.__name__}.{self.stage.__name__}',
+            'inputs': {name: self.file_item(getattr(self.obj, name)) for name in self.inputs},
+            'params': self.params,
+            'outputs': {name: self.file_item(getattr(self.obj, name)) for name in self.outputs},
+        }
+        temp = f'{self.manifest_json}.tmp'
+        with open(temp, 'w') as fh:
+            json.dump(manifest, fh, indent=2)
+        os.replace(temp, self.manifest_json)  # atomic, an interrupted write never leaves a partial manifest
+
+    def file_item(self, path: Optional[str]) -> Dict[str, Optional[str]]:
+        return {'path': path, 'sha256': get_sha256(path)}
+
+
+_sha256_cache: Dict[Tuple[str, int, int], str] = {}
+
+
+def get_sha256(path: Optional[str]) -> Optional[str]:
+    """
+    Cached by path, size and modification time, so that a file passed
+    from one stage to the next is hashed only once
+    """
+    if path is None:
+        return None
+
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _sha256_cache:
+        h = hashlib.sha256()
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(HASH_CHUNK_SIZE), b''):
+                h.update(chunk)
+        _sha256_cache[key] = h.hexdigest()
+    return _sha256_cache[key]
@@ -0,0 +1,104 @@
+import os
+import re
+import pandas as pd
+from copy import copy
+from typing import List, Dict
+from .cds import CDS
+from .cds_edits import CdsEdits
+from .read_gbk_mutate import ReadGbk, Mutate
+from .process_vcf import ProcessCohortVcf
+from .compare import CompareWtMutantCdses
+from .result import ReportResult, read_covid_variant_csv
+from .batch import SummarizeResults, SUMMARY_FILENAME
+from .template import Processor, Settings
+
+
+class Cohort(Processor):
+    """
+    Post-processing of a multi-sample VCF in one process
+
+    The VCF is read once (ProcessCohortVcf), and the WT CDSes and the variant table are loaded once,
+    shared by all samples. Each sample gets its own {outdir}/{sample_id} with cds_edit.csv, mutations.csv and result.txt,
+    as a single-sample run, and all samples are summarized in {outdir}/summary.csv as in batch mode.
+
+    Sample IDs are the VCF sample names, with characters other than letters, digits, '_', '.' and '-' replaced by '_'.
+    """
+
+    vcf: str
+    gbk: str
+    covid_variant_csv: str
+    tolerate_missing: float
+
+    cds_edits: Dict[str, CdsEdits]
+    wt_cdses: List[CDS]
+    status: Dict[str, str]
+    summary_df: pd.DataFrame
+
+    def __init__(self, settings: Settings):
+        super().__init__(settings=settings)
+
+    def main(
+            self,
+            vcf: str,
+            gbk: str,
+            covid_variant_csv: str,
+            tolerate_missing: float) -> pd.DataFrame:
+
+        self.vcf = vcf
+        self.gbk = gbk
+        self.covid_variant_csv = covid_variant_csv
+        self.tolerate_missing = tolerate_missing
+
+        self.process_cohort_vcf()
+        self.read_gbk()
+        self.annotate_samples()
+        self.write_summary()
+
+        return self.summary_df
+
+    def process_cohort_vcf(self):
+        cds_edits = ProcessCohortVcf(self.settings).main(vcf=self.vcf)
+        self.cds_edits = {sample_id_of(sample): edits for sample, edits in cds_edits.items()}
+        assert len(self.cds_edits) == len(cds_edits), f'Sample names in VCF "{self.vcf}" are not unique as sample IDs'
+
+    def read_gbk(self):
+        self.wt_cdses = ReadGbk(self.settings).main(gbk=self.gbk)
+
+    def annotate_samples(self):
+        self.status = {}
+        for sample_id, cds_edits in self.cds_edits.items():
+            try:
+                self.annotate_one(sample_id=sample_id, cds_edits=cds_edits)
+                self.status[sample_id] = 'Done'
+            except Exception as e:
+                self.status[sample_id] = f'Failed: {e!r}'
+            self.logger.info(f'{sample_id}\t{self.status[sample_id]}')
+
+    def annotate_one(self, sample_id: str, cds_edits: CdsEdits):
+        settings = copy(self.settings)
+        settings.outdir = f'{self.outdir}/{sample_id}'
+        os.makedirs(settings.outdir, exist_ok=True)
+
+        cds_edits.to_csv(f'{settings.outdir}/cds_edit.csv')
+        mutant_cdses = Mutate(settings).main(
+            cdses=self.wt_cdses,
+            cds_edits=cds_edits)
+        mutation_df = CompareWtMutantCdses(settings).main(
+            wt_cdses=self.wt_cdses,
+            mutant_cdses=mutant_cdses)
+        mutation_df.to_csv(f'{settings.outdir}/mutations.csv', index=False)
+        ReportResult(settings).main(
+            mutation_df=mutation_df,
+            covid_variant_df=read_covid_variant_csv(self.covid_variant_csv),
+            tolerate_missing=self.tolerate_missing)
+
+    def write_summary(self):
+        self.summary_df = SummarizeResults().main(
+            outdir=self.outdir,
+            sample_ids=list(self.cds_edits),
+            status=self.status)
+        self.summary_df.to_csv(f'{self.outdir}/{SUMMARY_FILENAME}', index=False)
+
+
+def sample_id_of(sample: str) -> str:
+    return re.sub(r'[^\w.-]', '_', sample)
@@ -1,8 +1,11 @@
 import pandas as pd
 from typing import List, Optional
 from .cds import CDS
-from .result import ReportResult
+from .cds_edits import CdsEdits
+from .result import ReportResult, read_covid_variant_csv
 from .process_vcf import ProcessVcf
+from .checkpoint import Checkpoint
+from .budget import reserve_threads
 from .compare import CompareWtMutantCdses
 from .template import Processor, Settings
 from .pipeline import VariantCallingPipeline
@@ -19,7 +22,8 @@ class CovidVariant(Processor):
     target_coverage: float
 
     vcf: str
-    cds_edit_df: pd.DataFrame
+    cds_edit_csv: str
+    cds_edits: CdsEdits
     wt_cdses: List[CDS]
     mutant_cdses: List[CDS]
     mutation_df: pd.DataFrame
@@ -44,11 +48,12 @@ class CovidVariant(Processor):
         self.target_coverage = target_coverage
 
         self.variant_calling_pipeline()
-        self.process_vcf()
-        self.read_gbk()
-        self.mutate()
-        self.compare_wt_and_mutant_cdses()
-        self.report_result()
+        with reserve_threads(self.settings.thread_budget, 1):
+            self.process_vcf()
+            self.read_gbk()
+            self.mutate()
+            self.compare_wt_and_mutant_cdses()
+            self.report_result()
 
     def variant_calling_pipeline(self):
         self.vcf = VariantCallingPipeline(self.settings).main(
@@ -58,8 +63,18 @@ class CovidVariant(Processor):
             target_coverage=self.target_coverage)
 
     def process_vcf(self):
-        self.cds_edit_df = ProcessVcf(self.settings).main(vcf=self.vcf)
-        self.cds_edit_df.to_csv(f'{self.outdir}/cds_edit.csv', index=False)
+        skipped = Checkpoint(self.settings).main(
+            obj=self,
+            stage=self.write_cds_edit_csv,
+            inputs=['vcf'],
+            outputs=['cds_edit_csv'])
+        if skipped:
+            self.cds_edits = CdsEdits.read_csv(self.cds_edit_csv)
+
+    def write_cds_edit_csv(self):
+        self.cds_edits = ProcessVcf(self.settings).main(vcf=self.vcf)
+        self.cds_edit_csv = f'{self.outdir}/cds_edit.csv'
+        self.cds_edits.to_csv(self.cds_edit_csv)
 
     def read_gbk(self):
         self.wt_cdses = ReadGbk(self.settings).main(gbk=self.gbk)
@@ -67,7 +82,7 @@ class CovidVariant(Processor):
     def mutate(self):
         self.mutant_cdses = Mutate(self.settings).main(
             cdses=self.wt_cdses,
-            cds_edit_df=self.cds_edit_df)
+            cds_edits=self.cds_edits)
 
     def compare_wt_and_mutant_cdses(self):
         self.mutation_df = CompareWtMutantCdses(self.settings).main(
@@ -78,5 +93,5 @@ class CovidVariant(Processor):
     def report_result(self):
         ReportResult(self.settings).main(
             mutation_df=self.mutation_df,
-            covid_variant_df=pd.read_csv(self.covid_variant_csv),
+            covid_variant_df=read_covid_variant_csv(self.covid_variant_csv),
             tolerate_missing=self.tolerate_missing)
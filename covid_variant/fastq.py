@@ -0,0 +1,183 @@
+import io
+import os
+import gzip
+import numpy as np
+from typing import Tuple, List, Iterator, Optional, Union, BinaryIO
+
+
+NONE = 'none'
+GZIP = 'gzip'
+ZSTD = 'zstd'
+CODECS = [NONE, GZIP, ZSTD]
+SUFFIXES = {
+    NONE: '.fq',
+    GZIP: '.fq.gz',
+    ZSTD: '.fq.zst',
+}
+MAGIC_NUMBERS = {
+    GZIP: b'\x1f\x8b',
+    ZSTD: b'\x28\xb5\x2f\xfd',
+}
+
+
+def detect_codec(fq: str) -> str:
+    with open(fq, 'rb') as fh:
+        head = fh.read(4)
+    for codec, magic in MAGIC_NUMBERS.items():
+        if head.startswith(magic):
+            return codec
+    return NONE
+
+
+def open_fastq(
+        file: Union[str, BinaryIO],
+        mode: str = 'rb',
+        codec: Optional[str] = None,
+        level: Optional[int] = None) -> BinaryIO:
+    """
+    Open a fastq file in binary mode
+
+    file:
+        path or binary file object
+
+    mode:
+        'rb' or 'wb'
+
+    codec:
+        'none', 'gzip' or 'zstd', detected from the file content if None (read mode only)
+
+    level:
+        compression level, the codec default if None
+    """
+    assert mode in ('rb', 'wb')
+    if codec is None:
+        assert mode == 'rb' and isinstance(file, str)
+        codec = detect_codec(file)
+    assert codec in CODECS
+
+    if codec == NONE:
+        return open(file, mode) if isinstance(file, str) else file
+
+    if codec == GZIP:
+        if level is None:
+            return gzip.open(file, mode)
+        return gzip.open(file, mode, compresslevel=level)
+
+    try:
+        import zstandard
+    except ModuleNotFoundError as e:
+        raise ModuleNotFoundError('The zstandard package is required for the zstd codec') from e
+    if mode == 'rb':
+        return io.BufferedReader(zstandard.open(file, mode))  # for readline()
+    cctx = zstandard.ZstdCompressor() if level is None else zstandard.ZstdCompressor(level=level)
+    return zstandard.open(file, mode, cctx=cctx)
+
+
+class FastqReader:
+    """
+    Iterate over the records of a fastq file,
+    while keeping track of how much of the (compressed) file has been consumed
+    """
+
+    fq: str
+    compressed_size: int
+    read_bases: int
+
+    __raw: io.BufferedReader
+    __fh: BinaryIO
+
+    def __init__(self, fq: str):
+        self.fq = fq
+        self.compressed_size = os.path.getsize(fq)
+        self.read_bases = 0
+        codec = detect_codec(fq)
+        self.__raw = open(fq, 'rb')
+        self.__fh = open_fastq(self.__raw, codec=codec)
+
+    @property
+    def compressed_pos(self) -> int:
+        return self.__raw.tell()
+
+    def records(self) -> Iterator[Tuple[List[bytes], int]]:
+        """
+        Yields the four lines of each record, and the number of bases in the record
+        """
+        while True:
+            lines = [self.__fh.readline() for _ in range(4)]
+            if lines[0] == b'':
+                return
+            bases = len(lines[1].strip())
+            self.read_bases += bases
+            yield lines, bases
+
+    def close(self):
+        self.__fh.close()
+        self.__raw.close()
+
+
+class FastqBlockReader:
+    """
+    Read a fastq file in large decompressed blocks,
+    and locate record boundaries in bulk with NumPy
+
+    Each record is taken as four lines. An incomplete record at the end of the file,
+    if any, is regarded as the last record.
+    """
+
+    BLOCK_SIZE = 2 ** 22
+    NEWLINE = ord('\n')
+
+    fq: str
+    eof: bool
+
+    __fh: BinaryIO
+    __data: bytes
+    __ends: np.ndarray  # exclusive end offset of each complete record in __data
+
+    def __init__(self, fq: str):
+        self.fq = fq
+        self.eof = False
+        self.__fh = open_fastq(fq)
+        self.__data = b''
+        self.__ends = np.zeros(0, dtype=np.int64)
+
+    @property
+    def n_records(self) -> int:
+        return len(self.__ends)
+
+    def fill(self):
+        block = self.__fh.read(self.BLOCK_SIZE)
+        if block == b'':
+            self.eof = True
+            if self.__data and not self.__data.endswith(b'\n'):
+                block = b'\n'
+        self.__data = self.__data + block
+        self.__set_ends()
+
+    def __set_ends(self):
+        array = np.frombuffer(self.__data, dtype=np.uint8)
+        newlines = np.flatnonzero(array == self.NEWLINE)
+        ends = newlines[3::4] + 1
+        if self.eof and len(newlines) % 4 != 0:
+            ends = np.append(ends, len(self.__data))
+        self.__ends = ends
+
+    def take(self, keep: np.ndarray) -> bytes:
+        """
+        Consume the first len(keep) records, and return the kept ones as a single bytes object
+        """
+        n = len(keep)
+        if n == 0:
+            return b''
+        end = self.__ends[n - 1]
+        lengths = np.diff(self.__ends[:n], prepend=0)
+        array = np.frombuffer(self.__data, dtype=np.uint8, count=end)
+        kept = array[np.repeat(keep, lengths)].tobytes()
+
+        self.__data = self.__data[end:]
+        self.__ends = self.__ends[n:] - end
+
+        return kept
+
+    def close(self):
+        self.__fh.close()
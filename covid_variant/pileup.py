@@ -0,0 +1,236 @@
+import re
+import numpy as np
+from collections import Counter
+from ngslite import read_fasta
+from typing import List, Tuple, Iterable
+from .template import Processor, Settings
+
+
+CIGAR_PATTERN = re.compile(r'(\d+)([MIDNSHP=X])')
+BASES = 'ACGTN'
+BASE_CODES = np.full(256, 4, dtype=np.int64)  # A, C, G, T -> 0, 1, 2, 3, anything else -> 4
+for i, b in enumerate('ACGT'):
+    BASE_CODES[ord(b)] = i
+    BASE_CODES[ord(b.lower())] = i
+
+
+class PileupCaller(Processor):
+    """
+    In-process haploid variant caller, an alternative to bcftools mpileup | bcftools call --ploidy 1
+
+    Alignments are streamed (samtools view for BAM, or a SAM file as is),
+    bases are counted per reference position in NumPy arrays, and indels per (position, allele).
+    An allele is called if it is supported by at least MIN_ALT_DEPTH reads
+    and by more than MIN_ALT_FRACTION of the reads covering the position.
+    Indels are left-normalized, as bcftools does.
+
+    QUAL is the Phred-scaled likelihood ratio of the allele against its absence, given that k of the n reads
+    covering the position support it and each read supports a wrong allele with probability ERROR_RATE:
+        10 * log10[(1 - e)^k e^(n - k) / (e^k (1 - e)^(n - k))] = 10 * (2k - n) * log10[(1 - e) / e]
+    It grows with the support without a cap, so that conflicting variants are resolved by evidence,
+    as with the QUAL of bcftools, although the values differ.
+    """
+
+    SKIP_FLAGS = 0x4 | 0x100 | 0x200 | 0x400 | 0x800  # unmapped, secondary, QC fail, duplicate, supplementary
+    MIN_BASE_QUALITY = 13  # default of bcftools mpileup
+    MIN_ALT_DEPTH = 3
+    MIN_ALT_FRACTION = 0.5
+    ERROR_RATE = 0.01
+    CHUNK_READS = 10000  # reads whose aligned bases are counted at a time
+
+    fna: str
+    bam: str
+    vcf: str
+
+    seqname: str
+    genome: str
+    base_counts: np.ndarray  # (genome size, 5), counts of A, C, G, T, N of each position
+    deletion_diff: np.ndarray  # difference array of the number of reads with a deletion spanning each position
+    deletions: Counter  # (1-based anchor POS, deleted length) -> count
+    insertions: Counter  # (1-based anchor POS, inserted bases) -> count
+    records: List[Tuple[int, str, str, float, str]]  # POS, REF, ALT, QUAL, INFO
+
+    seqs: List[str]
+    quals: List[str]
+    blocks: List[Tuple[int, int, int]]  # 0-based reference start, offset in the joined seqs, length
+    offset: int
+
+    def __init__(self, settings: Settings):
+        super().__init__(settings=settings)
+
+    def main(self, fna: str, bam: str, vcf: str) -> str:
+        """
+        bam:
+            Sorted BAM file, or SAM file with the .sam extension
+        """
+
+        self.fna = fna
+        self.bam = bam
+        self.vcf = vcf
+
+        self.set_genome()
+        self.count()
+        self.call_variants()
+        self.write_vcf()
+
+        return self.vcf
+
+    def set_genome(self):
+        self.seqname, self.genome = read_fasta(self.fna, strip_header=True)[0]
+        size = len(self.genome)
+        self.base_counts = np.zeros((size, 5), dtype=np.int64)
+        self.deletion_diff = np.zeros(size + 1, dtype=np.int64)
+        self.deletions = Counter()
+        self.insertions = Counter()
+
+    def count(self):
+        if self.bam.endswith('.sam'):
+            with open(self.bam) as fh:
+                self.count_sam_lines(fh)
+            return
+
+        self.call_stream(args=['samtools', 'view', self.bam], consume=self.count_sam_lines, threads=1)
+
+    def count_sam_lines(self, lines: Iterable[str]):
+        self.reset_chunk()
+        for line in lines:
+            if line.startswith('@'):
+                continue
+            fields = line.split('\t', 11)
+            if int(fields[1]) & self.SKIP_FLAGS or fields[2] != self.seqname or fields[5] == '*':
+                continue
+            self.add_read(pos=int(fields[3]), cigar=fields[5], seq=fields[9], qual=fields[10].rstrip('\r\n'))
+            if len(self.seqs) == self.CHUNK_READS:
+                self.count_chunk()
+                self.reset_chunk()
+        self.count_chunk()
+
+    def reset_chunk(self):
+        self.seqs, self.quals, self.blocks, self.offset = [], [], [], 0
+
+    def add_read(self, pos: int, cigar: str, seq: str, qual: str):
+        r, q = pos - 1, 0  # 0-based reference and query positions
+        for n, op in CIGAR_PATTERN.findall(cigar):
+            n = int(n)
+            if op in 'M=X':
+                self.blocks.append((r, self.offset + q, n))
+                r += n
+                q += n
+            elif op == 'I':
+                if r > 0:  # anchored to the preceding reference base
+                    self.insertions[(r, seq[q:q + n].upper())] += 1
+                q += n
+            elif op == 'D':
+                if r > 0:
+                    self.deletions[(r, n)] += 1
+                self.deletion_diff[r] += 1
+                self.deletion_diff[min(r + n, len(self.genome))] -= 1
+                r += n
+            elif op == 'N':
+                r += n
+            elif op == 'S':
+                q += n
+
+        self.seqs.append(seq)
+        self.quals.append(qual if qual != '*' else chr(33 + self.MIN_BASE_QUALITY) * len(seq))
+        self.offset += len(seq)
+
+    def count_chunk(self):
+        if len(self.blocks) == 0:
+            return
+        seqs = np.frombuffer(''.join(self.seqs).encode(), dtype=np.uint8)
+        quals = np.frombuffer(''.join(self.quals).encode(), dtype=np.uint8)
+
+        blocks = np.array(self.blocks, dtype=np.int64)
+        lengths = blocks[:, 2]
+        block_starts = np.cumsum(lengths) - lengths
+        within = np.arange(lengths.sum()) - np.repeat(block_starts, lengths)
+        ref_idx = np.repeat(blocks[:, 0], lengths) + within
+        seq_idx = np.repeat(blocks[:, 1], lengths) + within
+
+        passed = (quals[seq_idx] - 33 >= self.MIN_BASE_QUALITY) & (ref_idx < len(self.genome))
+        ref_idx, seq_idx = ref_idx[passed], seq_idx[passed]
+        codes = BASE_CODES[seqs[seq_idx]]
+        self.base_counts += np.bincount(
+            ref_idx * 5 + codes, minlength=self.base_counts.size).reshape(self.base_counts.shape)
+
+    def call_variants(self):
+        depth = self.base_counts.sum(axis=1) + np.cumsum(self.deletion_diff)[:-1]
+        self.records = self.snv_records(depth=depth) + self.indel_records(depth=depth)
+        self.records.sort(key=lambda r: (r[0], len(r[1]) != len(r[2])))  # SNV before indel at the same POS
+
+    def snv_records(self, depth: np.ndarray) -> List[Tuple[int, str, str, float, str]]:
+        ref_codes = BASE_CODES[np.frombuffer(self.genome.encode(), dtype=np.uint8)]
+        alt_counts = self.base_counts[:, :4].copy()
+        alt_counts[ref_codes < 4, ref_codes[ref_codes < 4]] = 0
+        alt_codes = alt_counts.argmax(axis=1)
+        alt = alt_counts.max(axis=1)
+
+        called = np.flatnonzero(
+            (alt >= self.MIN_ALT_DEPTH) & (alt > self.MIN_ALT_FRACTION * np.maximum(depth, 1)))
+        records = []
+        for i in called:
+            ref_count = self.base_counts[i, ref_codes[i]]
+            records.append((
+                int(i) + 1,
+                self.genome[i].upper(),
+                BASES[alt_codes[i]],
+                self.qual(count=alt[i], depth=depth[i]),
+                f'DP={depth[i]};AD={ref_count},{alt[i]};AC=1;AN=1'))
+        return records
+
+    def indel_records(self, depth: np.ndarray) -> List[Tuple[int, str, str, float, str]]:
+        alleles = Counter()
+        for (pos, length), count in self.deletions.items():
+            alleles[self.left_normalize(pos=pos, ref=self.genome[pos - 1:pos + length], alt=self.genome[pos - 1])] += count
+        for (pos, bases), count in self.insertions.items():
+            anchor = self.genome[pos - 1]
+            alleles[self.left_normalize(pos=pos, ref=anchor, alt=anchor + bases)] += count
+
+        records = []
+        for (pos, ref, alt), count in sorted(alleles.items()):
+            dp = depth[pos - 1]
+            if count >= self.MIN_ALT_DEPTH and count > self.MIN_ALT_FRACTION * max(dp, 1):
+                records.append((pos, ref, alt, self.qual(count=count, depth=dp), f'INDEL;DP={dp};AD={dp - count},{count};AC=1;AN=1'))
+        return records
+
+    def left_normalize(self, pos: int, ref: str, alt: str) -> Tuple[int, str, str]:
+        """
+        Shift an indel, given as 1-based POS with the anchor base in both REF and ALT, to the leftmost equivalent position
+        """
+        while pos > 1 and ref[-1].upper() == alt[-1].upper():
+            anchor = self.genome[pos - 2]
+            ref, alt = anchor + ref[:-1], anchor + alt[:-1]
+            pos -= 1
+        return pos, ref, alt
+
+    def qual(self, count: int, depth: int) -> float:
+        return support_qual(count=count, depth=depth, error_rate=self.ERROR_RATE)
+
+    def write_vcf(self):
+        header = [
+            '##fileformat=VCFv4.2',
+            '##source=covid_variant.PileupCaller',
+            f'##reference=file://{self.fna}',
+            f'##contig=<ID={self.seqname},length={len(self.genome)}>',
+            '##INFO=<ID=INDEL,Number=0,Type=Flag,Description="Indicates that the variant is an INDEL.">',
+            '##INFO=<ID=DP,Number=1,Type=Integer,Description="Read depth of high-quality bases and deletions">',
+            '##INFO=<ID=AD,Number=R,Type=Integer,Description="Read depth of the reference and the alternate allele">',
+            '##INFO=<ID=AC,Number=A,Type=Integer,Description="Allele count in genotypes for each ALT allele, in the same order as listed">',
+            '##INFO=<ID=AN,Number=1,Type=Integer,Description="Total number of alleles in called genotypes">',
+            '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+            '\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT', self.bam]),
+        ]
+        with open(self.vcf, 'w') as fh:
+            for line in header:
+                fh.write(line + '\n')
+            for pos, ref, alt, qual, info in self.records:
+                fh.write('\t'.join([self.seqname, str(pos), '.', ref, alt, str(qual), '.', info, 'GT', '1']) + '\n')
+
+
+def support_qual(count: int, depth: int, error_rate: float) -> float:
+    """
+    Phred-scaled likelihood ratio of an allele supported by count of depth reads, see PileupCaller
+    """
+    e = error_rate
+    return round(10 * (2 * int(count) - int(depth)) * np.log10((1 - e) / e), 2)
@@ -1,12 +1,31 @@
-import gzip
+import os
+import json
 import random
+import signal
+import shutil
 import os.path
-from typing import Tuple, Optional
-from ngslite import read_genbank, write_fasta
-from .template import Processor, Settings
+import hashlib
+import tempfile
+import itertools
+import subprocess
+import numpy as np
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Tuple, Optional, List, Dict, Iterator, BinaryIO
+from ngslite import write_fasta
+from .pileup import PileupCaller
+from .reference import LoadReference
+from .budget import reserve_threads
+from .threads import load_thread_profile
+from .checkpoint import Checkpoint
+from .workdir import WORKDIR_USAGE_FILENAME
+from .template import Processor, Settings, exit_code
+from .fastq import FastqReader, FastqBlockReader, open_fastq, SUFFIXES
 
 
 LOG_FILENAME = 'variant_calling_pipeline.log'
+SORT_TEMP_USAGE_FILENAME = 'sort_temp_usage.json'
 
 
 class VariantCallingPipeline(Processor):
@@ -19,6 +38,7 @@ class VariantCallingPipeline(Processor):
     fna: str
     bam: str
     vcf: str
+    bytes_written: Dict[str, int]  # stage -> growth of the workdir
 
     def __init__(self, settings: Settings):
         super().__init__(settings=settings)
@@ -34,19 +54,108 @@ class VariantCallingPipeline(Processor):
         self.fq1 = fq1
         self.fq2 = fq2
         self.target_coverage = target_coverage
-
-        self.write_fna()
-        self.trimming()
-        self.sampling()
-        self.mapping()
-        self.variant_calling()
+        self.bytes_written = {}
+
+        self.checkpoint(
+            stage=self.write_fna,
+            inputs=['gbk'],
+            outputs=['fna'])
+        if self.settings.unordered_input and self.target_coverage != float('inf'):
+            self.checkpoint(
+                stage=self.early_stop_trimming,
+                inputs=['gbk', 'fq1', 'fq2'],
+                outputs=['fq1', 'fq2'],
+                params={
+                    'target_coverage': self.target_coverage,
+                    'intermediate_codec': self.settings.intermediate_codec,
+                    'compression_level': self.settings.compression_level,
+                })
+        else:
+            self.trimming_and_sampling()
+        self.checkpoint(
+            stage=self.mapping,
+            inputs=['fna', 'fq1', 'fq2'],
+            outputs=['bam'])
+        self.checkpoint(
+            stage=self.variant_calling,
+            inputs=['fna', 'bam'],
+            outputs=['vcf'],
+            params={'variant_caller': self.settings.variant_caller})
+        self.write_workdir_usage()
 
         return self.vcf
 
+    def trimming_and_sampling(self):
+        self.checkpoint(
+            stage=self.trimming,
+            inputs=['fq1', 'fq2'],
+            outputs=['fq1', 'fq2'],
+            params={
+                'intermediate_codec': self.settings.intermediate_codec,
+                'compression_level': self.settings.compression_level,
+            })
+        self.checkpoint(
+            stage=self.sampling,
+            inputs=['gbk', 'fq1', 'fq2'],
+            outputs=['fq1', 'fq2'],
+            params={
+                'target_coverage': self.target_coverage,
+                'single_pass_sampling': self.settings.single_pass_sampling,
+                'sampling_scheme': self.settings.sampling_scheme,
+                'depth_normalization': self.settings.depth_normalization,
+                'intermediate_codec': self.settings.intermediate_codec,
+                'compression_level': self.settings.compression_level,
+            })
+
+    def checkpoint(self, **kwargs) -> bool:
+        stage = kwargs['stage'].__name__
+        threads = self.stage_threads(stage=stage)
+        size = get_dir_size(self.workdir)
+        with reserve_threads(self.settings.thread_budget, threads):
+            skipped = Checkpoint(self.settings).main(obj=self, **kwargs)
+        self.bytes_written[stage] = get_dir_size(self.workdir) - size
+        self.logger.info(f'{stage}() wrote {self.bytes_written[stage]} bytes to the workdir ({self.settings.workdir_backend})')
+        return skipped
+
+    def write_workdir_usage(self):
+        """
+        Bytes written by each stage is measured as the growth of the workdir,
+        which is exact as long as stages do not delete files from the workdir
+        """
+        data = {
+            'workdir': self.workdir,
+            'backend': self.settings.workdir_backend,
+            'bytes_written': self.bytes_written,
+            'total_bytes': get_dir_size(self.workdir),
+        }
+        with open(f'{self.outdir}/{WORKDIR_USAGE_FILENAME}', 'w') as fh:
+            json.dump(data, fh, indent=2)
+
+    def stage_threads(self, stage: str) -> int:
+        """
+        Number of threads a stage keeps busy, reserved from the thread budget of pipelined batch mode,
+        so that threads a tool cannot use according to the thread profile are left to other samples
+        """
+        if stage in ['trimming', 'early_stop_trimming']:
+            return self.tool_threads('cutadapt')
+        if stage == 'mapping' and self.settings.stream_mapping:
+            return max(self.tool_threads('bowtie2-build'), sum(stream_mapping_threads(self.settings)))  # bowtie2 and samtools sort run concurrently
+        if stage == 'mapping':
+            return max(self.tool_threads(t) for t in ['bowtie2-build', 'bowtie2', 'samtools view', 'samtools sort'])
+        if stage == 'sampling' and self.settings.sampling_scheme == 'hash':
+            return self.threads
+        if stage == 'variant_calling':
+            if self.settings.variant_caller == 'pileup':
+                return 1
+            if self.settings.calling_regions > 1:
+                return self.threads
+            return self.tool_threads('bcftools')
+        return 1
+
     def write_fna(self):
         self.fna = f'{self.workdir}/genome.fna'
-        chromsome = read_genbank(file=self.gbk)[0]
-        data = {chromsome.seqname: chromsome.sequence}
+        reference = LoadReference(self.settings).main(gbk=self.gbk)
+        data = {reference.seqname: reference.sequence}
         write_fasta(data=data, file=self.fna)
 
     def trimming(self):
@@ -57,6 +166,19 @@ class VariantCallingPipeline(Processor):
             self.fq1, self.fq2 = TrimmingPaired(self.settings).main(
                 fq1=self.fq1, fq2=self.fq2)
 
+    def early_stop_trimming(self):
+        if self.fq2 is None:
+            self.fq1 = EarlyStopTrimmingUnpaired(self.settings).main(
+                gbk=self.gbk,
+                fq=self.fq1,
+                target_coverage=self.target_coverage)
+        else:
+            self.fq1, self.fq2 = EarlyStopTrimmingPaired(self.settings).main(
+                gbk=self.gbk,
+                fq1=self.fq1,
+                fq2=self.fq2,
+                target_coverage=self.target_coverage)
+
     def sampling(self):
         if self.fq2 is None:
             self.fq1 = SamplingUnpaired(self.settings).main(
@@ -97,6 +219,20 @@ class Trimming(Processor):
     def __init__(self, settings: Settings):
         super().__init__(settings=settings)
 
+    @property
+    def suffix(self) -> str:
+        return SUFFIXES[self.settings.intermediate_codec]
+
+    @property
+    def compression_option(self) -> str:
+        """
+        The output codec of cutadapt is determined by the file name suffix
+        """
+        level = self.settings.compression_level
+        if level is not None:
+            return f'--compression-level {level}'
+        return '-Z'  # compression level 1
+
 
 class TrimmingUnpaired(Trimming):
 
@@ -114,21 +250,21 @@ class TrimmingUnpaired(Trimming):
 
         self.set_trimmed_fq()
         self.set_cmd()
-        self.call(self.cmd)
+        self.call(self.cmd, threads=self.tool_threads('cutadapt'))
 
         return self.trimmed_fq
 
     def set_trimmed_fq(self):
-        self.trimmed_fq = f'{self.workdir}/trimmed.fq.gz'
+        self.trimmed_fq = f'{self.workdir}/trimmed{self.suffix}'
 
     def set_cmd(self):
         self.cmd = f'''\
 cutadapt \\
---cores {self.threads} \\
+--cores {self.tool_threads('cutadapt')} \\
 --error-rate {self.ERROR_RATE} \\
 --quality-cutoff {self.QUALITY_CUTOFF} \\
 --trim-n \\
--Z \\
+{self.compression_option} \\
 -a {self.READ1_ADAPTER} \\
 -o {self.trimmed_fq} \\
 {self.fq} \\
@@ -155,22 +291,22 @@ class TrimmingPaired(Trimming):
 
         self.set_trimmed_fq1_fq2()
         self.set_cmd()
-        self.call(self.cmd)
+        self.call(self.cmd, threads=self.tool_threads('cutadapt'))
 
         return self.trimmed_fq1, self.trimmed_fq2
 
     def set_trimmed_fq1_fq2(self):
-        self.trimmed_fq1 = f'{self.workdir}/trimmed.1.fq.gz'
-        self.trimmed_fq2 = f'{self.workdir}/trimmed.2.fq.gz'
+        self.trimmed_fq1 = f'{self.workdir}/trimmed.1{self.suffix}'
+        self.trimmed_fq2 = f'{self.workdir}/trimmed.2{self.suffix}'
 
     def set_cmd(self):
         self.cmd = f'''\
 cutadapt \\
---cores {self.threads} \\
+--cores {self.tool_threads('cutadapt')} \\
 --error-rate {self.ERROR_RATE} \\
 --quality-cutoff {self.QUALITY_CUTOFF} \\
 --trim-n \\
--Z \\
+{self.compression_option} \\
 -a {self.READ1_ADAPTER} \\
 -A {self.READ2_ADAPTER} \\
 -o {self.trimmed_fq1} \\
@@ -181,9 +317,151 @@ cutadapt \\
 2>> {self.workdir}/{LOG_FILENAME}'''
 
 
+class EarlyStopTrimming(Trimming):
+    """
+    Trimming and sampling in one streaming pass, for reads in random order with respect to the genome
+
+    cutadapt writes trimmed reads (interleaved if paired) to stdout, which are kept
+    until the trimmed bases reach the target coverage. cutadapt is then terminated,
+    so the rest of the input is never read. cutadapt runs in its own session, and the whole
+    process group is signaled, so that its worker processes (--cores > 1) are terminated as well.
+    """
+
+    gbk: str
+    target_coverage: float
+
+    target_bases: int
+    kept_bases: int
+    stopped: bool
+
+    def __init__(self, settings: Settings):
+        super().__init__(settings=settings)
+
+    def set_target_bases(self):
+        genome_size = len(LoadReference(self.settings).main(gbk=self.gbk).sequence)
+        self.target_bases = int(self.target_coverage * genome_size)
+
+    def stream(self, args: List[str], trimmed_fqs: List[str]):
+        """
+        args:
+            cutadapt command, which writes trimmed reads to stdout
+
+        trimmed_fqs:
+            Trimmed records are written to these files in turn, i.e. de-interleaved if more than one
+        """
+        cmd = ' '.join(args)
+        self.logger.debug(cmd)
+        if self.mock:
+            return
+
+        self.kept_bases, self.stopped = 0, False
+        writers = [
+            open_fastq(fq, mode='wb', codec=self.settings.intermediate_codec, level=self.settings.compression_level)
+            for fq in trimmed_fqs
+        ]
+
+        start = datetime.now()
+        with open(f'{self.workdir}/{LOG_FILENAME}', 'a') as log:
+            process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=log, start_new_session=True)
+            while not self.stopped:
+                records = [[process.stdout.readline() for _ in range(4)] for _ in writers]
+                if records[-1][3] == b'':
+                    break
+                for writer, lines in zip(writers, records):
+                    writer.write(b''.join(lines))
+                    self.kept_bases += len(lines[1].rstrip())
+                self.stopped = self.kept_bases >= self.target_bases
+            if self.stopped:
+                try:
+                    os.killpg(process.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            process.stdout.close()
+            _, status, rusage = os.wait4(process.pid, 0)
+        returncode = exit_code(status)
+        self.write_resource_usage(
+            cmd=cmd, start=start, rusage=rusage, returncode=returncode, threads=self.tool_threads('cutadapt'))
+
+        for writer in writers:
+            writer.close()
+
+        if not self.stopped and returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
+        self.report()
+
+    def report(self):
+        coverage = self.kept_bases / self.target_bases * self.target_coverage
+        if self.stopped:
+            self.logger.info(f'Stopped reading input at coverage {coverage:.1f} of trimmed reads')
+        else:
+            self.logger.info(f'Input coverage {coverage:.1f} of trimmed reads is below the target coverage {self.target_coverage}')
+
+    def base_args(self) -> List[str]:
+        return [
+            'cutadapt',
+            '--cores', str(self.tool_threads('cutadapt')),
+            '--error-rate', str(self.ERROR_RATE),
+            '--quality-cutoff', str(self.QUALITY_CUTOFF),
+            '--trim-n',
+            '-a', self.READ1_ADAPTER,
+        ]
+
+
+class EarlyStopTrimmingUnpaired(EarlyStopTrimming):
+
+    fq: str
+    trimmed_fq: str
+
+    def __init__(self, settings: Settings):
+        super().__init__(settings=settings)
+
+    def main(self, gbk: str, fq: str, target_coverage: float) -> str:
+
+        self.gbk = gbk
+        self.fq = fq
+        self.target_coverage = target_coverage
+
+        self.set_target_bases()
+        self.trimmed_fq = f'{self.workdir}/trimmed{self.suffix}'
+        self.stream(args=self.base_args() + [self.fq], trimmed_fqs=[self.trimmed_fq])
+
+        return self.trimmed_fq
+
+
+class EarlyStopTrimmingPaired(EarlyStopTrimming):
+
+    fq1: str
+    fq2: str
+    trimmed_fq1: str
+    trimmed_fq2: str
+
+    def __init__(self, settings: Settings):
+        super().__init__(settings=settings)
+
+    def main(self, gbk: str, fq1: str, fq2: str, target_coverage: float) -> Tuple[str, str]:
+
+        self.gbk = gbk
+        self.fq1 = fq1
+        self.fq2 = fq2
+        self.target_coverage = target_coverage
+
+        self.set_target_bases()
+        self.trimmed_fq1 = f'{self.workdir}/trimmed.1{self.suffix}'
+        self.trimmed_fq2 = f'{self.workdir}/trimmed.2{self.suffix}'
+        args = self.base_args() + ['-A', self.READ2_ADAPTER, '--interleaved', self.fq1, self.fq2]
+        self.stream(args=args, trimmed_fqs=[self.trimmed_fq1, self.trimmed_fq2])
+
+        return self.trimmed_fq1, self.trimmed_fq2
+
+
 class Sampling(Processor):
 
     RANDOM_SEED = 1
+    PREFIX_RECORDS = 10000  # records read before the first single-pass fraction estimate
+    UPDATE_INTERVAL = 1000  # records between single-pass fraction updates
+    TOLERANCE = 0.05  # relative deviation from the target coverage corrected by a second pass in single-pass mode
+    KMER_SIZE = 21  # for locating reads in depth normalization
+    NORMALIZATION_WINDOW = 200  # bp, depth normalization caps the read bases of each window
 
     gbk: str
     target_coverage: float
@@ -192,10 +470,287 @@ class Sampling(Processor):
     total_read_bases: int
     fraction: float
 
+    kmer_positions: Dict[bytes, int]
+    windows: np.ndarray  # window of each record (or pair), the last window for unplaced records
+    window_fractions: np.ndarray
+
     def __init__(self, settings: Settings):
         super().__init__(settings=settings)
         random.seed(self.RANDOM_SEED)
 
+    @property
+    def suffix(self) -> str:
+        return SUFFIXES[self.settings.intermediate_codec]
+
+    def open_output(self, fq: str) -> BinaryIO:
+        return open_fastq(
+            fq,
+            mode='wb',
+            codec=self.settings.intermediate_codec,
+            level=self.settings.compression_level)
+
+    def block_sampling(
+            self,
+            fqs: List[str],
+            sub_fqs: List[str],
+            fractions: Optional[np.ndarray] = None):
+        """
+        Sampling scheme v2
+
+        Reads are decompressed in large blocks, keep/drop decisions are drawn
+        for all complete records (or pairs) of a block at once from a seeded NumPy generator,
+        and kept records are written with one write per block.
+        For the same seed, the sampled reads differ from those of the v1 scheme.
+
+        fractions:
+            Sampling fraction of each record (or pair), self.fraction for all records if None
+        """
+        rng = np.random.default_rng(self.RANDOM_SEED)
+        readers = [FastqBlockReader(fq) for fq in fqs]
+        writers = [self.open_output(sub_fq) for sub_fq in sub_fqs]
+
+        i = 0
+        while True:
+            for reader in readers:
+                if not reader.eof:
+                    reader.fill()
+            n = min(reader.n_records for reader in readers)
+            if n == 0:
+                if all(reader.eof for reader in readers):
+                    break
+                continue
+            fraction = self.fraction if fractions is None else fractions[i:i + n]
+            keep = rng.random(n) <= fraction
+            i += n
+            for reader, writer in zip(readers, writers):
+                writer.write(reader.take(keep))
+
+        for f in readers + writers:
+            f.close()
+
+    def single_pass_sampling(self, fqs: List[str], sub_fqs: List[str]) -> bool:
+        """
+        Sampling in one pass over the input, with the fraction adapted on the fly by AdaptiveFraction
+
+        Nothing is written until the first record (or pair) is dropped, at which point the leading records,
+        all kept, are copied from the input. If the sampled bases end up outside TOLERANCE of the target,
+        e.g. because the bases per compressed byte change along the input, they are corrected in a second pass.
+
+        Returns False if all records are kept (the input is at or below the target coverage),
+        in which case nothing is written
+        """
+        target_bases = self.target_coverage * self.genome_size
+        if target_bases == float('inf'):
+            return False
+
+        readers = [FastqReader(fq) for fq in fqs]
+        fraction = AdaptiveFraction(
+            target_bases=target_bases,
+            compressed_size=sum(reader.compressed_size for reader in readers))
+
+        records = zip(*[reader.records() for reader in readers])
+        prefix = list(itertools.islice(records, self.PREFIX_RECORDS))
+
+        keep = bytearray()  # keep/drop decision of each record (or pair)
+        processed, kept = 0, 0
+        writers = None
+        for i, record in enumerate(itertools.chain(prefix, records)):
+            if i % self.UPDATE_INTERVAL == 0:
+                self.fraction = fraction.get(
+                    read_bases=sum(reader.read_bases for reader in readers),
+                    compressed_pos=sum(reader.compressed_pos for reader in readers),
+                    processed_bases=processed,
+                    kept_bases=kept)
+            bases = sum(b for _, b in record)
+            if random.random() <= self.fraction:
+                keep.append(1)
+                kept += bases
+                if writers is not None:
+                    for (lines, _), writer in zip(record, writers):
+                        writer.write(b''.join(lines))
+            else:
+                keep.append(0)
+                if writers is None:
+                    writers = [self.open_output(sub_fq) for sub_fq in sub_fqs]
+                    self.write_records(fqs=fqs, writers=writers, keep=keep)  # the leading records kept so far
+            processed += bases
+
+        for f in readers + (writers or []):
+            f.close()
+
+        if processed <= target_bases:  # some records may have been dropped before the total was known
+            for sub_fq in sub_fqs:
+                if os.path.exists(sub_fq):
+                    os.remove(sub_fq)
+            self.report_sampled_coverage(total_bases=processed, kept_bases=processed)
+            return False
+
+        if abs(kept - target_bases) > self.TOLERANCE * target_bases:
+            kept = self.correct_sampling(fqs=fqs, sub_fqs=sub_fqs, keep=keep, total_bases=processed, kept_bases=kept)
+        elif writers is None:
+            self.report_sampled_coverage(total_bases=processed, kept_bases=kept)
+            return False
+
+        self.report_sampled_coverage(total_bases=processed, kept_bases=kept)
+        return True
+
+    def write_records(self, fqs: List[str], writers: List[BinaryIO], keep: bytearray):
+        """
+        Write the records (or pairs) of the input that are kept in keep, up to the length of keep
+        """
+        readers = [FastqReader(fq) for fq in fqs]
+        records = zip(*[reader.records() for reader in readers])
+        for k, record in zip(keep, records):
+            if k:
+                for (lines, _), writer in zip(record, writers):
+                    writer.write(b''.join(lines))
+        for reader in readers:
+            reader.close()
+
+    def correct_sampling(
+            self,
+            fqs: List[str],
+            sub_fqs: List[str],
+            keep: bytearray,
+            total_bases: int,
+            kept_bases: int) -> int:
+        """
+        Second pass, now that the total read bases are known exactly
+
+        Below the target, dropped records are added back with the fraction that fills the deficit.
+        Above the target, kept records are thinned with the fraction that removes the excess.
+        The input order is kept. Returns the kept bases after correction.
+        """
+        target_bases = self.target_coverage * self.genome_size
+        self.logger.info(f'Sampled coverage {kept_bases / self.genome_size:.1f} deviates from the target coverage {self.target_coverage} by more than {self.TOLERANCE:.0%}, correct in a second pass')
+        if kept_bases < target_bases:
+            keep_kept, keep_dropped = 1., (target_bases - kept_bases) / (total_bases - kept_bases)
+        else:
+            keep_kept, keep_dropped = target_bases / kept_bases, 0.
+
+        readers = [FastqReader(fq) for fq in fqs]
+        writers = [self.open_output(sub_fq) for sub_fq in sub_fqs]
+        kept = 0
+        for k, record in zip(keep, zip(*[reader.records() for reader in readers])):
+            if random.random() <= (keep_kept if k else keep_dropped):
+                for (lines, _), writer in zip(record, writers):
+                    writer.write(b''.join(lines))
+                kept += sum(b for _, b in record)
+        for f in readers + writers:
+            f.close()
+        return kept
+
+    def report_sampled_coverage(self, total_bases: int, kept_bases: int):
+        target_bases = self.target_coverage * self.genome_size
+        coverage = kept_bases / self.genome_size
+        if total_bases < target_bases:
+            self.logger.info(f'Input coverage {coverage:.1f} is below the target coverage {self.target_coverage}')
+        elif abs(kept_bases - target_bases) > self.TOLERANCE * target_bases:
+            self.logger.info(f'WARNING! Sampled coverage {coverage:.1f} deviates from the target coverage {self.target_coverage} by more than {self.TOLERANCE:.0%}')
+        else:
+            self.logger.info(f'Sampled coverage: {coverage:.1f}')
+
+    def hash_sampling(self, fqs: List[str], sub_fqs: List[str]):
+        """
+        Sampling scheme hash
+
+        A record is kept if the seeded hash of its read name (without the /1 or /2 suffix)
+        falls below the fraction, so the decision depends neither on the record order
+        nor on the other file of a pair. Blocks of records are sampled by a pool of worker processes,
+        with at most 2 blocks per worker in flight, and written in the input order.
+        The output is identical for any number of workers.
+        """
+        with ProcessPoolExecutor(max_workers=self.threads) as executor:
+            for fq, sub_fq in zip(fqs, sub_fqs):
+                reader = FastqBlockReader(fq)
+                writer = self.open_output(sub_fq)
+                futures = deque()
+                for block in iter_blocks(reader):
+                    futures.append(executor.submit(
+                        hash_sample_block, block, self.fraction, self.RANDOM_SEED))
+                    if len(futures) >= 2 * self.threads:
+                        writer.write(futures.popleft().result())
+                while futures:
+                    writer.write(futures.popleft().result())
+                reader.close()
+                writer.close()
+
+    def depth_normalization(self, fqs: List[str], sub_fqs: List[str]) -> bool:
+        """
+        Cap the read bases of each genome window at the target coverage, instead of
+        sampling all reads with a single genome-wide fraction,
+        such that deep amplicons are thinned while weak amplicons are kept in full
+
+        In a first pass, each read (read 1, or read 2 if read 1 is not placed) is placed in a window
+        by looking up a few of its k-mers among the unique k-mers of the genome.
+        Unplaced reads are sampled with the genome-wide fraction.
+
+        Returns False if no window exceeds the target coverage, in which case nothing is written
+        """
+        self.set_kmer_positions()
+        self.set_windows(fqs=fqs)
+        if np.all(self.window_fractions >= 1.):
+            return False
+        self.block_sampling(fqs=fqs, sub_fqs=sub_fqs, fractions=self.window_fractions[self.windows])
+        return True
+
+    def set_kmer_positions(self):
+        sequence = LoadReference(self.settings).main(gbk=self.gbk).sequence.upper().encode()
+        self.genome_size = len(sequence)
+        reverse_complement = sequence[::-1].translate(bytes.maketrans(b'ACGT', b'TGCA'))
+
+        k = self.KMER_SIZE
+        positions, repeats = {}, set()
+        for i in range(len(sequence) - k + 1):
+            j = len(sequence) - k - i  # the reverse complement kmer starting at i
+            for kmer in [sequence[i:i + k], reverse_complement[j:j + k]]:
+                if kmer in positions:
+                    repeats.add(kmer)
+                positions[kmer] = i
+        for kmer in repeats:
+            del positions[kmer]
+        self.kmer_positions = positions
+
+    def locate(self, seq: bytes) -> Optional[int]:
+        k = self.KMER_SIZE
+        for start in [0, (len(seq) - k) // 2, len(seq) - k]:
+            pos = self.kmer_positions.get(seq[start:start + k])
+            if pos is not None:
+                return pos
+        return None
+
+    def set_windows(self, fqs: List[str]):
+        n_windows = self.genome_size // self.NORMALIZATION_WINDOW + 1
+        unplaced = n_windows
+
+        readers = [FastqReader(fq) for fq in fqs]
+        windows, bases = [], []
+        for records in zip(*[reader.records() for reader in readers]):
+            pos = None
+            for lines, _ in records:
+                pos = self.locate(lines[1].rstrip())
+                if pos is not None:
+                    break
+            windows.append(unplaced if pos is None else pos // self.NORMALIZATION_WINDOW)
+            bases.append(sum(b for _, b in records))
+        for reader in readers:
+            reader.close()
+
+        self.windows = np.array(windows, dtype=np.int64)
+        window_bases = np.bincount(self.windows, weights=bases, minlength=n_windows + 1)
+
+        target = self.target_coverage * self.NORMALIZATION_WINDOW
+        with np.errstate(divide='ignore'):
+            fractions = np.minimum(target / window_bases, 1.)
+        total = window_bases.sum()
+        fractions[unplaced] = min(self.target_coverage * self.genome_size / total, 1.) if total > 0 else 1.
+        self.window_fractions = fractions
+
+        n_capped = int(np.sum(fractions[:unplaced] < 1.))
+        kept = np.sum(window_bases * fractions)
+        self.logger.info(f'Depth normalization: {n_capped} of {n_windows} windows capped at {self.target_coverage}x, {window_bases[unplaced] / max(total, 1):.1%} of read bases unplaced')
+        self.logger.info(f'Expected coverage after depth normalization: {kept / self.genome_size:.1f}')
+
     def set_fraction(self):
         self.set_total_read_bases()
         self.set_genome_size()
@@ -207,7 +762,7 @@ class Sampling(Processor):
         pass
 
     def set_genome_size(self):
-        self.genome_size = len(read_genbank(self.gbk)[0].sequence)
+        self.genome_size = len(LoadReference(self.settings).main(gbk=self.gbk).sequence)
 
 
 class SamplingUnpaired(Sampling):
@@ -215,8 +770,8 @@ class SamplingUnpaired(Sampling):
     fq: str
     sub_fq: str
 
-    __fq: gzip.GzipFile
-    __sub_fq: gzip.GzipFile
+    __fq: BinaryIO
+    __sub_fq: BinaryIO
 
     def __init__(self, settings: Settings):
         super().__init__(settings=settings)
@@ -231,24 +786,40 @@ class SamplingUnpaired(Sampling):
         self.fq = fq
         self.target_coverage = target_coverage
 
+        if self.settings.depth_normalization:
+            self.set_sub_fq()
+            normalized = self.depth_normalization(fqs=[self.fq], sub_fqs=[self.sub_fq])
+            return self.sub_fq if normalized else self.fq
+
+        if self.settings.single_pass_sampling:
+            self.set_genome_size()
+            self.set_sub_fq()
+            sampled = self.single_pass_sampling(fqs=[self.fq], sub_fqs=[self.sub_fq])
+            return self.sub_fq if sampled else self.fq
+
         self.set_fraction()
         if self.fraction >= 1.:
             return self.fq
         self.set_sub_fq()
-        self.random_sampling()
+        if self.settings.sampling_scheme == 'v2':
+            self.block_sampling(fqs=[self.fq], sub_fqs=[self.sub_fq])
+        elif self.settings.sampling_scheme == 'hash':
+            self.hash_sampling(fqs=[self.fq], sub_fqs=[self.sub_fq])
+        else:
+            self.random_sampling()
 
         return self.sub_fq
 
     def set_total_read_bases(self):
         t = 0
-        with gzip.open(self.fq) as fh:
+        with open_fastq(self.fq) as fh:
             for i, line in enumerate(fh):
                 if i % 4 == 1:
                     t += len(line.strip())
         self.total_read_bases = t
 
     def set_sub_fq(self):
-        self.sub_fq = f'{self.workdir}/subsampled.fq.gz'
+        self.sub_fq = f'{self.workdir}/subsampled{self.suffix}'
 
     def random_sampling(self):
         self.__open_files()
@@ -269,8 +840,8 @@ class SamplingUnpaired(Sampling):
         self.__close_files()
 
     def __open_files(self):
-        self.__fq = gzip.open(self.fq)
-        self.__sub_fq = gzip.open(self.sub_fq, mode='wb')
+        self.__fq = open_fastq(self.fq)
+        self.__sub_fq = self.open_output(self.sub_fq)
 
     def __close_files(self):
         for f in [self.__fq, self.__sub_fq]:
@@ -284,10 +855,10 @@ class SamplingPaired(Sampling):
     sub_fq1: str
     sub_fq2: str
 
-    __fq1: gzip.GzipFile
-    __fq2: gzip.GzipFile
-    __sub_fq1: gzip.GzipFile
-    __sub_fq2: gzip.GzipFile
+    __fq1: BinaryIO
+    __fq2: BinaryIO
+    __sub_fq1: BinaryIO
+    __sub_fq2: BinaryIO
 
     def __init__(self, settings: Settings):
         super().__init__(settings=settings)
@@ -304,26 +875,43 @@ class SamplingPaired(Sampling):
         self.fq2 = fq2
         self.target_coverage = target_coverage
 
+        if self.settings.depth_normalization:
+            self.set_sub_fq1_fq2()
+            normalized = self.depth_normalization(
+                fqs=[self.fq1, self.fq2], sub_fqs=[self.sub_fq1, self.sub_fq2])
+            return (self.sub_fq1, self.sub_fq2) if normalized else (self.fq1, self.fq2)
+
+        if self.settings.single_pass_sampling:
+            self.set_genome_size()
+            self.set_sub_fq1_fq2()
+            sampled = self.single_pass_sampling(fqs=[self.fq1, self.fq2], sub_fqs=[self.sub_fq1, self.sub_fq2])
+            return (self.sub_fq1, self.sub_fq2) if sampled else (self.fq1, self.fq2)
+
         self.set_fraction()
         if self.fraction >= 1.:
             return self.fq1, self.fq2
         self.set_sub_fq1_fq2()
-        self.random_sampling()
+        if self.settings.sampling_scheme == 'v2':
+            self.block_sampling(fqs=[self.fq1, self.fq2], sub_fqs=[self.sub_fq1, self.sub_fq2])
+        elif self.settings.sampling_scheme == 'hash':
+            self.hash_sampling(fqs=[self.fq1, self.fq2], sub_fqs=[self.sub_fq1, self.sub_fq2])
+        else:
+            self.random_sampling()
 
         return self.sub_fq1, self.sub_fq2
 
     def set_total_read_bases(self):
         t = 0
         for fq in [self.fq1, self.fq2]:
-            with gzip.open(fq) as fh:
+            with open_fastq(fq) as fh:
                 for i, line in enumerate(fh):
                     if i % 4 == 1:
                         t += len(line.strip())
         self.total_read_bases = t
 
     def set_sub_fq1_fq2(self):
-        self.sub_fq1 = f'{self.workdir}/subsampled.1.fq.gz'
-        self.sub_fq2 = f'{self.workdir}/subsampled.2.fq.gz'
+        self.sub_fq1 = f'{self.workdir}/subsampled.1{self.suffix}'
+        self.sub_fq2 = f'{self.workdir}/subsampled.2{self.suffix}'
 
     def random_sampling(self):
         self.__open_files()
@@ -346,61 +934,284 @@ class SamplingPaired(Sampling):
         self.__close_files()
 
     def __open_files(self):
-        self.__fq1 = gzip.open(self.fq1)
-        self.__fq2 = gzip.open(self.fq2)
-        self.__sub_fq1 = gzip.open(self.sub_fq1, mode='wb')
-        self.__sub_fq2 = gzip.open(self.sub_fq2, mode='wb')
+        self.__fq1 = open_fastq(self.fq1)
+        self.__fq2 = open_fastq(self.fq2)
+        self.__sub_fq1 = self.open_output(self.sub_fq1)
+        self.__sub_fq2 = self.open_output(self.sub_fq2)
 
     def __close_files(self):
         for f in [self.__fq1, self.__fq2, self.__sub_fq1, self.__sub_fq2]:
             f.close()
 
 
+def iter_blocks(reader: FastqBlockReader) -> Iterator[bytes]:
+    """
+    Yields the complete records of each decompressed block
+    """
+    while not reader.eof:
+        reader.fill()
+        if reader.n_records > 0:
+            yield reader.take(np.ones(reader.n_records, dtype=bool))
+
+
+def hash_sample_block(block: bytes, fraction: float, seed: int) -> bytes:
+    """
+    Keep the records in block whose seeded read name hash is below fraction
+    """
+    key = seed.to_bytes(8, 'little')
+    threshold = fraction * 2 ** 64
+    lines = block.split(b'\n')
+    kept = []
+    for i in range(0, len(lines) - 3, 4):
+        name = lines[i].split(maxsplit=1)[0][1:]
+        if name.endswith((b'/1', b'/2')):
+            name = name[:-2]
+        h = int.from_bytes(hashlib.blake2b(name, digest_size=8, key=key).digest(), 'little')
+        if h < threshold:
+            kept.append(b'\n'.join(lines[i:i + 4]) + b'\n')
+    return b''.join(kept)
+
+
+class AdaptiveFraction:
+    """
+    Sampling fraction for a single pass over the reads
+
+    The total number of read bases is extrapolated from the bases read so far
+    and the fraction of the compressed input consumed so far.
+    The fraction is then set such that the kept bases approach the target bases
+    over the estimated remaining reads, so estimation errors made early on
+    are corrected as the estimate converges towards the end of the input.
+    """
+
+    target_bases: float
+    compressed_size: int
+
+    def __init__(self, target_bases: float, compressed_size: int):
+        self.target_bases = target_bases
+        self.compressed_size = compressed_size
+
+    def get(
+            self,
+            read_bases: int,
+            compressed_pos: int,
+            processed_bases: int,
+            kept_bases: int) -> float:
+
+        estimated_total = read_bases * self.compressed_size / max(compressed_pos, 1)
+        remaining = max(estimated_total, read_bases) - processed_bases
+        if remaining <= 0:
+            return 1.
+        fraction = (self.target_bases - kept_bases) / remaining
+        return min(max(fraction, 0.), 1.)
+
+
 class Mapping(Processor):
 
     LINE_BREAK = ' \\\n'
+    SORT_MEMORY_PER_THREAD = '768M'
 
     fna: str
     bowtie2_index: str
     sam: str
     bam: str
     sorted_bam: str
+    sort_tmpdir: str
+    peak_temp_bytes: int
 
     def __init__(self, settings: Settings):
         super().__init__(settings=settings)
 
     def indexing(self):
+        if self.settings.index_cache_dir is not None:
+            self.bowtie2_index = Bowtie2IndexCache(self.settings).main(fna=self.fna)
+            return
+
         self.bowtie2_index = f'{self.workdir}/{os.path.basename(self.fna)}'
+        threads = self.tool_threads('bowtie2-build')
         args = [
             'bowtie2-build',
-            f'--threads {self.threads}',
+            f'--threads {threads}',
             self.fna,
             self.bowtie2_index,
             f'1>> {self.workdir}/{LOG_FILENAME}',
             f'2>> {self.workdir}/{LOG_FILENAME}',
         ]
         cmd = self.LINE_BREAK.join(args)
-        self.call(cmd)
+        self.call(cmd, threads=threads)
 
     def sam_to_bam(self):
         self.bam = f'{self.workdir}/aligned.bam'
+        threads = self.tool_threads('samtools view')
         args = [
             'samtools view -b -h',
+            f'-@ {threads}',
             f'-o {self.bam}',
             self.sam
         ]
         cmd = self.LINE_BREAK.join(args)
-        self.call(cmd)
+        self.call(cmd, threads=threads)
 
     def sort_bam(self):
         self.sorted_bam = f'{self.outdir}/aligned_sorted.bam'
+        threads = self.tool_threads('samtools sort')
         args = [
             'samtools sort',
+            f'-@ {threads}',
             f'-o {self.sorted_bam}',
             self.bam
         ]
         cmd = self.LINE_BREAK.join(args)
-        self.call(cmd)
+        self.call(cmd, threads=threads)
+
+    def stream_mapping(self, read_args: List[str]):
+        """
+        Pipe the SAM output of bowtie2 directly into samtools sort,
+        so that neither aligned.sam nor aligned.bam is written to disk
+
+        samtools sort holds at most SORT_MEMORY_PER_THREAD per thread in memory,
+        and spills the rest into temporary files in sort_tmpdir, whose peak size is written to
+        {outdir}/sort_temp_usage.json
+
+        bowtie2 and samtools sort run concurrently, with threads split by stream_mapping_threads()
+
+        The pipeline runs with pipefail, so that it fails if bowtie2 fails,
+        even though samtools sort still writes a valid BAM of the reads aligned so far
+        """
+        self.sorted_bam = f'{self.outdir}/aligned_sorted.bam'
+        self.sort_tmpdir = f'{self.workdir}/sort_tmp'
+        os.makedirs(self.sort_tmpdir, exist_ok=True)
+        bowtie2_threads, sort_threads = stream_mapping_threads(self.settings)
+        args = [
+            'bowtie2',
+            f'--threads {bowtie2_threads}',
+            f'-x {self.bowtie2_index}',
+        ] + read_args + [
+            f'2>> {self.workdir}/{LOG_FILENAME}',
+            '|',
+            'samtools sort',
+            f'-@ {sort_threads - 1}',  # additional to the main thread
+            f'-m {self.SORT_MEMORY_PER_THREAD}',
+            f'-T {self.sort_tmpdir}/aligned',
+            f'-o {self.sorted_bam}',
+            '-',
+            f'2>> {self.workdir}/{LOG_FILENAME}',
+        ]
+        cmd = self.LINE_BREAK.join(args)
+        self.peak_temp_bytes = 0
+        self.call(cmd, monitor=self.update_peak_temp_bytes, threads=bowtie2_threads + sort_threads, pipefail=True)
+        self.logger.info(f'Peak temporary disk usage of samtools sort: {self.peak_temp_bytes} bytes')
+        self.write_sort_temp_usage(bowtie2_threads=bowtie2_threads, sort_threads=sort_threads)
+
+    def update_peak_temp_bytes(self):
+        self.peak_temp_bytes = max(self.peak_temp_bytes, get_dir_size(self.sort_tmpdir))
+
+    def write_sort_temp_usage(self, bowtie2_threads: int, sort_threads: int):
+        data = {
+            'sort_tmpdir': self.sort_tmpdir,
+            'peak_temp_bytes': self.peak_temp_bytes,
+            'sort_memory_per_thread': self.SORT_MEMORY_PER_THREAD,
+            'bowtie2_threads': bowtie2_threads,
+            'sort_threads': sort_threads,
+        }
+        with open(f'{self.outdir}/{SORT_TEMP_USAGE_FILENAME}', 'w') as fh:
+            json.dump(data, fh, indent=2)
+
+
+def stream_mapping_threads(settings: Settings) -> Tuple[int, int]:
+    """
+    Threads of bowtie2 and of samtools sort, which run concurrently in stream mapping,
+    such that their sum stays within settings.threads (with at least one thread each)
+
+    samtools sort gets at most a quarter, as alignment takes most of the CPU time,
+    and each tool is capped by the thread profile if any
+    """
+    profile = load_thread_profile(settings.thread_profile)
+    sort_threads = profile.threads(tool='samtools sort', available=max(1, settings.threads // 4))
+    bowtie2_threads = profile.threads(tool='bowtie2', available=max(1, settings.threads - sort_threads))
+    return bowtie2_threads, sort_threads
+
+
+class Bowtie2IndexCache(Processor):
+    """
+    Persistent cache of genome.fna and its bowtie2 index, keyed by the SHA-256 of genome.fna
+
+    A cache entry is built in a private temporary directory and then renamed into place,
+    which is atomic on POSIX file systems, so that concurrent runs never see a half-built index.
+    If two runs build the same entry at the same time, the loser discards its own copy.
+    """
+
+    LINE_BREAK = ' \\\n'
+    HASH_CHUNK_SIZE = 2 ** 20
+
+    fna: str
+    cache_dir: str
+    key: str
+    entry: str
+    bowtie2_index: str
+
+    def __init__(self, settings: Settings):
+        super().__init__(settings=settings)
+
+    def main(self, fna: str) -> str:
+        self.fna = fna
+        self.cache_dir = self.settings.index_cache_dir
+
+        self.set_key()
+        self.set_entry()
+        if os.path.isdir(self.entry):
+            self.logger.info(f'Reuse cached bowtie2 index: {self.entry}')
+        else:
+            self.build_entry()
+
+        return self.bowtie2_index
+
+    def set_key(self):
+        h = hashlib.sha256()
+        with open(self.fna, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(self.HASH_CHUNK_SIZE), b''):
+                h.update(chunk)
+        self.key = h.hexdigest()
+
+    def set_entry(self):
+        self.entry = f'{self.cache_dir}/{self.key}'
+        self.bowtie2_index = f'{self.entry}/{os.path.basename(self.fna)}'
+
+    def build_entry(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmpdir = tempfile.mkdtemp(prefix=f'{self.key}.tmp.', dir=self.cache_dir)
+        try:
+            fna = f'{tmpdir}/{os.path.basename(self.fna)}'
+            shutil.copyfile(self.fna, fna)
+            threads = self.tool_threads('bowtie2-build')
+            args = [
+                'bowtie2-build',
+                f'--threads {threads}',
+                fna,
+                fna,
+                f'1>> {self.workdir}/{LOG_FILENAME}',
+                f'2>> {self.workdir}/{LOG_FILENAME}',
+            ]
+            cmd = self.LINE_BREAK.join(args)
+            self.call(cmd, threads=threads)
+            os.rename(tmpdir, self.entry)
+        except OSError:
+            if not os.path.isdir(self.entry):
+                raise
+            self.logger.info(f'Bowtie2 index was cached by a concurrent run: {self.entry}')
+        finally:
+            if os.path.exists(tmpdir):
+                shutil.rmtree(tmpdir)
+
+
+def get_dir_size(directory: str) -> int:
+    size = 0
+    for root, dirs, files in os.walk(directory):
+        for f in files:
+            try:
+                size += os.path.getsize(os.path.join(root, f))
+            except FileNotFoundError:  # temp file removed by samtools in the meantime
+                pass
+    return size
 
 
 class MappingUnpaired(Mapping):
@@ -416,17 +1227,21 @@ class MappingUnpaired(Mapping):
         self.fq = fq
 
         self.indexing()
-        self.mapping()
-        self.sam_to_bam()
-        self.sort_bam()
+        if self.settings.stream_mapping:
+            self.stream_mapping(read_args=[f'-U {self.fq}'])
+        else:
+            self.mapping()
+            self.sam_to_bam()
+            self.sort_bam()
 
         return self.sorted_bam
 
     def mapping(self):
         self.sam = f'{self.workdir}/aligned.sam'
+        threads = self.tool_threads('bowtie2')
         args = [
             'bowtie2',
-            f'--threads {self.threads}',
+            f'--threads {threads}',
             f'-x {self.bowtie2_index}',
             f'-U {self.fq}',
             f'-S {self.sam}',
@@ -434,7 +1249,7 @@ class MappingUnpaired(Mapping):
             f'2>> {self.workdir}/{LOG_FILENAME}',
         ]
         cmd = self.LINE_BREAK.join(args)
-        self.call(cmd)
+        self.call(cmd, threads=threads)
 
 
 class MappingPaired(Mapping):
@@ -452,17 +1267,21 @@ class MappingPaired(Mapping):
         self.fq2 = fq2
 
         self.indexing()
-        self.mapping()
-        self.sam_to_bam()
-        self.sort_bam()
+        if self.settings.stream_mapping:
+            self.stream_mapping(read_args=[f'-1 {self.fq1}', f'-2 {self.fq2}'])
+        else:
+            self.mapping()
+            self.sam_to_bam()
+            self.sort_bam()
 
         return self.sorted_bam
 
     def mapping(self):
         self.sam = f'{self.workdir}/aligned.sam'
+        threads = self.tool_threads('bowtie2')
         args = [
             'bowtie2',
-            f'--threads {self.threads}',
+            f'--threads {threads}',
             f'-x {self.bowtie2_index}',
             f'-1 {self.fq1}',
             f'-2 {self.fq2}',
@@ -471,12 +1290,13 @@ class MappingPaired(Mapping):
             f'2>> {self.workdir}/{LOG_FILENAME}',
         ]
         cmd = self.LINE_BREAK.join(args)
-        self.call(cmd)
+        self.call(cmd, threads=threads)
 
 
 class VariantCalling(Processor):
 
     LINE_BREAK = ' \\\n'
+    REGION_OVERLAP = 1000  # bp, longer than any read, so that every read covering a core region is piled up
 
     fna: str
     bam: str
@@ -491,35 +1311,162 @@ class VariantCalling(Processor):
         self.fna = fna
         self.bam = bam
 
-        self.variant_calling()
+        if self.settings.variant_caller == 'pileup':
+            self.pileup_variant_calling()
+        elif self.settings.calling_regions > 1:
+            self.region_parallel_variant_calling()
+        else:
+            self.variant_calling()
 
         return self.vcf
 
+    def pileup_variant_calling(self):
+        self.vcf = f'{self.outdir}/raw.vcf'
+        if not self.mock:
+            PileupCaller(self.settings).main(fna=self.fna, bam=self.bam, vcf=self.vcf)
+
     def variant_calling(self):
+        self.vcf = f'{self.outdir}/raw.vcf'
+        threads = self.tool_threads('bcftools')
+        cmd = self.mpileup_call_cmd(vcf=self.vcf, threads=threads)
+        self.call(cmd, threads=threads)
+
+    def region_parallel_variant_calling(self):
+        """
+        The genome is split into consecutive core regions, each padded by REGION_OVERLAP on both sides.
+        Padded regions are called concurrently, and a variant is kept only from the region
+        whose core contains its POS, so that variants (e.g. indels) near the boundaries
+        are neither lost nor duplicated.
+
+        The BAM and the genome are indexed once beforehand, so that the concurrent mpileup jobs
+        do not race to create the same genome.fna.fai.
+        """
+        self.vcf = f'{self.outdir}/raw.vcf'
+        self.call(f'samtools index {self.bam}')
+        self.call(f'samtools faidx {self.fna}')
+
+        seqname, length = read_fasta_seqname_length(self.fna)
+        regions = split_regions(length=length, n=self.settings.calling_regions, overlap=self.REGION_OVERLAP)
+
+        region_vcfs = [f'{self.workdir}/raw_region_{i}.vcf' for i in range(len(regions))]
+        cmds = [
+            self.mpileup_call_cmd(vcf=vcf, threads=1, region=f'{seqname}:{start}-{end}')
+            for vcf, (core_start, core_end, start, end) in zip(region_vcfs, regions)
+        ]
+        with ThreadPoolExecutor(max_workers=min(len(cmds), self.threads)) as executor:
+            list(executor.map(lambda cmd: self.call(cmd, threads=1), cmds))  # list() to raise any exception
+
+        if not self.mock:
+            MergeRegionVcfs(self.settings).main(
+                region_vcfs=region_vcfs,
+                core_regions=[(core_start, core_end) for core_start, core_end, _, _ in regions],
+                vcf=self.vcf)
+
+    def mpileup_call_cmd(self, vcf: str, threads: int, region: Optional[str] = None) -> str:
         """
         For some reason, even though --ploidy was set to 1,
         --consensus-caller (old method) still gave me diploid calling result, e.g. "A,C"
 
         I set the calling method to --multiallelic-caller (new method), and the problem got resolved
         """
-
-        self.vcf = f'{self.outdir}/raw.vcf'
         args = [
             'bcftools mpileup',
-            f'--threads {self.threads}',
+            f'--threads {threads}',
             f'--output-type u',  # uncompressed BCF
             f'--fasta-ref {self.fna}',
+        ]
+        if region is not None:
+            args.append(f'--regions {region}')
+        args += [
             self.bam,
             f'2>> {self.workdir}/{LOG_FILENAME}',
             '|',
             'bcftools call',
-            f'--threads {self.threads}',
+            f'--threads {threads}',
             '--multiallelic-caller',
             '--variants-only',
             '--ploidy 1',
             '--output-type v',  # uncompressed VCF
-            f'-o {self.vcf}',
+            f'-o {vcf}',
             f'2>> {self.workdir}/{LOG_FILENAME}'
         ]
-        cmd = self.LINE_BREAK.join(args)
-        self.call(cmd)
+        return self.LINE_BREAK.join(args)
+
+
+class MergeRegionVcfs(Processor):
+
+    region_vcfs: List[str]
+    core_regions: List[Tuple[int, int]]
+    vcf: str
+
+    def __init__(self, settings: Settings):
+        super().__init__(settings=settings)
+
+    def main(
+            self,
+            region_vcfs: List[str],
+            core_regions: List[Tuple[int, int]],
+            vcf: str):
+        """
+        region_vcfs:
+            VCF files called from padded regions, in genomic order
+
+        core_regions:
+            (start, end) of the core of each region, 1-based inclusive
+
+        vcf:
+            Output VCF, with the header of the first region VCF
+        """
+
+        self.region_vcfs = region_vcfs
+        self.core_regions = core_regions
+        self.vcf = vcf
+
+        seen = set()
+        with open(self.vcf, 'w') as writer:
+            for i, (region_vcf, (start, end)) in enumerate(zip(self.region_vcfs, self.core_regions)):
+                with open(region_vcf) as reader:
+                    for line in reader:
+                        if line.startswith('#'):
+                            if i == 0:
+                                writer.write(line)
+                            continue
+                        chrom, pos, _, ref, alt = line.split('\t', 5)[:5]
+                        key = (chrom, int(pos), ref, alt)
+                        if start <= int(pos) <= end and key not in seen:
+                            seen.add(key)
+                            writer.write(line)
+
+
+def split_regions(length: int, n: int, overlap: int) -> List[Tuple[int, int, int, int]]:
+    """
+    Returns (core_start, core_end, padded_start, padded_end) of n regions covering 1..length, 1-based inclusive
+    """
+    n = max(1, min(n, length))
+    bounds = [round(length * i / n) for i in range(n + 1)]
+    regions = []
+    for i in range(n):
+        core_start, core_end = bounds[i] + 1, bounds[i + 1]
+        regions.append((
+            core_start,
+            core_end,
+            max(1, core_start - overlap),
+            min(length, core_end + overlap)
+        ))
+    return regions
+
+
+def read_fasta_seqname_length(fna: str) -> Tuple[str, int]:
+    """
+    Name and length of the first sequence in a fasta file
+    """
+    seqname, length = None, 0
+    with open(fna) as fh:
+        for line in fh:
+            if line.startswith('>'):
+                if seqname is not None:
+                    break
+                seqname = line[1:].split()[0]
+            else:
+                length += len(line.strip())
+    return seqname, length
@@ -1,29 +1,40 @@
+import gzip
+import numpy as np
 import pandas as pd
-from typing import Union
+from typing import Union, Optional, List, Dict, Iterable, TextIO
+from .fastq import detect_codec, GZIP
+from .pileup import PileupCaller, support_qual
+from .cds_edits import CdsEdits
 from .template import Processor, Settings
 
 
 class ProcessVcf(Processor):
 
-    vcf: str
+    vcf: Union[str, TextIO]
 
     vcf_df: pd.DataFrame
     cds_edit_df: pd.DataFrame
+    cds_edits: CdsEdits
 
     def __init__(self, settings: Settings):
         super().__init__(settings=settings)
 
-    def main(self, vcf: str) -> pd.DataFrame:
+    def main(self, vcf: Union[str, TextIO]) -> CdsEdits:
+        """
+        vcf:
+            Path or text stream, see ReadVcf
+        """
         self.vcf = vcf
 
         self.read_vcf()
         self.remove_conflict_variants()
         self.vcf_df_to_cds_edit_df()
+        self.cds_edits = CdsEdits.from_df(self.cds_edit_df)
 
-        return self.cds_edit_df
+        return self.cds_edits
 
     def read_vcf(self):
-        self.vcf_df = ReadVcf(self.settings).main(vcf=self.vcf)
+        self.vcf_df = ReadVcf(self.settings).main(vcf=self.vcf, columns=RemoveConflictVariants.COLUMNS_IN)
 
     def remove_conflict_variants(self):
         self.vcf_df = RemoveConflictVariants(self.settings).main(indf=self.vcf_df)
@@ -32,38 +43,231 @@ class ProcessVcf(Processor):
         self.cds_edit_df = VcfDfToCdsEditDf(self.settings).main(vcf_df=self.vcf_df)
 
 
+class ProcessCohortVcf(Processor):
+    """
+    Process a multi-sample VCF, e.g. joint-called from a plate of samples, in one pass
+
+    The VCF is read once. For each sample, the records whose genotype (GT) carries an ALT allele
+    are taken with that allele, and conflicts are resolved and converted to CDS edits as in ProcessVcf.
+
+    Conflicts are resolved by the quality of the allele in the sample, so that samples may resolve
+    the same conflict differently: GQ if given, otherwise the support of the allele from AD
+    (against DP, or the sum of AD) scored as the QUAL of PileupCaller, otherwise the site-level QUAL.
+    """
+
+    FIRST_SAMPLE_COLUMN = 9  # after CHROM, POS, ID, REF, ALT, QUAL, FILTER, INFO, FORMAT
+
+    vcf: Union[str, TextIO]
+
+    vcf_df: pd.DataFrame
+    samples: List[str]
+    gt_indices: List[int]
+    gq_indices: List[int]
+    ad_indices: List[int]
+    dp_indices: List[int]
+    cds_edits: Dict[str, CdsEdits]
+
+    def __init__(self, settings: Settings):
+        super().__init__(settings=settings)
+
+    def main(self, vcf: Union[str, TextIO]) -> Dict[str, CdsEdits]:
+        """
+        vcf:
+            Path or text stream, see ReadVcf
+
+        Returns the CDS edits of each sample, in the order of the VCF columns
+        """
+        self.vcf = vcf
+
+        self.read_vcf()
+        self.set_format_indices()
+        self.cds_edits = {}
+        for sample in self.samples:
+            vcf_df = RemoveConflictVariants(self.settings).main(indf=self.sample_vcf_df(sample))
+            cds_edit_df = VcfDfToCdsEditDf(self.settings).main(vcf_df=vcf_df)
+            self.cds_edits[sample] = CdsEdits.from_df(cds_edit_df)
+
+        return self.cds_edits
+
+    def read_vcf(self):
+        self.vcf_df = ReadVcf(self.settings).main(vcf=self.vcf)
+        self.samples = list(self.vcf_df.columns[self.FIRST_SAMPLE_COLUMN:])
+        assert len(self.samples) > 0, f'No sample column in VCF "{self.vcf}"'
+
+    def set_format_indices(self):
+        self.gt_indices, self.gq_indices, self.ad_indices, self.dp_indices = [], [], [], []
+        for fmt in self.vcf_df['FORMAT']:
+            keys = fmt.split(':')
+            for indices, key in [
+                (self.gt_indices, 'GT'),
+                (self.gq_indices, 'GQ'),
+                (self.ad_indices, 'AD'),
+                (self.dp_indices, 'DP'),
+            ]:
+                indices.append(keys.index(key) if key in keys else -1)
+
+    def sample_vcf_df(self, sample: str) -> pd.DataFrame:
+        alleles = [
+            genotype_allele(field=field, gt_index=i)
+            for field, i in zip(self.vcf_df[sample], self.gt_indices)
+        ]
+        carried = np.flatnonzero(np.array(alleles, dtype=np.int64) > 0)
+        alts = self.vcf_df['ALT'].to_numpy()
+        fields = self.vcf_df[sample].to_numpy()
+        site_quals = self.vcf_df['QUAL'].to_numpy()
+        quals = [
+            sample_qual(
+                field=fields[i],
+                allele=alleles[i],
+                gq_index=self.gq_indices[i],
+                ad_index=self.ad_indices[i],
+                dp_index=self.dp_indices[i],
+                site_qual=site_quals[i])
+            for i in carried
+        ]
+        return pd.DataFrame(data={
+            'POS': self.vcf_df['POS'].to_numpy()[carried],
+            'REF': self.vcf_df['REF'].to_numpy()[carried],
+            'ALT': np.array([alts[i].split(',')[alleles[i] - 1] for i in carried], dtype=object),
+            'QUAL': np.array(quals, dtype=np.float64),
+        })
+
+
+def genotype_allele(field: str, gt_index: int) -> int:
+    """
+    The first ALT allele (1-based index into ALT) called in the GT of a sample field, e.g. '1' or '0/2:...',
+    0 if the genotype is reference, missing or absent
+    """
+    if gt_index < 0:
+        return 0
+    keys = field.split(':')
+    if gt_index >= len(keys):
+        return 0
+    for allele in keys[gt_index].replace('|', '/').split('/'):
+        if allele not in ('', '.') and int(allele) > 0:
+            return int(allele)
+    return 0
+
+
+def sample_qual(
+        field: str,
+        allele: int,
+        gq_index: int,
+        ad_index: int,
+        dp_index: int,
+        site_qual: float) -> float:
+    """
+    Quality of an ALT allele (1-based index into ALT) in a sample field, e.g. '1:35' with GT:GQ,
+    GQ if given, otherwise scored from AD and DP (the sum of AD if DP is absent), otherwise the site-level QUAL
+    """
+    keys = field.split(':')
+    gq = format_value(keys=keys, index=gq_index)
+    if gq is not None:
+        return float(gq)
+
+    ad = format_value(keys=keys, index=ad_index)
+    counts = [] if ad is None else [0 if c == '.' else int(c) for c in ad.split(',')]
+    if allele < len(counts):
+        dp = format_value(keys=keys, index=dp_index)
+        depth = sum(counts) if dp is None else int(dp)
+        return support_qual(count=counts[allele], depth=depth, error_rate=PileupCaller.ERROR_RATE)
+
+    return site_qual
+
+
+def format_value(keys: List[str], index: int) -> Optional[str]:
+    if index < 0 or index >= len(keys) or keys[index] in ('', '.'):
+        return None
+    return keys[index]
+
+
 class ReadVcf(Processor):
+    """
+    Parse the records of a VCF in one pass, without writing any intermediate file
+
+    Each line is split only up to the last wanted column, and the values are collected per column,
+    POS into int64 and QUAL into float64 arrays (missing QUAL '.' as NaN), other columns as str
+    """
 
-    vcf: str
+    INT_COLUMNS = ['POS']
+    FLOAT_COLUMNS = ['QUAL']
+
+    vcf: Union[str, TextIO]
+    columns: Optional[List[str]]
 
-    temp_tsv: str
     outdf: pd.DataFrame
 
     def __init__(self, settings: Settings):
         super().__init__(settings=settings)
 
-    def main(self, vcf: str) -> pd.DataFrame:
+    def main(
+            self,
+            vcf: Union[str, TextIO],
+            columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        vcf:
+            Path to a VCF, a bgzipped VCF (detected by the gzip magic number) or a BCF (.bcf, decoded by bcftools view),
+            or a text stream of VCF lines, e.g. the stdout of a variant caller
+
+        columns:
+            Columns to keep, e.g. ['POS', 'REF', 'ALT', 'QUAL'], all if None
+        """
         self.vcf = vcf
+        self.columns = columns
 
-        self.write_temp_tsv()
-        self.read_temp_tsv()
+        if not isinstance(self.vcf, str):
+            self.parse(lines=self.vcf)
+        elif self.vcf.endswith('.bcf'):
+            self.read_bcf()
+        else:
+            with open_vcf(self.vcf) as fh:
+                self.parse(lines=fh)
 
         return self.outdf
 
-    def write_temp_tsv(self):
-        self.temp_tsv = f'{self.workdir}/temp.tsv'
-        with open(self.vcf) as reader:
-            with open(self.temp_tsv, 'w') as writer:
-                for line in reader:
-                    if line.startswith('##'):
-                        continue
-                    elif line.startswith('#CHROM'):
-                        writer.write(line[1:])
-                    else:
-                        writer.write(line)
+    def read_bcf(self):
+        self.call_stream(args=['bcftools', 'view', self.vcf], consume=self.parse, threads=1)
+
+    def parse(self, lines: Iterable[str]):
+        lines = iter(lines)
 
-    def read_temp_tsv(self):
-        self.outdf = pd.read_csv(self.temp_tsv, sep='\t')
+        header = None
+        for line in lines:
+            if line.startswith('##'):
+                continue
+            if line.startswith('#'):
+                header = line[1:].rstrip('\r\n').split('\t')
+            break
+        assert header is not None, f'Header line "#CHROM ..." not found in VCF "{self.vcf}"'
+
+        columns = header if self.columns is None else self.columns
+        for c in columns:
+            assert c in header, f'Column "{c}" not found in VCF "{self.vcf}"'
+        indices = [header.index(c) for c in columns]
+        maxsplit = max(indices) + 1
+
+        values = [[] for _ in columns]
+        for line in lines:
+            if line.isspace() or line == '':  # blank or trailing lines
+                continue
+            fields = line.rstrip('\r\n').split('\t', maxsplit)
+            for v, i in zip(values, indices):
+                v.append(fields[i])
+
+        self.outdf = pd.DataFrame(data={c: self.to_array(c, v) for c, v in zip(columns, values)})
+
+    def to_array(self, column: str, values: List[str]) -> np.ndarray:
+        if column in self.INT_COLUMNS:
+            return np.array(values, dtype=np.int64)
+        if column in self.FLOAT_COLUMNS:
+            return np.array([np.nan if v == '.' else v for v in values], dtype=np.float64)
+        return np.array(values, dtype=object)
+
+
+def open_vcf(vcf: str) -> TextIO:
+    if detect_codec(vcf) == GZIP:  # bgzip is gzip-compatible
+        return gzip.open(vcf, 'rt')
+    return open(vcf)
 
 
 class RemoveConflictVariants(Processor):
@@ -98,8 +302,8 @@ class RemoveConflictVariants(Processor):
 
     def separate_three_dfs(self):
         df = self.indf
-        ref_len = df['REF'].apply(len)
-        alt_len = df['ALT'].apply(len)
+        ref_len = df['REF'].str.len()
+        alt_len = df['ALT'].str.len()
         self.snv_df = df[ref_len == alt_len].reset_index(drop=True)
         self.del_df = df[ref_len > alt_len].reset_index(drop=True)
         self.ins_df = df[ref_len < alt_len].reset_index(drop=True)
@@ -116,13 +320,12 @@ class RemoveConflictVariants(Processor):
             self.ins_df = RemoveInsertionConflict(self.settings).main(indf=self.ins_df)
 
     def merge_back(self):
-        self.outdf = self.snv_df.append(
-            self.del_df, ignore_index=True
-        ).append(
-            self.ins_df, ignore_index=True
+        self.outdf = pd.concat(
+            [self.snv_df, self.del_df, self.ins_df], ignore_index=True
         ).sort_values(
             by='POS',
-            ascending=True
+            ascending=True,
+            kind='stable'  # SNV, deletion, insertion at the same POS
         ).reset_index(
             drop=True
         )
@@ -173,7 +376,6 @@ class RemoveDeletionConflict(Processor):
 
     def main(self, indf: pd.DataFrame) -> pd.DataFrame:
         self.indf = indf
-        self.outdf = pd.DataFrame(columns=self.COLUMNS_OUT)
 
         self.sort_by_position()
         self.add_deletion_range()
@@ -191,41 +393,37 @@ class RemoveDeletionConflict(Processor):
         )
 
     def add_deletion_range(self):
-        df = self.indf
-        for i, row in df.iterrows():
-            pos, ref, alt = row['POS'], row['REF'], row['ALT']
-            df.loc[i, 'start'] = pos + len(alt)
-            df.loc[i, 'end'] = pos + len(ref) - 1  # -1 because the end is inclusive
+        pos = self.indf['POS'].to_numpy()
+        self.indf['start'] = pos + self.indf['ALT'].str.len().to_numpy()
+        self.indf['end'] = pos + self.indf['REF'].str.len().to_numpy() - 1  # -1 because the end is inclusive
 
     def remove_overlapped(self):
-        df = self.indf
-        prev = None
-        for i, row in df.iterrows():
-            this = row
-
-            if prev is None:
-                prev = this
-                continue
-
-            if overlap(prev, this):
-                if this['QUAL'] > prev['QUAL']:
+        """
+        One sweep in the order of POS: a deletion overlapping the currently kept one replaces it
+        if of higher QUAL, otherwise is skipped; a non-overlapping deletion is kept next
+        """
+        starts = self.indf['start'].tolist()
+        ends = self.indf['end'].tolist()
+        quals = self.indf['QUAL'].tolist()
+
+        kept = []
+        prev = 0
+        for this in range(1, len(starts)):
+            if starts[this] <= ends[prev] and starts[prev] <= ends[this]:  # overlap
+                if quals[this] > quals[prev]:
                     prev = this
-                else:
-                    pass  # Just skip this deletion (lower quality), and keep the previous one
             else:
-                self.outdf = self.outdf.append(prev, ignore_index=True)
+                kept.append(prev)
                 prev = this
+        if len(starts) > 0:
+            kept.append(prev)  # the final one
 
-        self.outdf = self.outdf.append(prev, ignore_index=True)  # Append the final one
+        self.outdf = self.indf.iloc[kept].reset_index(drop=True)
 
     def drop_deletion_range(self):
         self.outdf = self.outdf.drop(columns=['start', 'end'])
 
 
-def overlap(row1: pd.Series, row2: pd.Series) -> bool:
-    return (row2['start'] <= row1['end']) and (row1['start'] <= row2['end'])
-
-
 class RemoveInsertionConflict(Processor):
 
     COLUMNS_IN = [
@@ -244,7 +442,6 @@ class RemoveInsertionConflict(Processor):
 
     def main(self, indf: pd.DataFrame) -> pd.DataFrame:
         self.indf = indf
-        self.outdf = pd.DataFrame(columns=self.COLUMNS_OUT)
 
         self.sort_by_position()
         self.add_insertion_position()
@@ -262,10 +459,7 @@ class RemoveInsertionConflict(Processor):
         )
 
     def add_insertion_position(self):
-        df = self.indf
-        for i, row in df.iterrows():
-            pos, ref = row['POS'], row['REF']
-            df.loc[i, 'position'] = pos + len(ref)
+        self.indf['position'] = self.indf['POS'].to_numpy() + self.indf['REF'].str.len().to_numpy()
 
     def remove_conflict(self):
         self.outdf = self.indf.sort_values(
@@ -298,19 +492,32 @@ class VcfDfToCdsEditDf(Processor):
         'Base',
     ]
 
+    SUBSTITUTE, DELETE, INSERT = 0, 1, 2
+    TYPES = np.array(['substitute', 'delete', 'insert'], dtype=object)
+
     vcf_df: pd.DataFrame
+    pos: np.ndarray
+    ref_len: np.ndarray
+    alt_len: np.ndarray
+    kinds: np.ndarray  # SUBSTITUTE, DELETE or INSERT of each record
+    records: np.ndarray  # record index of each output row
+    offsets: np.ndarray  # 0-based index of each output row within its record
     cds_edit_df: pd.DataFrame
 
     def __init__(self, settings: Settings):
         super().__init__(settings=settings)
 
     def main(self, vcf_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Each SNV and insertion gives one row, and each deletion one row per deleted base,
+        all computed at once as columns
+        """
         self.vcf_df = vcf_df
-        self.cds_edit_df = pd.DataFrame(columns=self.COLUMNS_OUT)
 
         self.sort_by_position()
-        for i, row in self.vcf_df.iterrows():
-            self.convert_one(row)
+        self.set_record_arrays()
+        self.expand_rows()
+        self.build_cds_edit_df()
 
         return self.cds_edit_df
 
@@ -322,48 +529,37 @@ class VcfDfToCdsEditDf(Processor):
             drop=True
         )
 
-    def convert_one(self, row: pd.Series):
-        pos, ref, alt = row['POS'], row['REF'], row['ALT']
-        is_snv = len(ref) == len(alt)
-        is_deletion = len(ref) > len(alt)
-        if is_snv:
-            self.convert_snv(row)
-        elif is_deletion:
-            self.convert_deletion(row)
-        else:
-            self.convert_insertion(row)
-
-    def convert_snv(self, row: pd.Series):
-        self.append({
-            'Position': row['POS'],
-            'Type': 'substitute',
-            'Base': row['ALT'],
-        })
-
-    def convert_deletion(self, row: pd.Series):
-        pos, ref, alt = row['POS'], row['REF'], row['ALT']
-
-        start = pos + len(alt)
-        length = len(ref) - len(alt)
-        positions = [(start + i) for i in range(length)]
-
-        new = pd.DataFrame(data={
+    def set_record_arrays(self):
+        self.pos = self.vcf_df['POS'].to_numpy(dtype=np.int64)
+        self.ref_len = self.vcf_df['REF'].str.len().to_numpy(dtype=np.int64)
+        self.alt_len = self.vcf_df['ALT'].str.len().to_numpy(dtype=np.int64)
+        self.kinds = np.where(
+            self.ref_len == self.alt_len, self.SUBSTITUTE, np.where(
+                self.ref_len > self.alt_len, self.DELETE, self.INSERT))
+
+    def expand_rows(self):
+        n_rows = np.where(self.kinds == self.DELETE, self.ref_len - self.alt_len, 1)
+        self.records = np.repeat(np.arange(len(n_rows)), n_rows)
+        first_rows = np.cumsum(n_rows) - n_rows
+        self.offsets = np.arange(len(self.records)) - np.repeat(first_rows, n_rows)
+
+    def build_cds_edit_df(self):
+        r = self.records
+        kinds = self.kinds[r]
+
+        positions = self.pos[r]  # fancy indexing makes a copy
+        deletion = kinds == self.DELETE
+        positions[deletion] += self.alt_len[r][deletion] + self.offsets[deletion]  # deleted bases after ALT
+        insertion = kinds == self.INSERT
+        positions[insertion] += self.ref_len[r][insertion]  # inserted after the last REF base
+
+        bases = np.array([
+            alt if kind == self.SUBSTITUTE else (alt[len(ref):] if kind == self.INSERT else np.nan)
+            for ref, alt, kind in zip(self.vcf_df['REF'], self.vcf_df['ALT'], self.kinds)
+        ], dtype=object)
+
+        self.cds_edit_df = pd.DataFrame(data={
             'Position': positions,
-            'Type': ['delete'] * len(positions),
-        })
-        self.append(new)
-
-    def convert_insertion(self, row: pd.Series):
-        pos, ref, alt = row['POS'], row['REF'], row['ALT']
-
-        insertion_site = pos + len(ref)
-        bases = alt[len(ref):]
-
-        self.append({
-            'Position': insertion_site,
-            'Type': 'insert',
-            'Base': bases,
-        })
-
-    def append(self, new: Union[dict, pd.DataFrame]):
-        self.cds_edit_df = self.cds_edit_df.append(new, ignore_index=True)
+            'Type': self.TYPES[kinds],
+            'Base': bases[r],
+        }, columns=self.COLUMNS_OUT)
@@ -1,8 +1,8 @@
-import pandas as pd
-from typing import List
 from copy import deepcopy
-from ngslite import read_genbank, Chromosome, GenericFeature
+from typing import List, Tuple, Optional
 from .cds import CDS, Exon
+from .cds_edits import CdsEdits, SUBSTITUTE, DELETE, INSERT
+from .reference import LoadReference, Reference
 from .template import Processor, Settings
 
 
@@ -10,7 +10,7 @@ class ReadGbk(Processor):
 
     gbk: str
 
-    chromosome: Chromosome
+    reference: Reference
     cdses: List[CDS]
 
     def __init__(self, settings: Settings):
@@ -23,37 +23,30 @@ class ReadGbk(Processor):
         return self.cdses
 
     def read_gbk(self):
-        self.chromosome = read_genbank(file=self.gbk)[0]
+        self.reference = LoadReference(self.settings).main(gbk=self.gbk)
 
     def features_to_cdses(self):
-        self.cdses = []
-        features = [f for f in self.chromosome.features if f.type == 'CDS']
-        self.cdses = list(map(self.to_cds, features))
+        self.cdses = list(map(self.to_cds, self.reference.cds_regions, self.reference.cds_names))
 
-    def to_cds(self, feature: GenericFeature) -> CDS:
+    def to_cds(self, regions: List[Tuple[int, int, str]], name: Optional[str]) -> CDS:
         exons = []
-        for start, end, strand in feature.regions:
+        for start, end, strand in regions:
             exon = Exon(
                 start=start,
                 end=end,
                 strand=strand,
-                sequence=self.chromosome.sequence[start - 1:end]
+                sequence=self.reference.sequence[start - 1:end]
             )
             exons.append(exon)
         cds = CDS(exons=exons)
-        cds.name = feature.get_attribute(key='gene')
+        cds.name = name
         return cds
 
 
-TYPE = 'Type'
-POSITION = 'Position'
-BASE = 'Base'
-
-
 class Mutate(Processor):
 
     cdses: List[CDS]
-    cds_edit_df: pd.DataFrame
+    cds_edits: CdsEdits
 
     def __init__(self, settings: Settings):
         super().__init__(settings=settings)
@@ -62,13 +55,13 @@ class Mutate(Processor):
     def main(
             self,
             cdses: List[CDS],
-            cds_edit_df: pd.DataFrame) -> List[CDS]:
+            cds_edits: CdsEdits) -> List[CDS]:
 
         self.cdses = deepcopy(cdses)
-        self.cds_edit_df = cds_edit_df
+        self.cds_edits = cds_edits
 
         for cds in self.cdses:
-            self.mutate_one_cds(cds=cds, cds_edit_df=cds_edit_df)
+            self.mutate_one_cds(cds=cds, cds_edits=cds_edits)
 
         return self.cdses
 
@@ -76,7 +69,7 @@ class Mutate(Processor):
 class MutateOneCDS(Processor):
 
     cds: CDS
-    cds_edit_df: pd.DataFrame
+    cds_edits: CdsEdits
 
     def __init__(self, settings: Settings):
         super().__init__(settings=settings)
@@ -84,38 +77,32 @@ class MutateOneCDS(Processor):
     def main(
             self,
             cds: CDS,
-            cds_edit_df: pd.DataFrame):
+            cds_edits: CdsEdits):
 
         self.cds = cds
-        self.cds_edit_df = cds_edit_df
+        self.cds_edits = cds_edits
 
-        self.subset_cds_edit_df()
+        self.subset_cds_edits()
         self.substitute()
         self.delete()
         self.insert()
 
         return self.cds
 
-    def subset_cds_edit_df(self):
-        within_cds = \
-            (self.cds_edit_df[POSITION] >= self.cds.start) & \
-            (self.cds_edit_df[POSITION] <= self.cds.end)
-        self.cds_edit_df = self.cds_edit_df.loc[within_cds]
+    def subset_cds_edits(self):
+        self.cds_edits = self.cds_edits.slice(start=self.cds.start, end=self.cds.end)
 
     def substitute(self):
-        df = self.cds_edit_df
-        for i, row in df[df[TYPE] == 'substitute'].iterrows():
-            self.cds.substitute(position=row[POSITION], base=row[BASE])
+        for position, base in self.cds_edits.iter_type(SUBSTITUTE):
+            self.cds.substitute(position=position, base=base)
 
     def delete(self):
-        df = self.cds_edit_df
-        for i, row in df[df[TYPE] == 'delete'].iterrows():
-            self.cds.delete(position=row[POSITION])
+        for position, _ in self.cds_edits.iter_type(DELETE):
+            self.cds.delete(position=position)
 
     def insert(self):
-        df = self.cds_edit_df
-        for i, row in df[df[TYPE] == 'insert'].iterrows():
-            first_base = row[POSITION] == self.cds.start
+        for position, bases in self.cds_edits.iter_type(INSERT):
+            first_base = position == self.cds.start
             if first_base:
                 continue  # by definition insertion cannot take place before the first base
-            self.cds.insert(position=row[POSITION], bases=row[BASE])
+            self.cds.insert(position=position, bases=bases)
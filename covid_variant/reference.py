@@ -0,0 +1,136 @@
+import os
+import json
+import struct
+import tempfile
+from typing import List, Tuple, Dict, Optional
+from ngslite import read_genbank
+from .checkpoint import get_sha256
+from .template import Processor, Settings
+
+
+CACHE_SUFFIX = '.refcache'
+MAGIC = b'CVREF1\n'
+HEADER = struct.Struct('<32sI')  # SHA-256 digest of the GenBank file, size of the JSON metadata
+
+
+class Reference:
+
+    seqname: str
+    sequence: str
+    cds_regions: List[List[Tuple[int, int, str]]]  # 1-based inclusive (start, end, strand) of each CDS
+    cds_names: List[Optional[str]]  # gene name of each CDS
+
+    def __init__(
+            self,
+            seqname: str,
+            sequence: str,
+            cds_regions: List[List[Tuple[int, int, str]]],
+            cds_names: List[Optional[str]]):
+        self.seqname = seqname
+        self.sequence = sequence
+        self.cds_regions = cds_regions
+        self.cds_names = cds_names
+
+
+_references: Dict[bytes, Reference] = {}  # SHA-256 digest of the GenBank file -> parsed reference
+
+
+class LoadReference(Processor):
+    """
+    Load the first chromosome of a GenBank file, parsed at most once per content
+
+    The parsed sequence, CDS regions and gene names are kept in memory for the process.
+    The SHA-256 of the GenBank file is cached by path, size and modification time (checkpoint.get_sha256),
+    so a GenBank file loaded again by later stages is not hashed again.
+
+    If settings.index_cache_dir is set, the reference is also serialized to a compact binary cache
+    {index_cache_dir}/{sha256}.refcache, shared across runs:
+        MAGIC, SHA-256 of the GenBank file, size of the metadata, metadata (JSON), sequence (ASCII)
+    The cache is valid only if the recorded SHA-256 matches the current GenBank file,
+    otherwise the file is parsed again and the cache is rewritten.
+    If the directory is not writable, the cache is skipped.
+    """
+
+    gbk: str
+    cache: Optional[str]
+    digest: bytes
+    reference: Optional[Reference]
+
+    def __init__(self, settings: Settings):
+        super().__init__(settings=settings)
+
+    def main(self, gbk: str) -> Reference:
+        self.gbk = gbk
+
+        self.set_digest()
+        self.set_cache()
+        if self.digest in _references:
+            return _references[self.digest]
+
+        self.reference = self.read_cache()
+        if self.reference is None:
+            self.parse_gbk()
+            self.write_cache()
+
+        _references[self.digest] = self.reference
+        return self.reference
+
+    def set_digest(self):
+        self.digest = bytes.fromhex(get_sha256(self.gbk))
+
+    def set_cache(self):
+        cache_dir = self.settings.index_cache_dir
+        self.cache = None if cache_dir is None else f'{cache_dir}/{self.digest.hex()}{CACHE_SUFFIX}'
+
+    def read_cache(self) -> Optional[Reference]:
+        if self.cache is None or not os.path.exists(self.cache):
+            return None
+
+        with open(self.cache, 'rb') as fh:
+            data = fh.read()
+
+        start = len(MAGIC)
+        if not data.startswith(MAGIC) or len(data) < start + HEADER.size:
+            return None
+        digest, metadata_size = HEADER.unpack_from(data, start)
+        if digest != self.digest:
+            self.logger.debug(f'Outdated reference cache: {self.cache}')
+            return None
+
+        start += HEADER.size
+        metadata = json.loads(data[start:start + metadata_size])
+        return Reference(
+            seqname=metadata['seqname'],
+            sequence=data[start + metadata_size:].decode(),
+            cds_regions=[[tuple(r) for r in regions] for regions in metadata['cds_regions']],
+            cds_names=metadata['cds_names'])
+
+    def parse_gbk(self):
+        chromosome = read_genbank(file=self.gbk)[0]
+        features = [f for f in chromosome.features if f.type == 'CDS']
+        self.reference = Reference(
+            seqname=chromosome.seqname,
+            sequence=chromosome.sequence,
+            cds_regions=[[tuple(r) for r in f.regions] for f in features],
+            cds_names=[f.get_attribute(key='gene') for f in features])
+
+    def write_cache(self):
+        if self.cache is None:
+            return
+
+        metadata = json.dumps({
+            'seqname': self.reference.seqname,
+            'cds_regions': self.reference.cds_regions,
+            'cds_names': self.reference.cds_names,
+        }).encode()
+        data = MAGIC + HEADER.pack(self.digest, len(metadata)) + metadata + self.reference.sequence.encode()
+
+        try:
+            os.makedirs(self.settings.index_cache_dir, exist_ok=True)
+            fd, temp = tempfile.mkstemp(prefix=f'{os.path.basename(self.cache)}.tmp.', dir=self.settings.index_cache_dir)
+        except OSError:
+            self.logger.debug(f'Cannot write reference cache in {self.settings.index_cache_dir}')
+            return
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.replace(temp, self.cache)  # atomic, concurrent runs never read a partial cache
@@ -1,8 +1,20 @@
 import pandas as pd
-from typing import List
+from typing import List, Dict
 from .template import Processor, Settings
 
 
+_covid_variant_dfs: Dict[str, pd.DataFrame] = {}
+
+
+def read_covid_variant_csv(csv: str) -> pd.DataFrame:
+    """
+    Read once per process, and return a copy, since ReportResult adds the Matched column
+    """
+    if csv not in _covid_variant_dfs:
+        _covid_variant_dfs[csv] = pd.read_csv(csv)
+    return _covid_variant_dfs[csv].copy()
+
+
 class ReportResult(Processor):
 
     SEP = ','
@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Optional, Tuple, List
+from .template import Settings
+from .batch import run_sample, read_result_txt, RESULT_FILENAME
+
+
+REF_DIR = f'{os.path.dirname(os.path.dirname(__file__))}/reference'
+GBK = f'{REF_DIR}/NC_045512.2.gb'
+COVID_VARIANT_CSV = f'{REF_DIR}/variants.csv'
+INDEX_CACHE_DIRNAME = 'index_cache'
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def warm_up(gbk: str, covid_variant_csv: str, index_cache_dir: str):
+    """
+    Initializer of worker processes, which loads everything that does not depend on the sample
+    """
+    from .covid_variant import CovidVariant  # noqa: F401, imports pandas, numpy, Biopython and ngslite
+    from .reference import LoadReference
+    from .result import read_covid_variant_csv
+
+    settings = Settings(workdir='.', outdir='.', threads=1, debug=False, mock=True, index_cache_dir=index_cache_dir)
+    LoadReference(settings).main(gbk=gbk)
+    read_covid_variant_csv(covid_variant_csv)
+
+
+def run_job(
+        fq1: str,
+        fq2: Optional[str],
+        outdir: str,
+        threads: int,
+        options: Dict[str, Any]) -> Dict[str, Any]:
+    start, end = run_sample(fq1=fq1, fq2=fq2, outdir=outdir, threads=threads, options=options)
+    spike_mutations, match = read_result_txt(f'{outdir}/{RESULT_FILENAME}')
+    return {
+        'spike_mutations': split_items(spike_mutations),
+        'match': split_items(match),
+        'start': start,
+        'end': end,
+        'wall_time': end - start,
+    }
+
+
+def split_items(s: Optional[str]) -> Optional[List[str]]:
+    if s is None:
+        return None
+    return [item for item in s.split(', ') if item != '']
+
+
+class JobServer(ThreadingHTTPServer):
+    """
+    Long-lived HTTP server that runs samples as jobs on a pool of warm worker processes
+
+    Worker processes import the heavy dependencies, parse the reference and read the variant table once,
+    at startup. All jobs share a bowtie2 index cache, so the index is built by the first job only.
+
+    POST /jobs
+        JSON body with fq1, and optionally fq2, outdir and any option of Main.main() to override the server defaults.
+        With "wait": true, responds when the job is finished, otherwise right away with the job ID
+    GET /jobs
+        All jobs
+    GET /jobs/{job_id}
+        Status and, when done, the spike protein mutations and the matched variants
+    GET /health
+    """
+
+    outdir: str
+    threads_per_sample: int
+    workers: int
+    options: Dict[str, Any]
+
+    executor: ProcessPoolExecutor
+    jobs: Dict[str, Tuple[Dict[str, Any], Future]]
+    lock: threading.Lock
+
+    def __init__(
+            self,
+            address: Tuple[str, int],
+            outdir: str,
+            threads: int,
+            threads_per_sample: int,
+            options: Dict[str, Any]):
+        """
+        options:
+            Default keyword arguments passed to Main.main() for every job,
+            other than fq1, fq2, outdir, workdir and threads
+        """
+        super().__init__(address, JobHandler)
+
+        self.outdir = outdir
+        self.threads_per_sample = min(threads_per_sample, threads)
+        self.workers = max(1, threads // self.threads_per_sample)
+        self.options = dict(options)
+        if self.options['index_cache_dir'] in [None, 'None']:
+            self.options['index_cache_dir'] = f'{outdir}/{INDEX_CACHE_DIRNAME}'
+
+        os.makedirs(self.outdir, exist_ok=True)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=warm_up,
+            initargs=(GBK, COVID_VARIANT_CSV, self.options['index_cache_dir']))
+        for _ in range(self.workers):
+            self.executor.submit(time.sleep, 0)  # start and warm up all workers before the first job
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, request: Dict[str, Any]) -> str:
+        """
+        Raises ValueError if the request is invalid
+        """
+        unknown = set(request) - set(self.options) - {'fq1', 'fq2', 'outdir', 'wait'}
+        if unknown:
+            raise ValueError(f'Unknown options: {", ".join(sorted(unknown))}')
+        if 'fq1' not in request:
+            raise ValueError('fq1 is required')
+        for key in ['fq1', 'fq2']:
+            fq = request.get(key)
+            if fq is not None and not os.path.isfile(fq):
+                raise ValueError(f'{key} "{fq}" does not exist')
+
+        with self.lock:
+            job_id = f'{len(self.jobs) + 1:06d}'
+            job = {
+                'job_id': job_id,
+                'fq1': request['fq1'],
+                'fq2': request.get('fq2'),
+                'outdir': request.get('outdir', f'{self.outdir}/{job_id}'),
+                'submitted': time.time(),
+            }
+            options = {**self.options, **{k: v for k, v in request.items() if k in self.options}}
+            future = self.executor.submit(
+                run_job,
+                fq1=job['fq1'],
+                fq2=job['fq2'],
+                outdir=job['outdir'],
+                threads=self.threads_per_sample,
+                options=options)
+            self.jobs[job_id] = (job, future)
+        return job_id
+
+    def wait(self, job_id: str):
+        _, future = self.jobs[job_id]
+        try:
+            future.result()
+        except Exception:
+            pass  # reported by get_job()
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            if job_id not in self.jobs:
+                return None
+            job, future = self.jobs[job_id]
+
+        data = dict(job)
+        if not future.done():
+            data['status'] = RUNNING if future.running() else QUEUED
+        elif future.exception() is not None:
+            data['status'] = FAILED
+            data['error'] = repr(future.exception())
+        else:
+            data['status'] = DONE
+            data.update(future.result())
+        return data
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            job_ids = list(self.jobs)
+        return [self.get_job(job_id) for job_id in job_ids]
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+class JobHandler(BaseHTTPRequestHandler):
+
+    server: JobServer
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        if path == '/health':
+            self.send_json(200, {'status': 'ok', 'workers': self.server.workers})
+        elif path == '/jobs':
+            self.send_json(200, self.server.list_jobs())
+        elif path.startswith('/jobs/'):
+            job = self.server.get_job(path[len('/jobs/'):])
+            if job is None:
+                self.send_json(404, {'error': f'Job not found: {path}'})
+            else:
+                self.send_json(200, job)
+        else:
+            self.send_json(404, {'error': f'Not found: {path}'})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            self.send_json(404, {'error': f'Not found: {self.path}'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError('Request body must be a JSON object')
+            job_id = self.server.submit(request)
+        except ValueError as e:  # json.JSONDecodeError is a ValueError
+            self.send_json(400, {'error': str(e)})
+            return
+
+        if request.get('wait', False):
+            self.server.wait(job_id)
+            self.send_json(200, self.server.get_job(job_id))
+        else:
+            self.send_json(202, self.server.get_job(job_id))
+
+    def send_json(self, code: int, data: Any):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args):
+        print(f'{self.__class__.__name__}\tINFO\t{datetime.now()}\n{format % args}\n', flush=True)
+
+
+def serve(
+        host: str,
+        port: int,
+        outdir: str,
+        threads: int,
+        threads_per_sample: int,
+        options: Dict[str, Any]):
+
+    with JobServer(
+            address=(host, port),
+            outdir=outdir,
+            threads=threads,
+            threads_per_sample=threads_per_sample,
+            options=options) as server:
+        print(f'Serving on http://{host}:{server.server_address[1]} with {server.workers} workers', flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,185 @@
+import numpy as np
+import pandas as pd
+from typing import Tuple, Optional
+from .fastq import open_fastq
+from .reference import LoadReference
+from .template import Processor, Settings
+
+
+def b_1_1_7_cds_edit_df() -> pd.DataFrame:
+    """
+    Spike protein mutations of B.1.1.7 on NC_045512.2, in the format of cds_edit.csv
+    """
+    substitutions = [
+        (23063, 'T'),  # N501Y
+        (23271, 'A'),  # A570D
+        (23403, 'G'),  # D614G
+        (23604, 'A'),  # P681H
+        (23709, 'T'),  # T716I
+        (24506, 'G'),  # S982A
+        (24914, 'C'),  # D1118H
+    ]
+    deletions = list(range(21765, 21771)) + list(range(21991, 21994))  # 69-70del, 144del
+    return pd.DataFrame(data={
+        'Position': [p for p, _ in substitutions] + deletions,
+        'Type': ['substitute'] * len(substitutions) + ['delete'] * len(deletions),
+        'Base': [b for _, b in substitutions] + [np.nan] * len(deletions),
+    })
+
+
+def apply_cds_edits(sequence: str, cds_edit_df: pd.DataFrame) -> str:
+    """
+    Same semantics as Exon, i.e. an insertion at a position goes before the base of that position
+    """
+    s = list(sequence)
+    for i, row in cds_edit_df.iterrows():
+        p = row['Position'] - 1
+        if row['Type'] == 'substitute':
+            s[p] = s[p][:-1] + row['Base']
+        elif row['Type'] == 'delete':
+            s[p] = s[p][:-1]
+        else:
+            s[p] = row['Base'] + s[p]
+    return ''.join(s).upper()
+
+
+class SimulateReads(Processor):
+
+    FRAGMENT_MEAN = 300
+    FRAGMENT_SD = 30
+    QUALITY = b'I'
+    CHUNK_SIZE = 100000  # reads or read pairs simulated at a time
+    COMPLEMENT = np.frombuffer(bytes.maketrans(b'ACGT', b'TGCA'), dtype=np.uint8)
+    BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+    gbk: str
+    cds_edit_df: pd.DataFrame
+    coverage: float
+    read_length: int
+    paired: bool
+    error_rate: float
+    prefix: str
+
+    genome: np.ndarray
+    rng: np.random.Generator
+    n_reads: int
+    n_bases: int
+    fq1: str
+    fq2: Optional[str]
+
+    def __init__(self, settings: Settings):
+        super().__init__(settings=settings)
+
+    def main(
+            self,
+            gbk: str,
+            cds_edit_df: pd.DataFrame,
+            coverage: float,
+            read_length: int,
+            paired: bool,
+            prefix: str,
+            error_rate: float = 0.,
+            seed: int = 1) -> Tuple[str, Optional[str]]:
+        """
+        Simulate reads from the genome in gbk with the mutations in cds_edit_df spiked in
+
+        coverage:
+            Total read bases / genome size
+
+        prefix:
+            Output path prefix, {prefix}.1.fq.gz and {prefix}.2.fq.gz for paired reads, otherwise {prefix}.fq.gz
+
+        Returns the paths of read 1 and read 2 (None for unpaired) fastq files
+        """
+
+        self.gbk = gbk
+        self.cds_edit_df = cds_edit_df
+        self.coverage = coverage
+        self.read_length = read_length
+        self.paired = paired
+        self.prefix = prefix
+        self.error_rate = error_rate
+        self.rng = np.random.default_rng(seed)
+
+        self.set_genome()
+        self.set_n_reads()
+        self.set_fq1_fq2()
+        self.write_reads()
+
+        return self.fq1, self.fq2
+
+    def set_genome(self):
+        sequence = LoadReference(self.settings).main(gbk=self.gbk).sequence
+        mutated = apply_cds_edits(sequence=sequence, cds_edit_df=self.cds_edit_df)
+        self.genome = np.frombuffer(mutated.encode(), dtype=np.uint8)
+
+    def set_n_reads(self):
+        self.n_reads = int(round(self.coverage * len(self.genome) / self.read_length))
+        if self.paired:
+            self.n_reads += self.n_reads % 2
+        self.n_bases = self.n_reads * self.read_length
+
+    def set_fq1_fq2(self):
+        if self.paired:
+            self.fq1, self.fq2 = f'{self.prefix}.1.fq.gz', f'{self.prefix}.2.fq.gz'
+        else:
+            self.fq1, self.fq2 = f'{self.prefix}.fq.gz', None
+
+    def write_reads(self):
+        n_records = self.n_reads // 2 if self.paired else self.n_reads
+        fqs = [self.fq1, self.fq2] if self.paired else [self.fq1]
+        writers = [open_fastq(fq, mode='wb', codec='gzip', level=1) for fq in fqs]
+
+        for chunk_start in range(0, n_records, self.CHUNK_SIZE):
+            n = min(self.CHUNK_SIZE, n_records - chunk_start)
+            reads = self.simulate_pairs(n) if self.paired else [self.simulate_unpaired(n)]
+            for i, (writer, seqs) in enumerate(zip(writers, reads)):
+                writer.write(self.to_fastq(seqs=seqs, first_id=chunk_start, mate=i + 1))
+
+        for writer in writers:
+            writer.close()
+
+    def simulate_unpaired(self, n: int) -> np.ndarray:
+        starts = self.rng.integers(0, len(self.genome) - self.read_length + 1, size=n)
+        seqs = self.extract(starts)
+        reverse = self.rng.random(n) < 0.5
+        seqs[reverse] = self.reverse_complement(seqs[reverse])
+        return self.add_errors(seqs)
+
+    def simulate_pairs(self, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        g, r = len(self.genome), self.read_length
+        lengths = self.rng.normal(self.FRAGMENT_MEAN, self.FRAGMENT_SD, size=n).round().astype(np.int64)
+        lengths = np.clip(lengths, r, g)
+        starts = (self.rng.random(n) * (g - lengths + 1)).astype(np.int64)
+
+        forward = self.extract(starts)
+        reverse = self.reverse_complement(self.extract(starts + lengths - r))
+
+        swap = self.rng.random(n) < 0.5  # fragments from the minus strand
+        seqs1 = np.where(swap[:, None], reverse, forward)
+        seqs2 = np.where(swap[:, None], forward, reverse)
+        return self.add_errors(seqs1), self.add_errors(seqs2)
+
+    def extract(self, starts: np.ndarray) -> np.ndarray:
+        return self.genome[starts[:, None] + np.arange(self.read_length)]
+
+    def reverse_complement(self, seqs: np.ndarray) -> np.ndarray:
+        return self.COMPLEMENT[seqs[:, ::-1]]
+
+    def add_errors(self, seqs: np.ndarray) -> np.ndarray:
+        if self.error_rate == 0:
+            return seqs
+        errors = self.rng.random(seqs.shape) < self.error_rate
+        seqs = seqs.copy()
+        seqs[errors] = self.rng.choice(self.BASES, size=errors.sum())
+        return seqs
+
+    def to_fastq(self, seqs: np.ndarray, first_id: int, mate: int) -> bytes:
+        r = self.read_length
+        data = seqs.tobytes()
+        quality = self.QUALITY * r
+        records = [
+            b'@sim%d/%d\n%s\n+\n%s\n' % (first_id + i, mate, data[i * r:(i + 1) * r], quality)
+            for i in range(len(seqs))
+        ]
+        return b''.join(records)
@@ -1,5 +1,16 @@
+import os
+import json
+import time
+import shlex
+import resource
+import threading
 import subprocess
 from datetime import datetime
+from typing import Optional, Callable, Any, List, TextIO
+from .threads import load_thread_profile
+
+
+RESOURCE_USAGE_FILENAME = 'resource_usage.jsonl'
 
 
 class Settings:
@@ -9,6 +20,20 @@ class Settings:
     threads: int
     debug: bool
     mock: bool
+    workdir_backend: str
+    stream_mapping: bool
+    index_cache_dir: Optional[str]
+    resume: bool
+    calling_regions: int
+    variant_caller: str
+    single_pass_sampling: bool
+    sampling_scheme: str
+    depth_normalization: bool
+    unordered_input: bool
+    intermediate_codec: str
+    compression_level: Optional[int]
+    thread_profile: Optional[str]
+    thread_budget: Optional[Any]  # ThreadBudget shared by samples in pipelined batch mode
 
     def __init__(
             self,
@@ -16,13 +41,41 @@ class Settings:
             outdir: str,
             threads: int,
             debug: bool,
-            mock: bool):
+            mock: bool,
+            workdir_backend: str = 'disk',
+            stream_mapping: bool = False,
+            index_cache_dir: Optional[str] = None,
+            resume: bool = False,
+            calling_regions: int = 1,
+            variant_caller: str = 'bcftools',
+            single_pass_sampling: bool = False,
+            sampling_scheme: str = 'v1',
+            depth_normalization: bool = False,
+            unordered_input: bool = False,
+            intermediate_codec: str = 'gzip',
+            compression_level: Optional[int] = None,
+            thread_profile: Optional[str] = None,
+            thread_budget: Optional[Any] = None):
 
         self.workdir = workdir
         self.outdir = outdir
         self.threads = threads
         self.debug = debug
         self.mock = mock
+        self.workdir_backend = workdir_backend
+        self.stream_mapping = stream_mapping
+        self.index_cache_dir = index_cache_dir
+        self.resume = resume
+        self.calling_regions = calling_regions
+        self.variant_caller = variant_caller
+        self.single_pass_sampling = single_pass_sampling
+        self.sampling_scheme = sampling_scheme
+        self.depth_normalization = depth_normalization
+        self.unordered_input = unordered_input
+        self.intermediate_codec = intermediate_codec
+        self.compression_level = compression_level
+        self.thread_profile = thread_profile
+        self.thread_budget = thread_budget
 
 
 class Logger:
@@ -51,6 +104,8 @@ class Logger:
 
 class Processor:
 
+    POLL_INTERVAL = 0.5  # seconds
+
     settings: Settings
     workdir: str
     outdir: str
@@ -74,7 +129,129 @@ class Processor:
             level=Logger.DEBUG if self.debug else Logger.INFO
         )
 
-    def call(self, cmd: str):
+    def tool_threads(self, tool: str) -> int:
+        """
+        Threads given to tool, capped by the thread profile if any
+        """
+        return load_thread_profile(self.settings.thread_profile).threads(tool=tool, available=self.threads)
+
+    def call(
+            self,
+            cmd: str,
+            monitor: Optional[Callable[[], None]] = None,
+            threads: Optional[int] = None,
+            pipefail: bool = False):
+        """
+        Run cmd in the shell, and append its wall time, CPU time and peak memory
+        to {outdir}/resource_usage.jsonl
+
+        The CPU time and peak memory from os.wait4() include all processes of the shell pipeline.
+
+        monitor:
+            Called every POLL_INTERVAL while cmd is running
+
+        threads:
+            Threads given to the (first) tool of cmd, for the record, self.threads if None
+
+        pipefail:
+            Run cmd in bash with pipefail, so that a failure of any tool of a pipeline fails cmd,
+            not only of the last one
+        """
+        self.logger.debug(cmd)
+        if self.mock:
+            return
+
+        start = datetime.now()
+        if pipefail:
+            process = subprocess.Popen(['bash', '-o', 'pipefail', '-c', cmd])
+        else:
+            process = subprocess.Popen(cmd, shell=True)
+        if monitor is None:
+            _, status, rusage = os.wait4(process.pid, 0)
+        else:
+            while True:
+                pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+                if pid != 0:
+                    break
+                monitor()
+                time.sleep(self.POLL_INTERVAL)
+        process.returncode = exit_code(status)  # already reaped by os.wait4()
+
+        self.write_resource_usage(
+            cmd=cmd, start=start, rusage=rusage, returncode=process.returncode, threads=threads)
+
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, cmd)  # positional, to be picklable across processes
+
+    def call_stream(
+            self,
+            args: List[str],
+            consume: Callable[[TextIO], None],
+            threads: Optional[int] = None):
+        """
+        Run args without the shell, pass its stdout as a text stream to consume,
+        and record its resource usage as call() does
+
+        args:
+            The program and its arguments, so that paths with spaces are passed as they are
+
+        consume:
+            Called with the stdout of the process, which is closed and waited for afterwards
+        """
+        cmd = shlex.join(args)
         self.logger.debug(cmd)
-        if not self.mock:
-            subprocess.check_call(cmd, shell=True)
+
+        start = datetime.now()
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, text=True)
+        try:
+            consume(process.stdout)
+        finally:
+            process.stdout.close()
+            _, status, rusage = os.wait4(process.pid, 0)
+            process.returncode = exit_code(status)  # already reaped by os.wait4()
+            self.write_resource_usage(
+                cmd=cmd, start=start, rusage=rusage, returncode=process.returncode, threads=threads)
+
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, cmd)
+
+    def write_resource_usage(
+            self,
+            cmd: str,
+            start: datetime,
+            rusage: resource.struct_rusage,
+            returncode: int,
+            threads: Optional[int] = None):
+        ResourceUsageWriter(self.outdir).write({
+            'processor': self.__class__.__name__,
+            'cmd': cmd,
+            'start': start.isoformat(),
+            'wall_time': (datetime.now() - start).total_seconds(),
+            'user_time': rusage.ru_utime,
+            'sys_time': rusage.ru_stime,
+            'max_rss_kb': rusage.ru_maxrss,
+            'threads': self.threads if threads is None else threads,
+            'returncode': returncode,
+        })
+
+
+def exit_code(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class ResourceUsageWriter:
+
+    __lock = threading.Lock()  # calls may run concurrently from threads of the same process
+
+    jsonl: str
+
+    def __init__(self, outdir: str):
+        self.jsonl = f'{outdir}/{RESOURCE_USAGE_FILENAME}'
+
+    def write(self, record: dict):
+        line = json.dumps(record) + '\n'
+        with self.__lock:
+            with open(self.jsonl, 'a') as fh:
+                fh.write(line)
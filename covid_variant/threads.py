@@ -0,0 +1,98 @@
+import json
+import functools
+import statistics
+from typing import List, Dict, Optional
+
+
+def tool_name(cmd: str) -> Optional[str]:
+    """
+    The tool of a command line recorded in resource_usage.jsonl,
+    with the subcommand for samtools, e.g. 'samtools sort'
+    """
+    words = cmd.split()
+    if len(words) == 0:
+        return None
+    if words[0] == 'samtools' and len(words) > 1:
+        return f'samtools {words[1]}'
+    return words[0]
+
+
+class ThreadProfile:
+    """
+    Useful number of threads of each tool, beyond which the tool does not get faster
+
+    Tools not in the profile use all available threads.
+    """
+
+    tools: Dict[str, int]
+
+    def __init__(self, tools: Dict[str, int]):
+        self.tools = tools
+
+    def threads(self, tool: str, available: int) -> int:
+        return max(1, min(available, self.tools.get(tool, available)))
+
+
+@functools.lru_cache()
+def load_thread_profile(json_path: Optional[str]) -> ThreadProfile:
+    if json_path is None:
+        return ThreadProfile(tools={})
+    with open(json_path) as fh:
+        return ThreadProfile(tools=json.load(fh)['tools'])
+
+
+class BuildThreadProfile:
+    """
+    Build a thread profile from resource_usage.jsonl files of runs with different thread counts
+
+    For each tool, the median wall time is taken for each thread count,
+    and the useful threads are the fewest threads whose wall time is within TOLERANCE of the fastest.
+    """
+
+    TOLERANCE = 0.1
+
+    resource_usage_jsonls: List[str]
+    json_path: str
+
+    wall_times: Dict[str, Dict[int, List[float]]]
+    tools: Dict[str, int]
+
+    def main(self, resource_usage_jsonls: List[str], json_path: str) -> Dict[str, int]:
+        self.resource_usage_jsonls = resource_usage_jsonls
+        self.json_path = json_path
+
+        self.read_wall_times()
+        self.set_tools()
+        self.write_json()
+
+        return self.tools
+
+    def read_wall_times(self):
+        self.wall_times = {}
+        for jsonl in self.resource_usage_jsonls:
+            with open(jsonl) as fh:
+                for line in fh:
+                    record = json.loads(line)
+                    tool = tool_name(record['cmd'])
+                    if tool is None or record['returncode'] != 0:
+                        continue
+                    self.wall_times.setdefault(tool, {}).setdefault(record['threads'], []).append(record['wall_time'])
+
+    def set_tools(self):
+        self.tools = {}
+        for tool, by_threads in self.wall_times.items():
+            medians = {t: statistics.median(w) for t, w in by_threads.items()}
+            fastest = min(medians.values())
+            self.tools[tool] = min(t for t, w in medians.items() if w <= fastest * (1 + self.TOLERANCE))
+
+    def write_json(self):
+        data = {
+            'tolerance': self.TOLERANCE,
+            'tools': self.tools,
+            'wall_times': {
+                tool: {str(t): statistics.median(w) for t, w in sorted(by_threads.items())}
+                for tool, by_threads in self.wall_times.items()
+            },
+        }
+        with open(self.json_path, 'w') as fh:
+            json.dump(data, fh, indent=2)
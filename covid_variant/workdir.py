@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+from typing import List, Optional
+from .template import Logger
+
+
+DISK = 'disk'
+MEMORY = 'memory'
+SCRATCH = 'scratch'  # resolved only as the fallback of MEMORY, not a choice on the command line
+BACKENDS = [DISK, MEMORY]
+MEMORY_ROOT = '/dev/shm'
+WORKDIR_USAGE_FILENAME = 'workdir_usage.json'
+COMPRESSION_RATIO = 4
+SAM_OVERHEAD = 1.5  # SAM fields and header on top of the read sequence and quality
+INDEX_BYTES = 2 ** 24  # bowtie2 index of a ~30-kb genome, with ample margin
+
+
+def estimate_intermediate_bytes(
+        fqs: List[str],
+        intermediate_codec: str,
+        stream_mapping: bool) -> int:
+    """
+    Rough upper bound of the bytes written to the workdir, from the sizes of the input fastq files
+
+    The workdir holds the trimmed and the subsampled fastq files (in intermediate_codec),
+    aligned.sam and aligned.bam (or the spill files of samtools sort in stream mapping),
+    and the bowtie2 index. Compressed fastq is assumed to expand COMPRESSION_RATIO-fold.
+    """
+    from .fastq import detect_codec, NONE  # fastq imports numpy, not needed by the package import
+
+    plain = 0
+    for fq in fqs:
+        size = os.path.getsize(fq)
+        plain += size if detect_codec(fq) == NONE else size * COMPRESSION_RATIO
+
+    compressed = plain / COMPRESSION_RATIO
+    fastq = 2 * (plain if intermediate_codec == NONE else compressed)  # trimmed + subsampled
+    alignment = compressed if stream_mapping else plain * SAM_OVERHEAD + compressed
+    return int(fastq + alignment + INDEX_BYTES)
+
+
+class ResolveWorkdirBackend:
+    """
+    Decide where the workdir of a run is placed
+
+    disk:
+        In the current directory
+
+    memory:
+        In MEMORY_ROOT (RAM-backed tmpfs), if the estimated intermediate size fits within
+        both memory_budget and the free space of MEMORY_ROOT
+
+    scratch:
+        Fallback of memory, in the local scratch directory ($TMPDIR, otherwise /tmp) if the estimated
+        intermediate size fits in its free space, instead of the current directory, which may be on a network filesystem.
+        Falls back to disk if it does not fit either
+    """
+
+    backend: str
+    memory_budget: int
+    fqs: List[str]
+    intermediate_codec: str
+    stream_mapping: bool
+    memory_root: str
+    scratch_root: str
+
+    estimate: int
+
+    logger: Logger
+
+    def __init__(self, debug: bool = False):
+        self.logger = Logger(
+            name=self.__class__.__name__,
+            level=Logger.DEBUG if debug else Logger.INFO)
+
+    def main(
+            self,
+            backend: str,
+            memory_budget: int,
+            fqs: List[Optional[str]],
+            intermediate_codec: str,
+            stream_mapping: bool,
+            memory_root: str = MEMORY_ROOT,
+            scratch_root: Optional[str] = None) -> str:
+        """
+        memory_budget:
+            Bytes
+
+        scratch_root:
+            tempfile.gettempdir() if None
+
+        Returns the resolved backend, 'disk', 'memory' or 'scratch'
+        """
+        assert backend in BACKENDS
+        self.backend = backend
+        self.memory_budget = memory_budget
+        self.fqs = [fq for fq in fqs if fq is not None]
+        self.intermediate_codec = intermediate_codec
+        self.stream_mapping = stream_mapping
+        self.memory_root = memory_root
+        self.scratch_root = tempfile.gettempdir() if scratch_root is None else scratch_root
+
+        if self.backend == DISK:
+            return DISK
+
+        self.estimate = estimate_intermediate_bytes(
+            fqs=self.fqs,
+            intermediate_codec=self.intermediate_codec,
+            stream_mapping=self.stream_mapping)
+        if self.fits(root=self.memory_root, budget=self.memory_budget):
+            return MEMORY
+        if self.fits(root=self.scratch_root):
+            return SCRATCH
+        self.logger.info('Fall back to the workdir on disk')
+        return DISK
+
+    def fits(self, root: str, budget: Optional[int] = None) -> bool:
+        if not os.path.isdir(root):
+            self.logger.info(f'{root} does not exist')
+            return False
+
+        available = shutil.disk_usage(root).free
+        if budget is not None:
+            available = min(budget, available)
+        if self.estimate > available:
+            self.logger.info(f'Estimated intermediate size {self.estimate} bytes exceeds the available {available} bytes in {root}')
+            return False
+
+        self.logger.info(f'Estimated intermediate size {self.estimate} bytes, place the workdir in {root}')
+        return True
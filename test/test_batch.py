@@ -0,0 +1,108 @@
+import os
+import json
+import pandas as pd
+from covid_variant.batch import Batch, SummarizeResults
+from .setup import TestCase
+
+
+class TestBatch(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        fq_dir = f'{os.path.dirname(self.indir)}/test_covid_variant'
+        sample_sheet = f'{self.workdir}/sample_sheet.csv'
+        pd.DataFrame(data={
+            'sample_id': ['paired', 'unpaired'],
+            'fq1': [f'{fq_dir}/54Ct21-NY-23572315_S54_L001_R1.fq.gz'] * 2,
+            'fq2': [f'{fq_dir}/54Ct21-NY-23572315_S54_L001_R2.fq.gz', None],
+        }).to_csv(sample_sheet, index=False)
+
+        Batch().main(
+            sample_sheet=sample_sheet,
+            outdir=self.outdir,
+            threads=4,
+            threads_per_sample=2,
+            pipelined=False,
+            options=self.options())
+
+        summary = pd.read_csv(f'{self.outdir}/summary.csv')
+        self.assertListEqual(['paired', 'unpaired'], list(summary['Sample ID']))
+        self.assertListEqual(['Done', 'Done'], list(summary['Status']))
+        for sample_id in ['paired', 'unpaired']:
+            self.assertTrue(os.path.exists(f'{self.outdir}/{sample_id}/result.txt'))
+
+    def test_pipelined(self):
+        fq_dir = f'{os.path.dirname(self.indir)}/test_covid_variant'
+        sample_sheet = f'{self.workdir}/sample_sheet.csv'
+        pd.DataFrame(data={
+            'sample_id': ['1', '2', '3'],
+            'fq1': [f'{fq_dir}/54Ct21-NY-23572315_S54_L001_R1.fq.gz'] * 3,
+            'fq2': [f'{fq_dir}/54Ct21-NY-23572315_S54_L001_R2.fq.gz'] * 3,
+        }).to_csv(sample_sheet, index=False)
+
+        Batch().main(
+            sample_sheet=sample_sheet,
+            outdir=self.outdir,
+            threads=4,
+            threads_per_sample=4,
+            pipelined=True,
+            options=self.options())
+
+        summary = pd.read_csv(f'{self.outdir}/summary.csv')
+        self.assertListEqual(['Done'] * 3, list(summary['Status']))
+        with open(f'{self.outdir}/timing.json') as fh:
+            timing = json.load(fh)
+        self.assertEqual(3, timing['samples_done'])
+        self.assertListEqual(['1', '2', '3'], sorted(s['sample_id'] for s in timing['samples']))
+
+    def options(self) -> dict:
+        return dict(
+            tolerate_missing=0.1,
+            target_coverage=float('inf'),
+            single_pass_sampling=False,
+            sampling_scheme='v1',
+            depth_normalization=False,
+            unordered_input=False,
+            intermediate_codec='gzip',
+            compression_level=None,
+            stream_mapping=False,
+            calling_regions=1,
+            variant_caller='bcftools',
+            thread_profile=None,
+            index_cache_dir=None,
+            workdir_backend='disk',
+            memory_budget=4.0,
+            resume=False,
+            debug=False)
+
+
+class TestSummarizeResults(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        os.makedirs(f'{self.outdir}/A')
+        with open(f'{self.outdir}/A/result.txt', 'w') as fh:
+            fh.write('Spike protein mutations: N501Y, D614G\nMatch: B.1.1.7 [United Kingdom]\n')
+
+        actual = SummarizeResults().main(
+            outdir=self.outdir,
+            sample_ids=['A', 'B'],
+            status={'A': 'Done', 'B': 'Failed: FileNotFoundError()'})
+
+        expected = pd.DataFrame(data={
+            'Sample ID': ['A', 'B'],
+            'Spike Protein Mutations': ['N501Y, D614G', None],
+            'Match': ['B.1.1.7 [United Kingdom]', None],
+            'Status': ['Done', 'Failed: FileNotFoundError()'],
+        })
+        pd.testing.assert_frame_equal(expected, actual)
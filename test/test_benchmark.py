@@ -0,0 +1,65 @@
+import json
+from covid_variant.benchmark import StageTimer, compare_benchmarks, throughput
+from .setup import TestCase
+
+
+class Stages:
+
+    def first(self):
+        return 1
+
+    def second(self):
+        raise ValueError
+
+
+class TestStageTimer(TestCase):
+
+    def test_wrap(self):
+        obj = Stages()
+        timer = StageTimer()
+        timer.wrap(obj=obj, stages=['first', 'second'])
+
+        self.assertEqual(1, obj.first())
+        self.assertEqual(1, obj.first())
+        with self.assertRaises(ValueError):
+            obj.second()
+
+        self.assertListEqual(['first', 'second'], sorted(timer.seconds.keys()))
+        self.assertEqual('first', obj.first.__name__)
+
+
+class TestCompareBenchmarks(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def write_json(self, name: str, mapping_seconds: float) -> str:
+        data = {
+            'runs': [{
+                'coverage': 50,
+                'threads': 4,
+                'reads': 100,
+                'bases': 15000,
+                'total': throughput(mapping_seconds + 1, 100, 15000),
+                'stages': {
+                    'trimming': throughput(1, 100, 15000),
+                    'mapping': throughput(mapping_seconds, 100, 15000),
+                },
+            }]
+        }
+        json_path = f'{self.outdir}/{name}.json'
+        with open(json_path, 'w') as fh:
+            json.dump(data, fh)
+        return json_path
+
+    def test_main(self):
+        df = compare_benchmarks(
+            baseline_json=self.write_json(name='baseline', mapping_seconds=4),
+            contender_json=self.write_json(name='contender', mapping_seconds=2))
+
+        self.assertListEqual(['total', 'trimming', 'mapping'], list(df['Stage']))
+        self.assertListEqual([4, 4, 4], list(df['Threads']))
+        self.assertListEqual([5 / 3, 1., 2.], list(df['Speedup']))
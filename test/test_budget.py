@@ -0,0 +1,42 @@
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from covid_variant.budget import ThreadBudget, reserve_threads
+from .setup import TestCase
+
+
+def busy(budget: ThreadBudget, n: int, in_use, lock) -> int:
+    """
+    Returns the number of tokens in use by all workers while this one holds its tokens
+    """
+    with reserve_threads(budget, n):
+        with lock:
+            in_use.value += n
+            peak = in_use.value
+        time.sleep(0.05)
+        with lock:
+            in_use.value -= n
+    return peak
+
+
+class TestThreadBudget(TestCase):
+
+    def test_never_exceeded(self):
+        with multiprocessing.Manager() as manager:
+            budget = ThreadBudget(manager=manager, total=4)
+            in_use, lock = manager.Value('i', 0), manager.Lock()
+            with ProcessPoolExecutor(max_workers=6) as executor:
+                futures = [executor.submit(busy, budget, n, in_use, lock) for n in [4, 1, 1, 2, 3, 1] * 2]
+                peaks = [f.result() for f in futures]
+
+        self.assertLessEqual(max(peaks), 4)
+
+    def test_more_than_total(self):
+        with multiprocessing.Manager() as manager:
+            budget = ThreadBudget(manager=manager, total=2)
+            with reserve_threads(budget, 8):  # capped at the total instead of waiting forever
+                pass
+
+    def test_no_budget(self):
+        with reserve_threads(None, 8):
+            pass
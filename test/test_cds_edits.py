@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import pandas as pd
+from covid_variant.cds_edits import CdsEdits, SUBSTITUTE, DELETE, INSERT
+from .setup import TestCase
+
+
+class TestCdsEdits(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.df = pd.DataFrame(data={
+            'Position': [30, 10, 20, 21, 20, 40],
+            'Type': ['insert', 'substitute', 'delete', 'delete', 'substitute', 'insert'],
+            'Base': ['ac', 'T', np.nan, np.nan, 'G', 'GGT'],
+        })
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_from_df(self):
+        edits = CdsEdits.from_df(self.df)
+        self.assertListEqual([10, 20, 20, 21, 30, 40], edits.positions.tolist())
+        self.assertListEqual([SUBSTITUTE, DELETE, SUBSTITUTE, DELETE, INSERT, INSERT], edits.types.tolist())
+        self.assertEqual(b'TGacGGT', edits.bases.tobytes())
+        self.assertEqual(np.int8, edits.types.dtype)
+
+    def test_slice(self):
+        edits = CdsEdits.from_df(self.df)
+        sliced = edits.slice(start=20, end=30)
+
+        self.assertEqual(4, len(sliced))
+        self.assertListEqual([(20, 'G')], list(sliced.iter_type(SUBSTITUTE)))
+        self.assertListEqual([(20, ''), (21, '')], list(sliced.iter_type(DELETE)))
+        self.assertListEqual([(30, 'ac')], list(sliced.iter_type(INSERT)))
+        for name in ['positions', 'types', 'bases', 'offsets']:
+            self.assertTrue(np.shares_memory(getattr(edits, name), getattr(sliced, name)))
+        self.assertEqual(0, len(edits.slice(start=41, end=100)))
+
+    def test_to_df(self):
+        edits = CdsEdits.from_df(self.df)
+        self.assertDataFrameEqual(self.df, edits.to_df())  # input order, not sorted by position
+
+        expected = self.df.iloc[[0, 2, 3, 4]].reset_index(drop=True)
+        self.assertDataFrameEqual(expected, edits.slice(start=20, end=30).to_df())
+
+    def test_csv_unsorted(self):
+        csv = f'{self.outdir}/cds_edit.csv'
+        CdsEdits.from_df(self.df).to_csv(csv)
+        self.assertDataFrameEqual(self.df, pd.read_csv(csv))
+
+    def test_csv(self):
+        csv = f'{os.path.dirname(self.indir)}/test_read_gbk_mutate/cds_edit.csv'
+        edits = CdsEdits.read_csv(csv)
+        actual = f'{self.outdir}/cds_edit.csv'
+        edits.to_csv(actual)
+        self.assertFileEqual(csv, actual)
+        self.assertLess(edits.nbytes, 4096)
+
+    def test_empty(self):
+        edits = CdsEdits.from_df(pd.DataFrame(columns=['Position', 'Type', 'Base']))
+        self.assertEqual(0, len(edits))
+        self.assertEqual(0, len(edits.slice(start=1, end=100)))
+        self.assertListEqual(['Position', 'Type', 'Base'], list(edits.to_df().columns))
@@ -0,0 +1,80 @@
+import os
+from covid_variant.checkpoint import Checkpoint
+from .setup import TestCase
+
+
+class Upper:
+
+    infile: str
+    outfile: str
+    n_calls: int
+
+    def __init__(self, infile: str, outfile: str):
+        self.infile = infile
+        self.outfile = None
+        self.n_calls = 0
+        self.__outfile = outfile
+
+    def stage(self):
+        self.n_calls += 1
+        self.outfile = self.__outfile
+        with open(self.infile) as reader:
+            with open(self.outfile, 'w') as writer:
+                writer.write(reader.read().upper())
+
+
+class TestCheckpoint(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.settings.resume = True
+        self.infile = f'{self.workdir}/in.txt'
+        self.write_infile('acgt')
+        self.obj = Upper(infile=self.infile, outfile=f'{self.workdir}/out.txt')
+
+    def tearDown(self):
+        self.tear_down()
+
+    def write_infile(self, text: str):
+        with open(self.infile, 'w') as fh:
+            fh.write(text)
+
+    def run_stage(self, params=None) -> bool:
+        self.obj.outfile = None
+        return Checkpoint(self.settings).main(
+            obj=self.obj,
+            stage=self.obj.stage,
+            inputs=['infile'],
+            outputs=['outfile'],
+            params=params)
+
+    def test_skip_completed(self):
+        self.assertFalse(self.run_stage())
+        self.assertTrue(self.run_stage())
+        self.assertEqual(1, self.obj.n_calls)
+        self.assertEqual(f'{self.workdir}/out.txt', self.obj.outfile)  # restored from the manifest
+
+    def test_changed_input(self):
+        self.run_stage()
+        self.write_infile('tttt')
+        self.assertFalse(self.run_stage())
+        self.assertEqual(2, self.obj.n_calls)
+
+    def test_changed_params(self):
+        self.run_stage(params={'level': 1})
+        self.assertFalse(self.run_stage(params={'level': 2}))
+        self.assertTrue(self.run_stage(params={'level': 2}))
+        self.assertEqual(2, self.obj.n_calls)
+
+    def test_missing_output(self):
+        self.run_stage()
+        os.remove(f'{self.workdir}/out.txt')
+        self.assertFalse(self.run_stage())
+        self.assertEqual(2, self.obj.n_calls)
+
+    def test_not_resume(self):
+        self.settings.resume = False
+        self.run_stage()
+        self.run_stage()
+        self.assertEqual(2, self.obj.n_calls)
+        self.assertFalse(os.path.exists(f'{self.workdir}/checkpoints'))
@@ -0,0 +1,34 @@
+import os
+import pandas as pd
+from covid_variant.cohort import Cohort, sample_id_of
+from .setup import TestCase
+
+
+class TestCohort(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        actual = Cohort(self.settings).main(
+            vcf=f'{self.indir}/{self.__class__.__name__}_in.vcf',
+            gbk=f'{self.indir}/NC_045512.2.gb',
+            covid_variant_csv=f'{self.indir}/variants.csv',
+            tolerate_missing=0.7)
+
+        self.assertListEqual(['plate1_A01', 'plate1_A02', 'plate1_A03'], list(actual['Sample ID']))
+        self.assertListEqual(['69del, 70del, N501Y, D614G', 'D614G', ''], list(actual['Spike Protein Mutations']))
+        self.assertListEqual(['B.1.1.7 [United Kingdom]', '', ''], list(actual['Match']))
+        self.assertListEqual(['Done'] * 3, list(actual['Status']))
+
+        self.assertDataFrameEqual(actual, pd.read_csv(f'{self.outdir}/summary.csv', keep_default_na=False))
+        for sample_id in actual['Sample ID']:
+            for file in ['cds_edit.csv', 'mutations.csv', 'result.txt']:
+                self.assertTrue(os.path.isfile(f'{self.outdir}/{sample_id}/{file}'))
+
+    def test_sample_id_of(self):
+        self.assertEqual('plate1_A01', sample_id_of('plate1/A01'))
+        self.assertEqual('S-1.a_b', sample_id_of('S-1.a b'))
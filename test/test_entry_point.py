@@ -0,0 +1,33 @@
+import os
+import sys
+import time
+import subprocess
+from .setup import TestCase
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['pandas', 'numpy', 'Bio', 'ngslite']
+
+
+class TestEntryPoint(TestCase):
+
+    HELP_TIME_RATIO = 10  # relative to a bare interpreter startup, best of N_RUNS
+    N_RUNS = 3
+
+    def best_time(self, args: list) -> float:
+        times = []
+        for _ in range(self.N_RUNS):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + args, stdout=subprocess.DEVNULL, check=True)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    def test_help_time(self):
+        baseline = self.best_time(['-c', 'pass'])
+        self.assertLess(self.best_time([ROOT, '--help']), self.HELP_TIME_RATIO * baseline)
+
+    def test_import_is_light(self):
+        code = f'import sys, covid_variant; print(*[m for m in {HEAVY_MODULES} if m in sys.modules])'
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=ROOT, stdout=subprocess.PIPE, text=True, check=True).stdout
+        self.assertEqual('', output.strip())
@@ -0,0 +1,119 @@
+import gzip
+import unittest
+import numpy as np
+from covid_variant.fastq import FastqReader, FastqBlockReader, open_fastq, detect_codec
+from .setup import TestCase
+
+
+try:
+    import zstandard
+    HAS_ZSTANDARD = True
+except ModuleNotFoundError:
+    HAS_ZSTANDARD = False
+
+
+RECORDS = [f'@read{i}\nACGT{"A" * i}\n+\nFFFF{"F" * i}\n'.encode() for i in range(10)]
+
+
+class TestFastqReader(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.fq = f'{self.workdir}/in.fq.gz'
+        with gzip.open(self.fq, 'wb') as fh:
+            fh.write(b''.join(RECORDS))
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_records(self):
+        reader = FastqReader(self.fq)
+        records = list(reader.records())
+        reader.close()
+
+        self.assertListEqual(RECORDS, [b''.join(lines) for lines, bases in records])
+        self.assertListEqual([4 + i for i in range(10)], [bases for lines, bases in records])
+        self.assertEqual(sum(4 + i for i in range(10)), reader.read_bases)
+
+
+class TestFastqBlockReader(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.fq = f'{self.workdir}/in.fq.gz'
+
+    def tearDown(self):
+        self.tear_down()
+
+    def write(self, data: bytes):
+        with gzip.open(self.fq, 'wb') as fh:
+            fh.write(data)
+
+    def read_all(self, block_size: int) -> list:
+        reader = FastqBlockReader(self.fq)
+        reader.BLOCK_SIZE = block_size
+        records = []
+        while not reader.eof:
+            reader.fill()
+            for _ in range(reader.n_records):
+                records.append(reader.take(np.array([True])))
+        reader.close()
+        return records
+
+    def test_record_boundaries_across_blocks(self):
+        self.write(b''.join(RECORDS))
+        for block_size in [1, 7, 50, 2 ** 22]:
+            self.assertListEqual(RECORDS, self.read_all(block_size=block_size))
+
+    def test_missing_final_newline(self):
+        self.write(b''.join(RECORDS)[:-1])
+        self.assertListEqual(RECORDS, self.read_all(block_size=7))
+
+    def test_take_kept_records(self):
+        self.write(b''.join(RECORDS))
+        reader = FastqBlockReader(self.fq)
+        reader.fill()
+        reader.fill()
+        keep = np.array([i % 3 == 0 for i in range(10)])
+        actual = reader.take(keep)
+        reader.close()
+
+        expected = b''.join(r for r, k in zip(RECORDS, keep) if k)
+        self.assertEqual(expected, actual)
+        self.assertEqual(0, reader.n_records)
+
+
+class TestOpenFastq(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def round_trip(self, codec: str, level=None):
+        fq = f'{self.workdir}/out.fq'
+        with open_fastq(fq, mode='wb', codec=codec, level=level) as fh:
+            fh.write(b''.join(RECORDS))
+
+        self.assertEqual(codec, detect_codec(fq))
+        with open_fastq(fq) as fh:
+            self.assertEqual(b''.join(RECORDS), fh.read())
+
+        reader = FastqReader(fq)
+        self.assertEqual(len(RECORDS), len(list(reader.records())))
+        self.assertEqual(reader.compressed_size, reader.compressed_pos)
+        reader.close()
+
+    def test_none(self):
+        self.round_trip(codec='none')
+
+    def test_gzip(self):
+        self.round_trip(codec='gzip')
+
+    def test_gzip_level_1(self):
+        self.round_trip(codec='gzip', level=1)
+
+    @unittest.skipUnless(HAS_ZSTANDARD, 'zstandard not installed')
+    def test_zstd(self):
+        self.round_trip(codec='zstd', level=3)
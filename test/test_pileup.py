@@ -0,0 +1,115 @@
+import random
+import shutil
+import unittest
+from covid_variant.pileup import PileupCaller
+from covid_variant.pipeline import VariantCalling
+from covid_variant.process_vcf import ReadVcf, RemoveConflictVariants
+from .setup import TestCase
+
+
+def read_alleles(vcf: str) -> list:
+    with open(vcf) as fh:
+        return [tuple(line.split('\t')[1:5]) for line in fh if not line.startswith('#')]
+
+
+def resolved_deletions(processor: TestCase, vcf: str) -> list:
+    df = ReadVcf(processor.settings).main(vcf=vcf, columns=RemoveConflictVariants.COLUMNS_IN)
+    df = RemoveConflictVariants(processor.settings).main(indf=df)
+    return [len(ref) - len(alt) for ref, alt in zip(df['REF'], df['ALT']) if len(ref) > len(alt)]
+
+
+class TestPileupCaller(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        rng = random.Random(1)
+        self.genome = ''.join(rng.choices('acgt', k=60)) + 'aaaa' + ''.join(rng.choices('cgt', k=136))
+        self.fna = f'{self.workdir}/genome.fna'
+        with open(self.fna, 'w') as fh:
+            fh.write(f'>chr1 test genome\n{self.genome}\n')
+        self.sam = f'{self.workdir}/aligned.sam'
+        self.vcf = f'{self.outdir}/raw.vcf'
+
+    def tearDown(self):
+        self.tear_down()
+
+    def write_sam(self, reads: list):
+        with open(self.sam, 'w') as fh:
+            fh.write('@SQ\tSN:chr1\tLN:200\n')
+            for i, (flag, pos, cigar, seq, qual) in enumerate(reads):
+                fh.write(f'read{i}\t{flag}\tchr1\t{pos}\t42\t{cigar}\t*\t0\t0\t{seq}\t{qual}\n')
+
+    def test_snv(self):
+        ref = self.genome[9:49].upper()
+        alt = ref[:20] + ('A' if ref[20] != 'A' else 'C') + ref[21:]
+        self.write_sam(
+            [(0, 10, '40M', alt, 'I' * 40)] * 4
+            + [(16, 10, '40M', ref, 'I' * 40)] * 2
+            + [(0, 10, '40M', ref, 'I' * 20 + '#' + 'I' * 19)] * 5  # ref base below the base quality cutoff
+            + [(4, 10, '40M', ref, 'I' * 40)] * 5)  # unmapped
+
+        PileupCaller(self.settings).main(fna=self.fna, bam=self.sam, vcf=self.vcf)
+
+        self.assertListEqual([('30', '.', ref[20], alt[20])], read_alleles(self.vcf))
+
+    def test_minority_allele(self):
+        ref = self.genome[9:49].upper()
+        alt = ref[:20] + ('A' if ref[20] != 'A' else 'C') + ref[21:]
+        self.write_sam([(0, 10, '40M', alt, 'I' * 40)] * 3 + [(0, 10, '40M', ref, 'I' * 40)] * 3)
+
+        PileupCaller(self.settings).main(fna=self.fna, bam=self.sam, vcf=self.vcf)
+
+        self.assertListEqual([], read_alleles(self.vcf))
+
+    def test_left_normalized_indels(self):
+        g = self.genome.upper()
+        deleted = g[40:62] + g[63:100]  # one 'a' of the poly-A at 61-64 (1-based) deleted in the middle
+        inserted = g[100:150] + 'GG' + g[150:170]
+        self.write_sam(
+            [(0, 41, '22M1D37M', deleted, 'I' * 59)] * 3
+            + [(0, 101, '50M2I20M', inserted, '*')] * 3)
+
+        PileupCaller(self.settings).main(fna=self.fna, bam=self.sam, vcf=self.vcf)
+
+        anchor = self.genome[59]
+        expected_insertion = self.left_normalized_insertion(pos=150, bases='GG')
+        self.assertListEqual(
+            [('60', '.', anchor + 'a', anchor), expected_insertion],
+            read_alleles(self.vcf))
+
+    def write_conflicting_deletions(self):
+        """
+        30 reads with a 6-bp deletion of 81-86, and 90 reads, starting after its anchor,
+        with an overlapping 3-bp deletion of 84-86, such that both deletions are called
+        """
+        g = self.genome.upper()
+        self.write_sam(
+            [(0, 41, '40M6D40M', g[40:80] + g[86:126], 'I' * 80)] * 30
+            + [(0, 82, '2M3D40M', g[81:83] + g[86:126], 'I' * 42)] * 90)
+
+    def test_conflicting_deletions(self):
+        self.write_conflicting_deletions()
+        PileupCaller(self.settings).main(fna=self.fna, bam=self.sam, vcf=self.vcf)
+
+        quals = [float(line.split('\t')[5]) for line in open(self.vcf) if not line.startswith('#')]
+        self.assertEqual(2, len(quals))
+        self.assertListEqual([3], resolved_deletions(self, self.vcf))  # the better supported deletion
+
+    @unittest.skipUnless(shutil.which('samtools') and shutil.which('bcftools'), 'samtools and bcftools are required')
+    def test_conflicting_deletions_as_bcftools(self):
+        self.write_conflicting_deletions()
+        bam = f'{self.workdir}/aligned_sorted.bam'
+        PileupCaller(self.settings).call(f'samtools sort -o {bam} {self.sam}')
+
+        PileupCaller(self.settings).main(fna=self.fna, bam=self.sam, vcf=self.vcf)
+        self.settings.variant_caller = 'bcftools'
+        bcftools_vcf = VariantCalling(self.settings).main(fna=self.fna, bam=bam)
+
+        self.assertListEqual(resolved_deletions(self, bcftools_vcf), resolved_deletions(self, self.vcf))
+
+    def left_normalized_insertion(self, pos: int, bases: str) -> tuple:
+        while self.genome[pos - 1].upper() == bases[-1]:
+            bases = self.genome[pos - 1].upper() + bases[:-1]
+            pos -= 1
+        anchor = self.genome[pos - 1]
+        return str(pos), '.', anchor, anchor + bases
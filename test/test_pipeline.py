@@ -1,7 +1,31 @@
-from covid_variant.pipeline import VariantCallingPipeline
+import os
+import time
+import gzip
+import random
+from ngslite import read_genbank
+from covid_variant.fastq import detect_codec
+from covid_variant.process_vcf import ReadVcf, RemoveConflictVariants
+from covid_variant.pipeline import VariantCallingPipeline, Bowtie2IndexCache, Sampling, SamplingUnpaired, SamplingPaired, \
+    EarlyStopTrimming, MergeRegionVcfs, split_regions, stream_mapping_threads
 from .setup import TestCase
 
 
+GENOME_SIZE = 29903
+
+
+def write_random_fq(fq: str, n_reads: int, read_length: int, seed: int):
+    rng = random.Random(seed)
+    with gzip.open(fq, 'wt') as fh:
+        for i in range(n_reads):
+            seq = ''.join(rng.choices('ACGT', k=read_length))
+            fh.write(f'@read{i}\n{seq}\n+\n{"F" * read_length}\n')
+
+
+def count_bases(fq: str) -> int:
+    with gzip.open(fq, 'rt') as fh:
+        return sum(len(line.strip()) for i, line in enumerate(fh) if i % 4 == 1)
+
+
 class TestVariantCallingPipeline(TestCase):
 
     def setUp(self):
@@ -30,6 +54,56 @@ class TestVariantCallingPipeline(TestCase):
         expected = f'{self.indir}/unpaired_raw.vcf'
         self.assertVcfEqual(expected, actual)
 
+    def test_paired_stream_mapping(self):
+        self.settings.stream_mapping = True
+        actual = VariantCallingPipeline(self.settings).main(
+            gbk=f'{self.indir}/NC_045512.2.gb',
+            fq1=f'{self.indir}/54Ct21-NY-23572315_S54_L001_R1.fq.gz',
+            fq2=f'{self.indir}/54Ct21-NY-23572315_S54_L001_R2.fq.gz',
+            target_coverage=50.,
+        )
+        expected = f'{self.indir}/paired_raw.vcf'
+        self.assertVcfEqual(expected, actual)
+
+    def test_paired_region_parallel(self):
+        self.settings.calling_regions = 4
+        actual = VariantCallingPipeline(self.settings).main(
+            gbk=f'{self.indir}/NC_045512.2.gb',
+            fq1=f'{self.indir}/54Ct21-NY-23572315_S54_L001_R1.fq.gz',
+            fq2=f'{self.indir}/54Ct21-NY-23572315_S54_L001_R2.fq.gz',
+            target_coverage=50.,
+        )
+        expected = f'{self.indir}/paired_raw.vcf'
+        self.assertListEqual(read_records(expected), read_records(actual))  # headers differ by the --regions option
+
+    def test_paired_pileup_caller(self):
+        self.settings.variant_caller = 'pileup'
+        actual = VariantCallingPipeline(self.settings).main(
+            gbk=f'{self.indir}/NC_045512.2.gb',
+            fq1=f'{self.indir}/54Ct21-NY-23572315_S54_L001_R1.fq.gz',
+            fq2=f'{self.indir}/54Ct21-NY-23572315_S54_L001_R2.fq.gz',
+            target_coverage=50.,
+        )
+        expected = f'{self.indir}/paired_raw.vcf'
+        self.assertListEqual(read_alleles(expected), read_alleles(actual))  # QUAL and INFO differ from bcftools
+        self.assertListEqual(self.resolve_conflicts(expected), self.resolve_conflicts(actual))  # but rank variants alike
+
+    def resolve_conflicts(self, vcf: str) -> list:
+        df = ReadVcf(self.settings).main(vcf=vcf, columns=RemoveConflictVariants.COLUMNS_IN)
+        df = RemoveConflictVariants(self.settings).main(indf=df)
+        return list(zip(df['POS'], df['REF'], df['ALT']))
+
+    def test_paired_unordered_input(self):
+        self.settings.unordered_input = True
+        VariantCallingPipeline(self.settings).main(
+            gbk=f'{self.indir}/NC_045512.2.gb',
+            fq1=f'{self.indir}/54Ct21-NY-23572315_S54_L001_R1.fq.gz',
+            fq2=f'{self.indir}/54Ct21-NY-23572315_S54_L001_R2.fq.gz',
+            target_coverage=20.,
+        )
+        trimmed_bases = count_bases(f'{self.workdir}/trimmed.1.fq.gz') + count_bases(f'{self.workdir}/trimmed.2.fq.gz')
+        self.assertAlmostEqual(20., trimmed_bases / GENOME_SIZE, delta=1.)
+
     def assertVcfEqual(self, expected: str, actual: str):
         with open(expected) as fh1:
             with open(actual) as fh2:
@@ -37,3 +111,406 @@ class TestVariantCallingPipeline(TestCase):
                     if line1.startswith('##bcftools_callCommand'):  # Skip the time stamp in this line
                         continue
                     self.assertEqual(line1, line2)
+
+
+class TestBowtie2IndexCache(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.settings.mock = True
+        self.settings.index_cache_dir = f'{self.workdir}/index_cache'
+        self.fna = f'{self.workdir}/genome.fna'
+        with open(self.fna, 'w') as fh:
+            fh.write('>chr\nACGT\n')
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_build_then_reuse(self):
+        first = Bowtie2IndexCache(self.settings).main(fna=self.fna)
+        second = Bowtie2IndexCache(self.settings).main(fna=self.fna)
+
+        self.assertEqual(first, second)
+        self.assertTrue(os.path.isfile(first))  # genome.fna is stored along with the index
+        self.assertEqual(1, len(os.listdir(self.settings.index_cache_dir)))
+
+    def test_different_reference(self):
+        first = Bowtie2IndexCache(self.settings).main(fna=self.fna)
+        with open(self.fna, 'w') as fh:
+            fh.write('>chr\nTTTT\n')
+        second = Bowtie2IndexCache(self.settings).main(fna=self.fna)
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(2, len(os.listdir(self.settings.index_cache_dir)))
+
+
+class TestSinglePassSampling(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.settings.single_pass_sampling = True
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_unpaired(self):
+        fq = f'{self.workdir}/in.fq.gz'
+        write_random_fq(fq=fq, n_reads=20000, read_length=100, seed=1)
+
+        sub_fq = SamplingUnpaired(self.settings).main(
+            gbk=f'{self.indir}/NC_045512.2.gb',
+            fq=fq,
+            target_coverage=20.)
+
+        coverage = count_bases(sub_fq) / GENOME_SIZE
+        self.assertAlmostEqual(20., coverage, delta=20. * SamplingUnpaired.TOLERANCE)
+
+    def test_paired(self):
+        fq1, fq2 = f'{self.workdir}/in.1.fq.gz', f'{self.workdir}/in.2.fq.gz'
+        write_random_fq(fq=fq1, n_reads=20000, read_length=100, seed=1)
+        write_random_fq(fq=fq2, n_reads=20000, read_length=100, seed=2)
+
+        sub_fq1, sub_fq2 = SamplingPaired(self.settings).main(
+            gbk=f'{self.indir}/NC_045512.2.gb',
+            fq1=fq1,
+            fq2=fq2,
+            target_coverage=40.)
+
+        coverage = (count_bases(sub_fq1) + count_bases(sub_fq2)) / GENOME_SIZE
+        self.assertAlmostEqual(40., coverage, delta=40. * SamplingPaired.TOLERANCE)
+        self.assertEqual(count_bases(sub_fq1), count_bases(sub_fq2))
+
+    def test_changing_compression_ratio(self):
+        fq = f'{self.workdir}/in.fq.gz'
+        with gzip.open(fq, 'wt') as fh:  # low-complexity reads compress far better than the random reads after them
+            for i in range(20000):
+                fh.write(f'@low{i}\n{"A" * 100}\n+\n{"F" * 100}\n')
+        with gzip.open(fq, 'at') as fh:
+            rng = random.Random(1)
+            for i in range(20000):
+                fh.write(f'@read{i}\n{"".join(rng.choices("ACGT", k=100))}\n+\n{"F" * 100}\n')
+
+        sub_fq = SamplingUnpaired(self.settings).main(
+            gbk=f'{self.indir}/NC_045512.2.gb',
+            fq=fq,
+            target_coverage=40.)
+
+        coverage = count_bases(sub_fq) / GENOME_SIZE
+        self.assertAlmostEqual(40., coverage, delta=40. * SamplingUnpaired.TOLERANCE)
+
+    def test_below_target(self):
+        fq = f'{self.workdir}/in.fq.gz'
+        write_random_fq(fq=fq, n_reads=20000, read_length=100, seed=1)
+
+        for target_coverage in [100., float('inf')]:
+            sub_fq = SamplingUnpaired(self.settings).main(
+                gbk=f'{self.indir}/NC_045512.2.gb',
+                fq=fq,
+                target_coverage=target_coverage)
+            self.assertEqual(fq, sub_fq)
+
+        self.assertListEqual(['in.fq.gz'], os.listdir(self.workdir))
+
+
+class TestBlockSampling(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.settings.sampling_scheme = 'v2'
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_paired(self):
+        fq1, fq2 = f'{self.workdir}/in.1.fq.gz', f'{self.workdir}/in.2.fq.gz'
+        write_random_fq(fq=fq1, n_reads=20000, read_length=100, seed=1)
+        write_random_fq(fq=fq2, n_reads=20000, read_length=100, seed=2)
+
+        sub_fq1, sub_fq2 = SamplingPaired(self.settings).main(
+            gbk=f'{self.indir}/NC_045512.2.gb',
+            fq1=fq1,
+            fq2=fq2,
+            target_coverage=40.)
+
+        names1, names2 = read_names(sub_fq1), read_names(sub_fq2)
+        self.assertListEqual(names1, names2)
+        self.assertListEqual(sorted(names1, key=lambda n: int(n[4:])), names1)  # input order is kept
+        self.assertAlmostEqual(40., count_bases(sub_fq1) * 2 / GENOME_SIZE, delta=4.)
+
+    def test_reproducible(self):
+        fq = f'{self.workdir}/in.fq.gz'
+        write_random_fq(fq=fq, n_reads=5000, read_length=100, seed=1)
+
+        results = []
+        for _ in range(2):
+            sub_fq = SamplingUnpaired(self.settings).main(
+                gbk=f'{self.indir}/NC_045512.2.gb',
+                fq=fq,
+                target_coverage=5.)
+            results.append(read_names(sub_fq))
+
+        self.assertListEqual(results[0], results[1])
+
+
+class TestHashSampling(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.settings.sampling_scheme = 'hash'
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_paired(self):
+        fq1, fq2 = f'{self.workdir}/in.1.fq.gz', f'{self.workdir}/in.2.fq.gz'
+        write_random_fq(fq=fq1, n_reads=20000, read_length=100, seed=1)
+        write_random_fq(fq=fq2, n_reads=20000, read_length=100, seed=2)
+
+        sub_fq1, sub_fq2 = SamplingPaired(self.settings).main(
+            gbk=f'{self.indir}/NC_045512.2.gb',
+            fq1=fq1,
+            fq2=fq2,
+            target_coverage=40.)
+
+        names1, names2 = read_names(sub_fq1), read_names(sub_fq2)
+        self.assertListEqual(names1, names2)
+        self.assertAlmostEqual(40., count_bases(sub_fq1) * 2 / GENOME_SIZE, delta=4.)
+
+    def test_independent_of_threads_and_order(self):
+        fq = f'{self.workdir}/in.fq.gz'
+        write_random_fq(fq=fq, n_reads=5000, read_length=100, seed=1)
+        with gzip.open(fq, 'rt') as fh:
+            lines = fh.read().splitlines(keepends=True)
+        records = [''.join(lines[i:i + 4]) for i in range(0, len(lines), 4)]
+        random.Random(1).shuffle(records)
+        shuffled_fq = f'{self.workdir}/shuffled.fq.gz'
+        with gzip.open(shuffled_fq, 'wt') as fh:
+            fh.write(''.join(records))
+
+        results = []
+        for threads, input_fq in [(1, fq), (4, fq), (4, shuffled_fq)]:
+            self.settings.threads = threads
+            sub_fq = SamplingUnpaired(self.settings).main(
+                gbk=f'{self.indir}/NC_045512.2.gb',
+                fq=input_fq,
+                target_coverage=5.)
+            results.append(sorted(read_names(sub_fq)))
+
+        self.assertListEqual(results[0], results[1])
+        self.assertListEqual(results[0], results[2])
+
+
+def is_running(pid: int) -> bool:
+    try:
+        with open(f'/proc/{pid}/stat') as fh:
+            state = fh.read().rsplit(')', 1)[1].split()[0]
+    except FileNotFoundError:
+        return False
+    return state != 'Z'
+
+
+def read_names(fq: str) -> list:
+    with gzip.open(fq, 'rt') as fh:
+        return [line.strip()[1:] for i, line in enumerate(fh) if i % 4 == 0]
+
+
+class TestSamplingIntermediateCodec(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.settings.intermediate_codec = 'none'
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_uncompressed_output(self):
+        fq = f'{self.workdir}/in.fq.gz'
+        write_random_fq(fq=fq, n_reads=5000, read_length=100, seed=1)
+
+        sub_fq = SamplingUnpaired(self.settings).main(
+            gbk=f'{self.indir}/NC_045512.2.gb',
+            fq=fq,
+            target_coverage=5.)
+
+        self.assertTrue(sub_fq.endswith('.fq'))
+        self.assertEqual('none', detect_codec(sub_fq))
+
+        sub_sub_fq = SamplingUnpaired(self.settings).main(  # uncompressed input is accepted as well
+            gbk=f'{self.indir}/NC_045512.2.gb',
+            fq=sub_fq,
+            target_coverage=2.5)
+        self.assertEqual('none', detect_codec(sub_sub_fq))
+
+
+class TestEarlyStopTrimming(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.trimming = EarlyStopTrimming(self.settings)
+        self.trimming.gbk = f'{self.indir}/NC_045512.2.gb'
+        self.trimming.target_coverage = 10.
+        self.trimming.set_target_bases()
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_stop_endless_input(self):
+        endless = 'import itertools\nfor i in itertools.count(): print(f"@r{i}\\n{100 * chr(65)}\\n+\\n{100 * chr(70)}")'
+        fq1, fq2 = f'{self.workdir}/trimmed.1.fq.gz', f'{self.workdir}/trimmed.2.fq.gz'
+
+        self.trimming.stream(args=['python', '-c', endless], trimmed_fqs=[fq1, fq2])
+
+        self.assertTrue(self.trimming.stopped)
+        self.assertEqual(count_bases(fq1), count_bases(fq2))
+        n_pairs = -(-self.trimming.target_bases // 200)  # stopped at the first pair reaching the target
+        self.assertListEqual([str(i) for i in range(0, 2 * n_pairs, 2)], [n[1:] for n in read_names(fq1)])
+
+    def test_input_below_target(self):
+        fq = f'{self.workdir}/in.fq.gz'
+        write_random_fq(fq=fq, n_reads=100, read_length=100, seed=1)
+        trimmed_fq = f'{self.workdir}/trimmed.fq.gz'
+
+        self.trimming.stream(args=['gzip', '-dc', fq], trimmed_fqs=[trimmed_fq])
+
+        self.assertFalse(self.trimming.stopped)
+        self.assertListEqual(read_names(fq), read_names(trimmed_fq))
+
+    def test_no_child_survives_stop(self):
+        pid_txt = f'{self.workdir}/child_pid.txt'
+        endless = f'sleep 60 & echo $! > {pid_txt}; while true; do printf "@r\\n{100 * "A"}\\n+\\n{100 * "F"}\\n"; done'
+
+        self.trimming.stream(args=['sh', '-c', endless], trimmed_fqs=[f'{self.workdir}/trimmed.fq.gz'])
+
+        self.assertTrue(self.trimming.stopped)
+        with open(pid_txt) as fh:
+            pid = int(fh.read())
+        for _ in range(100):
+            if not is_running(pid):
+                break
+            time.sleep(0.02)
+        self.assertFalse(is_running(pid))
+
+
+class TestDepthNormalization(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.settings.depth_normalization = True
+        self.gbk = f'{self.indir}/NC_045512.2.gb'
+        self.genome = read_genbank(self.gbk)[0].sequence.upper()
+
+    def tearDown(self):
+        self.tear_down()
+
+    def write_amplicon_fq(self, fq: str, amplicons: list, seed: int):
+        rng = random.Random(seed)
+        with gzip.open(fq, 'wt') as fh:
+            i = 0
+            for start, end, n_reads in amplicons:
+                for _ in range(n_reads):
+                    p = rng.randint(start, end - 100)
+                    seq = self.genome[p:p + 100]
+                    if rng.random() < 0.5:
+                        seq = seq[::-1].translate(str.maketrans('ACGT', 'TGCA'))
+                    fh.write(f'@{"deep" if n_reads > 100 else "weak"}{i}\n{seq}\n+\n{"F" * 100}\n')
+                    i += 1
+
+    def test_unpaired(self):
+        fq = f'{self.workdir}/in.fq.gz'
+        self.write_amplicon_fq(fq=fq, amplicons=[(1000, 1400, 4000), (20000, 20400, 40)], seed=1)
+
+        sub_fq = SamplingUnpaired(self.settings).main(gbk=self.gbk, fq=fq, target_coverage=100.)
+
+        names = read_names(sub_fq)
+        self.assertEqual(40, len([n for n in names if n.startswith('weak')]))
+        deep = len([n for n in names if n.startswith('deep')])
+        self.assertAlmostEqual(2 * 100. * Sampling.NORMALIZATION_WINDOW / 100, deep, delta=40)  # two capped windows
+
+    def test_below_target(self):
+        fq = f'{self.workdir}/in.fq.gz'
+        self.write_amplicon_fq(fq=fq, amplicons=[(20000, 20400, 40)], seed=1)
+
+        sub_fq = SamplingUnpaired(self.settings).main(gbk=self.gbk, fq=fq, target_coverage=100.)
+
+        self.assertEqual(fq, sub_fq)
+
+
+def read_records(vcf: str) -> list:
+    with open(vcf) as fh:
+        return [line for line in fh if not line.startswith('#')]
+
+
+def read_alleles(vcf: str) -> list:
+    return [tuple(line.split('\t')[1:5]) for line in read_records(vcf)]
+
+
+class TestStreamMappingThreads(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_within_threads(self):
+        for threads in [2, 3, 4, 8, 16]:
+            self.settings.threads = threads
+            bowtie2_threads, sort_threads = stream_mapping_threads(self.settings)
+            self.assertGreaterEqual(sort_threads, 1)
+            self.assertGreaterEqual(bowtie2_threads, sort_threads)
+            self.assertEqual(threads, bowtie2_threads + sort_threads)
+
+    def test_single_thread(self):
+        self.settings.threads = 1
+        self.assertTupleEqual((1, 1), stream_mapping_threads(self.settings))
+
+
+class TestSplitRegions(TestCase):
+
+    def test_main(self):
+        actual = split_regions(length=100, n=3, overlap=10)
+        expected = [
+            (1, 33, 1, 43),
+            (34, 67, 24, 77),
+            (68, 100, 58, 100),
+        ]
+        self.assertListEqual(expected, actual)
+
+    def test_more_regions_than_bases(self):
+        self.assertEqual(2, len(split_regions(length=2, n=4, overlap=10)))
+
+
+class TestMergeRegionVcfs(TestCase):
+
+    HEADER = '##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\n'
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        region_records = [
+            ['chr\t10\t.\tA\tT\t100\n', 'chr\t48\t.\tacgt\ta\t90\n', 'chr\t55\t.\tC\tG\t80\n'],
+            ['chr\t48\t.\tacgt\ta\t90\n', 'chr\t55\t.\tC\tG\t80\n', 'chr\t90\t.\tG\tGA\t70\n'],
+        ]
+        region_vcfs = []
+        for i, records in enumerate(region_records):
+            region_vcfs.append(f'{self.workdir}/region_{i}.vcf')
+            with open(region_vcfs[-1], 'w') as fh:
+                fh.write(self.HEADER + ''.join(records))
+
+        MergeRegionVcfs(self.settings).main(
+            region_vcfs=region_vcfs,
+            core_regions=[(1, 50), (51, 100)],
+            vcf=f'{self.outdir}/raw.vcf')
+
+        with open(f'{self.outdir}/raw.vcf') as fh:
+            actual = fh.read()
+        expected = self.HEADER + \
+            'chr\t10\t.\tA\tT\t100\n' + \
+            'chr\t48\t.\tacgt\ta\t90\n' + \
+            'chr\t55\t.\tC\tG\t80\n' + \
+            'chr\t90\t.\tG\tGA\t70\n'
+        self.assertEqual(expected, actual)
@@ -1,5 +1,11 @@
+import os
+import io
+import gzip
+import shutil
+import numpy as np
 import pandas as pd
-from covid_variant.process_vcf import ProcessVcf, RemoveConflictVariants, VcfDfToCdsEditDf, ReadVcf
+from covid_variant.process_vcf import ProcessVcf, RemoveConflictVariants, RemoveDeletionConflict, VcfDfToCdsEditDf, \
+    ReadVcf, ProcessCohortVcf, genotype_allele, sample_qual
 from .setup import TestCase
 
 
@@ -12,11 +18,91 @@ class TestProcessVcf(TestCase):
         self.tear_down()
 
     def test_main(self):
-        actual = ProcessVcf(self.settings).main(vcf=f'{self.indir}/{self.__class__.__name__}_in.vcf')
+        actual = ProcessVcf(self.settings).main(vcf=f'{self.indir}/{self.__class__.__name__}_in.vcf').to_df()
         expected = pd.read_csv(f'{self.indir}/{self.__class__.__name__}_out.csv')
         self.assertDataFrameEqual(expected, actual)
 
 
+class TestProcessCohortVcf(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        vcf = io.StringIO(
+            '##fileformat=VCFv4.2\n'
+            '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\ta\tb\tc\n'
+            'chr\t10\t.\tA\tT\t50\t.\t.\tGT\t1\t0\t.\n'
+            'chr\t10\t.\tA\tG\t20\t.\t.\tGT\t1\t1\t0\n'
+            'chr\t20\t.\tCGT\tC,CA\t30\t.\t.\tDP:GT\t9:2\t9:0/1\t9:0\n')
+        actual = ProcessCohortVcf(self.settings).main(vcf=vcf)
+
+        self.assertListEqual(['a', 'b', 'c'], list(actual))
+        expected = pd.DataFrame({
+            'Position': [10, 22],
+            'Type': ['substitute', 'delete'],
+            'Base': ['T', np.nan],
+        })
+        self.assertDataFrameEqual(expected, actual['a'].to_df())
+        expected = pd.DataFrame({
+            'Position': [10, 21, 22],
+            'Type': ['substitute', 'delete', 'delete'],
+            'Base': ['G', np.nan, np.nan],
+        })
+        self.assertDataFrameEqual(expected, actual['b'].to_df())
+        self.assertEqual(0, len(actual['c']))
+
+    def test_per_sample_qual(self):
+        vcf = io.StringIO(
+            '##fileformat=VCFv4.2\n'
+            '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\ta\tb\n'
+            'chr\t10\t.\tA\tT\t50\t.\t.\tGT:GQ\t1:40\t1:10\n'
+            'chr\t10\t.\tA\tG\t20\t.\t.\tGT:GQ\t1:10\t1:40\n'
+            'chr\t20\t.\tCGTA\tC\t50\t.\t.\tGT:AD:DP\t1:2,30:40\t1:30,8:40\n'
+            'chr\t21\t.\tGT\tG\t20\t.\t.\tGT:AD\t1:20,18\t1:10,28\n')
+        actual = ProcessCohortVcf(self.settings).main(vcf=vcf)
+
+        expected = pd.DataFrame({
+            'Position': [10, 21, 22, 23],
+            'Type': ['substitute', 'delete', 'delete', 'delete'],
+            'Base': ['T', np.nan, np.nan, np.nan],
+        })
+        self.assertDataFrameEqual(expected, actual['a'].to_df())
+        expected = pd.DataFrame({
+            'Position': [10, 22],
+            'Type': ['substitute', 'delete'],
+            'Base': ['G', np.nan],
+        })
+        self.assertDataFrameEqual(expected, actual['b'].to_df())
+
+    def test_sample_qual(self):
+        for field, allele, expected in [
+            ('1:35:5,20:30', 1, 35.),
+            ('1:.:5,20:30', 1, round(10 * (2 * 20 - 30) * np.log10(99), 2)),
+            ('1:.:5,20:.', 1, round(10 * (2 * 20 - 25) * np.log10(99), 2)),
+            ('2:.:5,20:30', 2, 50.),
+            ('1', 1, 50.),
+        ]:
+            self.assertEqual(expected, sample_qual(
+                field=field, allele=allele, gq_index=1, ad_index=2, dp_index=3, site_qual=50.))
+
+    def test_genotype_allele(self):
+        for field, gt_index, expected in [
+            ('1', 0, 1),
+            ('0', 0, 0),
+            ('.', 0, 0),
+            ('0/2', 0, 2),
+            ('0|1:35', 0, 1),
+            ('35:./.', 1, 0),
+            ('35', 1, 0),
+            ('1', -1, 0),
+        ]:
+            self.assertEqual(expected, genotype_allele(field=field, gt_index=gt_index))
+
+
 class TestReadVcf(TestCase):
 
     def setUp(self):
@@ -29,6 +115,42 @@ class TestReadVcf(TestCase):
         actual = ReadVcf(self.settings).main(vcf=f'{self.indir}/{self.__class__.__name__}_in.vcf')
         expected = pd.read_csv(f'{self.indir}/{self.__class__.__name__}_out.csv')
         self.assertDataFrameEqual(expected, actual)
+        self.assertListEqual([], os.listdir(self.workdir))
+
+    def test_columns(self):
+        columns = ['POS', 'REF', 'ALT', 'QUAL']
+        actual = ReadVcf(self.settings).main(vcf=f'{self.indir}/{self.__class__.__name__}_in.vcf', columns=columns)
+        expected = pd.read_csv(f'{self.indir}/{self.__class__.__name__}_out.csv')[columns]
+        self.assertDataFrameEqual(expected, actual)
+        self.assertEqual('int64', actual['POS'].dtype)
+        self.assertEqual('float64', actual['QUAL'].dtype)
+
+    def test_gzip(self):
+        vcf = f'{self.indir}/{self.__class__.__name__}_in.vcf'
+        vcf_gz = f'{self.workdir}/in.vcf.gz'
+        with open(vcf, 'rb') as reader:
+            with gzip.open(vcf_gz, 'wb') as writer:
+                shutil.copyfileobj(reader, writer)
+        actual = ReadVcf(self.settings).main(vcf=vcf_gz)
+        expected = ReadVcf(self.settings).main(vcf=vcf)
+        self.assertDataFrameEqual(expected, actual)
+
+    def test_stream(self):
+        vcf = f'{self.indir}/{self.__class__.__name__}_in.vcf'
+        with open(vcf) as fh:
+            actual = ReadVcf(self.settings).main(vcf=fh, columns=['POS', 'QUAL'])
+        expected = ReadVcf(self.settings).main(vcf=vcf, columns=['POS', 'QUAL'])
+        self.assertDataFrameEqual(expected, actual)
+
+    def test_blank_lines(self):
+        vcf = f'{self.indir}/{self.__class__.__name__}_in.vcf'
+        with open(vcf) as fh:
+            lines = fh.read().splitlines(keepends=True)
+        i = next(i for i, line in enumerate(lines) if line.startswith('#CHROM'))
+        lines = lines[:i + 2] + ['\n'] + lines[i + 2:] + ['   \n', '\n']
+        actual = ReadVcf(self.settings).main(vcf=io.StringIO(''.join(lines)))
+        expected = ReadVcf(self.settings).main(vcf=vcf)
+        self.assertDataFrameEqual(expected, actual)
 
 
 class TestRemoveConflictVariants(TestCase):
@@ -45,6 +167,54 @@ class TestRemoveConflictVariants(TestCase):
         expected = pd.read_csv(f'{self.indir}/{self.__class__.__name__}_out.csv')
         self.assertDataFrameEqual(expected, actual)
 
+    def test_many_records(self):
+        n = 100000
+        rng = np.random.default_rng(seed=1)
+        lengths = rng.integers(2, 8, size=n)
+        kinds = rng.integers(0, 3, size=n)
+        indf = pd.DataFrame(data={
+            'POS': rng.integers(1, 30000, size=n),
+            'REF': ['A' * l if k == 1 else 'A' for k, l in zip(kinds, lengths)],
+            'ALT': ['C' if k == 0 else ('A' if k == 1 else 'AG') for k in kinds],
+            'QUAL': rng.random(size=n) * 100,
+        })
+
+        outdf = RemoveConflictVariants(self.settings).main(indf=indf)
+
+        ref_len, alt_len = outdf['REF'].str.len(), outdf['ALT'].str.len()
+        self.assertTrue(outdf['POS'].is_monotonic_increasing)
+        self.assertTrue(outdf.loc[ref_len == alt_len, 'POS'].is_unique)
+        self.assertTrue((outdf.loc[ref_len < alt_len, 'POS'] + 1).is_unique)
+        deletions = outdf[ref_len > alt_len]
+        starts = (deletions['POS'] + deletions['ALT'].str.len()).to_numpy()
+        ends = (deletions['POS'] + deletions['REF'].str.len() - 1).to_numpy()
+        self.assertTrue(np.all(starts[1:] > ends[:-1]))
+
+
+class TestRemoveDeletionConflict(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        indf = pd.DataFrame(data={
+            'POS': [30, 10, 12, 14, 40],
+            'REF': ['AAA', 'AAAA', 'AAAA', 'AAAA', 'AA'],
+            'ALT': ['A', 'A', 'A', 'A', 'A'],
+            'QUAL': [50., 10., 20., 5., 50.],
+        })
+        actual = RemoveDeletionConflict(self.settings).main(indf=indf)
+        expected = pd.DataFrame(data={
+            'POS': [12, 30, 40],
+            'REF': ['AAAA', 'AAA', 'AA'],
+            'ALT': ['A', 'A', 'A'],
+            'QUAL': [20., 50., 50.],
+        })
+        self.assertDataFrameEqual(expected, actual)
+
 
 class TestVcfDfToCdsEditEf(TestCase):
 
@@ -59,3 +229,15 @@ class TestVcfDfToCdsEditEf(TestCase):
         actual = VcfDfToCdsEditDf(self.settings).main(vcf_df=vcf_df)
         expected = pd.read_csv(f'{self.indir}/{self.__class__.__name__}_out.csv')
         self.assertDataFrameEqual(expected, actual)
+
+    def test_csv(self):
+        vcf_df = pd.read_csv(f'{self.indir}/{self.__class__.__name__}_in.csv')
+        actual = f'{self.outdir}/cds_edit.csv'
+        VcfDfToCdsEditDf(self.settings).main(vcf_df=vcf_df).to_csv(actual, index=False)
+        self.assertFileEqual(f'{self.indir}/{self.__class__.__name__}_out.csv', actual)
+
+    def test_empty(self):
+        vcf_df = pd.DataFrame(columns=['POS', 'REF', 'ALT', 'QUAL'])
+        actual = VcfDfToCdsEditDf(self.settings).main(vcf_df=vcf_df)
+        self.assertListEqual(['Position', 'Type', 'Base'], list(actual.columns))
+        self.assertEqual(0, len(actual))
@@ -1,4 +1,4 @@
-import pandas as pd
+from covid_variant.cds_edits import CdsEdits
 from covid_variant.read_gbk_mutate import ReadGbk, Mutate
 from .setup import TestCase
 
@@ -37,7 +37,7 @@ class TestMutate(TestCase):
 
         mutant_cdses = Mutate(self.settings).main(
             cdses=wt_cdses,
-            cds_edit_df=pd.read_csv(f'{self.indir}/cds_edit.csv')
+            cds_edits=CdsEdits.read_csv(f'{self.indir}/cds_edit.csv')
         )
 
         spike = [cds for cds in mutant_cdses if cds.name == 'S'][0]
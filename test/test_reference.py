@@ -0,0 +1,72 @@
+import os
+import shutil
+from unittest.mock import patch
+from ngslite import read_genbank
+from covid_variant import reference, checkpoint
+from covid_variant.reference import LoadReference
+from .setup import TestCase
+
+
+class TestLoadReference(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.settings.index_cache_dir = f'{self.workdir}/index_cache'
+        self.gbk = f'{self.workdir}/NC_045512.2.gb'
+        shutil.copyfile(f'{os.path.dirname(self.indir)}/test_read_gbk_mutate/NC_045512.2.gb', self.gbk)
+        reference._references.clear()
+        checkpoint._sha256_cache.clear()
+
+    def tearDown(self):
+        self.tear_down()
+        reference._references.clear()
+
+    def test_main(self):
+        actual = LoadReference(self.settings).main(gbk=self.gbk)
+
+        chromosome = read_genbank(self.gbk)[0]
+        features = [f for f in chromosome.features if f.type == 'CDS']
+        self.assertEqual(chromosome.seqname, actual.seqname)
+        self.assertEqual(chromosome.sequence, actual.sequence)
+        self.assertListEqual([[tuple(r) for r in f.regions] for f in features], actual.cds_regions)
+        self.assertListEqual([f.get_attribute(key='gene') for f in features], actual.cds_names)
+        self.assertListEqual([f'{checkpoint.get_sha256(self.gbk)}.refcache'], os.listdir(self.settings.index_cache_dir))
+        self.assertFalse(os.path.exists(f'{self.gbk}.refcache'))
+
+    def test_no_cache_dir(self):
+        self.settings.index_cache_dir = None
+        LoadReference(self.settings).main(gbk=self.gbk)
+
+        self.assertListEqual([os.path.basename(self.gbk)], os.listdir(self.workdir))
+
+    def test_hash_once(self):
+        expected = LoadReference(self.settings).main(gbk=self.gbk)
+
+        with patch.object(checkpoint.hashlib, 'sha256', side_effect=AssertionError('hashed again')):
+            actual = LoadReference(self.settings).main(gbk=self.gbk)
+
+        self.assertIs(expected, actual)
+
+    def test_read_cache(self):
+        expected = LoadReference(self.settings).main(gbk=self.gbk)
+        reference._references.clear()
+
+        with patch.object(reference, 'read_genbank', side_effect=AssertionError('parsed again')):
+            actual = LoadReference(self.settings).main(gbk=self.gbk)
+
+        self.assertEqual(expected.sequence, actual.sequence)
+        self.assertListEqual(expected.cds_regions, actual.cds_regions)
+        self.assertListEqual(expected.cds_names, actual.cds_names)
+
+    def test_invalidate_by_content(self):
+        before = LoadReference(self.settings).main(gbk=self.gbk)
+
+        with open(self.gbk) as fh:
+            text = fh.read()
+        with open(self.gbk, 'w') as fh:
+            fh.write(text.replace('        1 attaaaggtt', '        1 gttaaaggtt', 1))
+        after = LoadReference(self.settings).main(gbk=self.gbk)
+
+        self.assertEqual('a', before.sequence[0].lower())
+        self.assertEqual('g', after.sequence[0].lower())
+        self.assertEqual(before.sequence[1:], after.sequence[1:])
@@ -0,0 +1,99 @@
+import os
+import json
+import threading
+import urllib.error
+import urllib.request
+from typing import Any, Dict, Tuple
+from covid_variant.server import JobServer, split_items
+from .setup import TestCase
+
+
+class TestJobServer(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.server = JobServer(
+            address=('127.0.0.1', 0),
+            outdir=self.outdir,
+            threads=2,
+            threads_per_sample=2,
+            options=self.options())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.fq_dir = f'{os.path.dirname(self.indir)}/test_covid_variant'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.tear_down()
+
+    def options(self) -> Dict[str, Any]:
+        return dict(
+            tolerate_missing=0.1,
+            target_coverage=float('inf'),
+            single_pass_sampling=False,
+            sampling_scheme='v1',
+            depth_normalization=False,
+            unordered_input=False,
+            intermediate_codec='gzip',
+            compression_level=None,
+            stream_mapping=False,
+            calling_regions=1,
+            variant_caller='bcftools',
+            thread_profile=None,
+            index_cache_dir=None,
+            workdir_backend='disk',
+            memory_budget=4.0,
+            resume=False,
+            debug=False)
+
+    def request(self, path: str, data: Any = None) -> Tuple[int, Any]:
+        body = None if data is None else json.dumps(data).encode()
+        try:
+            with urllib.request.urlopen(urllib.request.Request(self.url + path, data=body)) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_main(self):
+        status, job = self.request('/jobs', {
+            'fq1': f'{self.fq_dir}/54Ct21-NY-23572315_S54_L001_R1.fq.gz',
+            'fq2': f'{self.fq_dir}/54Ct21-NY-23572315_S54_L001_R2.fq.gz',
+            'target_coverage': 50.,
+            'wait': True,
+        })
+        self.assertEqual(200, status)
+        self.assertEqual('done', job['status'])
+        self.assertIn('N501Y', job['spike_mutations'])
+        self.assertTrue(job['match'][0].startswith('B.1.1.7'))
+        self.assertTrue(os.path.isdir(f'{self.outdir}/index_cache'))
+
+    def test_health(self):
+        self.assertEqual((200, {'status': 'ok', 'workers': 1}), self.request('/health'))
+
+    def test_job_not_found(self):
+        status, _ = self.request('/jobs/999999')
+        self.assertEqual(404, status)
+
+    def test_invalid_requests(self):
+        fq1 = f'{self.fq_dir}/54Ct21-NY-23572315_S54_L001_R1.fq.gz'
+        for data in [
+            {'fq1': fq1, 'unknown_option': 1},
+            {'fq2': fq1},
+            {'fq1': f'{self.fq_dir}/not_exist.fq.gz'},
+            [fq1],
+        ]:
+            status, response = self.request('/jobs', data)
+            self.assertEqual(400, status)
+            self.assertIn('error', response)
+        self.assertEqual((200, []), self.request('/jobs'))
+
+
+class TestSplitItems(TestCase):
+
+    def test_main(self):
+        self.assertListEqual(['N501Y', 'D614G'], split_items('N501Y, D614G'))
+        self.assertListEqual([], split_items(''))
+        self.assertIsNone(split_items(None))
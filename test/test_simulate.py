@@ -0,0 +1,97 @@
+import gzip
+import pandas as pd
+from ngslite import read_genbank
+from covid_variant.cds_edits import CdsEdits
+from covid_variant.read_gbk_mutate import ReadGbk, Mutate
+from covid_variant.compare import CompareWtMutantCdses
+from covid_variant.simulate import SimulateReads, apply_cds_edits, b_1_1_7_cds_edit_df
+from .setup import TestCase
+
+
+GBK = 'reference/NC_045512.2.gb'
+
+
+def read_fq(fq: str):
+    with gzip.open(fq, 'rt') as fh:
+        lines = fh.read().splitlines()
+    return lines[0::4], lines[1::4], lines[3::4]
+
+
+def reverse_complement(seq: str) -> str:
+    return seq[::-1].translate(str.maketrans('ACGT', 'TGCA'))
+
+
+class TestApplyCdsEdits(TestCase):
+
+    def test_edits(self):
+        df = pd.DataFrame(data={
+            'Position': [2, 4, 6],
+            'Type': ['substitute', 'delete', 'insert'],
+            'Base': ['T', None, 'GG'],
+        })
+        self.assertEqual('ATGAGGC', apply_cds_edits(sequence='acgtac', cds_edit_df=df))
+
+    def test_b_1_1_7(self):
+        self.set_up(py_path=__file__)
+        wt_cdses = ReadGbk(self.settings).main(gbk=GBK)
+        mutant_cdses = Mutate(self.settings).main(cdses=wt_cdses, cds_edits=CdsEdits.from_df(b_1_1_7_cds_edit_df()))
+        df = CompareWtMutantCdses(self.settings).main(wt_cdses=wt_cdses, mutant_cdses=mutant_cdses)
+        self.tear_down()
+
+        self.assertListEqual(
+            ['69del', '70del', '144del', 'N501Y', 'A570D', 'D614G', 'P681H', 'T716I', 'S982A', 'D1118H'],
+            list(df['Mutation']))
+
+
+class TestSimulateReads(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.genome = apply_cds_edits(
+            sequence=read_genbank(GBK)[0].sequence,
+            cds_edit_df=b_1_1_7_cds_edit_df())
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_paired(self):
+        simulator = SimulateReads(self.settings)
+        fq1, fq2 = simulator.main(
+            gbk=GBK,
+            cds_edit_df=b_1_1_7_cds_edit_df(),
+            coverage=5,
+            read_length=100,
+            paired=True,
+            prefix=f'{self.workdir}/sim')
+
+        names1, seqs1, quals1 = read_fq(fq1)
+        names2, seqs2, quals2 = read_fq(fq2)
+
+        self.assertEqual(simulator.n_reads, len(seqs1) + len(seqs2))
+        self.assertEqual(simulator.n_bases, sum(len(s) for s in seqs1 + seqs2))
+        self.assertAlmostEqual(5, simulator.n_bases / len(self.genome), delta=0.01)
+        self.assertListEqual([n[:-2] for n in names1], [n[:-2] for n in names2])
+        self.assertTrue(all(q == 'I' * 100 for q in quals1))
+
+        for s1, s2 in zip(seqs1[:200], seqs2[:200]):
+            forward = self.genome.find(s1) >= 0
+            self.assertTrue(forward or self.genome.find(reverse_complement(s1)) >= 0)
+            if forward:  # mate on the other strand and downstream
+                self.assertGreater(self.genome.find(reverse_complement(s2)), self.genome.find(s1))
+
+    def test_unpaired_with_errors(self):
+        fq1, fq2 = SimulateReads(self.settings).main(
+            gbk=GBK,
+            cds_edit_df=b_1_1_7_cds_edit_df(),
+            coverage=2,
+            read_length=150,
+            paired=False,
+            prefix=f'{self.workdir}/sim',
+            error_rate=0.01,
+            seed=2)
+
+        self.assertIsNone(fq2)
+        names, seqs, quals = read_fq(fq1)
+        exact = sum(self.genome.find(s) >= 0 or self.genome.find(reverse_complement(s)) >= 0 for s in seqs)
+        self.assertLess(exact, len(seqs) * 0.5)  # about 3 / 4 of reads carry an error
+        self.assertTrue(set(''.join(seqs)) <= set('ACGT'))
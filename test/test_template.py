@@ -0,0 +1,79 @@
+import os
+import json
+import pickle
+import subprocess
+from covid_variant.template import Processor
+from .setup import TestCase
+
+
+class Sleep(Processor):
+    POLL_INTERVAL = 0.01
+
+
+class TestProcessorCall(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.jsonl = f'{self.outdir}/resource_usage.jsonl'
+
+    def tearDown(self):
+        self.tear_down()
+
+    def read_records(self) -> list:
+        with open(self.jsonl) as fh:
+            return [json.loads(line) for line in fh]
+
+    def test_record(self):
+        Processor(self.settings).call('true')
+        Sleep(self.settings).call('sleep 0.1')
+
+        records = self.read_records()
+        self.assertListEqual(['Processor', 'Sleep'], [r['processor'] for r in records])
+        self.assertGreaterEqual(records[1]['wall_time'], 0.1)
+        for key in ['cmd', 'start', 'user_time', 'sys_time', 'max_rss_kb', 'threads', 'returncode']:
+            self.assertIn(key, records[0])
+
+    def test_nonzero_exit(self):
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            Processor(self.settings).call('exit 3')
+        self.assertEqual(3, context.exception.returncode)
+        self.assertEqual(3, self.read_records()[0]['returncode'])
+
+        e = pickle.loads(pickle.dumps(context.exception))  # raised in worker processes of batch mode
+        self.assertEqual(3, e.returncode)
+
+    def test_pipefail(self):
+        Processor(self.settings).call('false | true')
+        with self.assertRaises(subprocess.CalledProcessError):
+            Processor(self.settings).call('false | true', pipefail=True)
+        self.assertListEqual([0, 1], [r['returncode'] for r in self.read_records()])
+
+    def test_monitor(self):
+        calls = []
+        Sleep(self.settings).call('sleep 0.2', monitor=lambda: calls.append(1))
+        self.assertGreater(len(calls), 1)
+
+    def test_mock(self):
+        self.settings.mock = True
+        Processor(self.settings).call('true')
+        self.assertFalse(os.path.exists(self.jsonl))
+
+    def test_call_stream(self):
+        txt = f'{self.workdir}/file with spaces.txt'
+        with open(txt, 'w') as fh:
+            fh.write('a\nb\n')
+
+        lines = []
+        Processor(self.settings).call_stream(args=['cat', txt], consume=lambda fh: lines.extend(fh), threads=1)
+
+        self.assertListEqual(['a\n', 'b\n'], lines)
+        record = self.read_records()[0]
+        self.assertEqual(f"cat '{txt}'", record['cmd'])
+        self.assertEqual(0, record['returncode'])
+        self.assertEqual(1, record['threads'])
+
+    def test_call_stream_nonzero_exit(self):
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            Processor(self.settings).call_stream(args=['cat', f'{self.workdir}/missing.txt'], consume=list)
+        self.assertEqual(1, context.exception.returncode)
+        self.assertEqual(1, self.read_records()[0]['returncode'])
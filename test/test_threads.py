@@ -0,0 +1,75 @@
+import json
+from covid_variant.template import Processor
+from covid_variant.pipeline import VariantCallingPipeline
+from covid_variant.threads import ThreadProfile, BuildThreadProfile, tool_name
+from .setup import TestCase
+
+
+class TestToolName(TestCase):
+
+    def test_main(self):
+        self.assertEqual('cutadapt', tool_name('cutadapt \\\n--cores 4 \\\n-o out.fq in.fq'))
+        self.assertEqual('samtools sort', tool_name('samtools sort \\\n-@ 4 \\\n-o out.bam in.bam'))
+        self.assertEqual('bcftools', tool_name('bcftools mpileup \\\n--threads 1 | bcftools call'))
+        self.assertIsNone(tool_name(''))
+
+
+class TestThreadProfile(TestCase):
+
+    def test_threads(self):
+        profile = ThreadProfile(tools={'bcftools': 1, 'samtools sort': 4})
+        self.assertEqual(1, profile.threads(tool='bcftools', available=16))
+        self.assertEqual(2, profile.threads(tool='samtools sort', available=2))
+        self.assertEqual(16, profile.threads(tool='bowtie2', available=16))
+
+
+class TestStageThreads(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.settings.threads = 16
+        self.settings.thread_profile = f'{self.outdir}/stage_thread_profile.json'  # profiles are cached by path
+        with open(self.settings.thread_profile, 'w') as fh:
+            json.dump({'tools': {'bowtie2-build': 1, 'bowtie2': 4, 'samtools view': 2, 'samtools sort': 2}}, fh)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_mapping(self):
+        self.assertEqual(4, VariantCallingPipeline(self.settings).stage_threads(stage='mapping'))
+
+    def test_stream_mapping(self):
+        self.settings.stream_mapping = True
+        self.assertEqual(6, VariantCallingPipeline(self.settings).stage_threads(stage='mapping'))  # concurrent bowtie2 and samtools sort
+
+
+class TestBuildThreadProfile(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def write_jsonl(self, name: str, threads: int, wall_times: dict) -> str:
+        jsonl = f'{self.workdir}/{name}.jsonl'
+        with open(jsonl, 'w') as fh:
+            for cmd, wall_time in wall_times.items():
+                fh.write(json.dumps({'cmd': cmd, 'threads': threads, 'wall_time': wall_time, 'returncode': 0}) + '\n')
+        return jsonl
+
+    def test_main(self):
+        jsonls = [
+            self.write_jsonl(name='t1', threads=1, wall_times={'bowtie2 -x': 80., 'bcftools mpileup': 10.}),
+            self.write_jsonl(name='t4', threads=4, wall_times={'bowtie2 -x': 21., 'bcftools mpileup': 9.8}),
+            self.write_jsonl(name='t8', threads=8, wall_times={'bowtie2 -x': 11., 'bcftools mpileup': 9.7}),
+        ]
+        json_path = f'{self.outdir}/thread_profile.json'
+
+        tools = BuildThreadProfile().main(resource_usage_jsonls=jsonls, json_path=json_path)
+
+        self.assertDictEqual({'bowtie2': 8, 'bcftools': 1}, tools)
+        self.settings.thread_profile = json_path
+        self.settings.threads = 8
+        self.assertEqual(1, Processor(self.settings).tool_threads('bcftools'))
+        self.assertEqual(8, Processor(self.settings).tool_threads('bowtie2'))
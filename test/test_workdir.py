@@ -0,0 +1,118 @@
+import os
+import gzip
+from typing import Optional
+from covid_variant import Main
+from covid_variant.pipeline import VariantCallingPipeline
+from covid_variant.workdir import ResolveWorkdirBackend, estimate_intermediate_bytes, INDEX_BYTES
+from .setup import TestCase
+
+
+class TestResolveWorkdirBackend(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.fq = f'{self.workdir}/reads.fq.gz'
+        with gzip.open(self.fq, 'wt') as fh:
+            for i in range(1000):
+                fh.write(f'@read{i}\n{"ACGT" * 25}\n+\n{"F" * 100}\n')
+        self.memory_root = f'{self.workdir}/shm'
+        self.scratch_root = f'{self.workdir}/scratch'
+        for d in [self.memory_root, self.scratch_root]:
+            os.makedirs(d)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def resolve(self, backend: str, memory_budget: int, memory_root: str, scratch_root: Optional[str] = None) -> str:
+        return ResolveWorkdirBackend().main(
+            backend=backend,
+            memory_budget=memory_budget,
+            fqs=[self.fq, None],
+            intermediate_codec='gzip',
+            stream_mapping=False,
+            memory_root=memory_root,
+            scratch_root=self.scratch_root if scratch_root is None else scratch_root)
+
+    def test_estimate(self):
+        gzip_estimate = estimate_intermediate_bytes(fqs=[self.fq], intermediate_codec='gzip', stream_mapping=False)
+        none_estimate = estimate_intermediate_bytes(fqs=[self.fq], intermediate_codec='none', stream_mapping=False)
+        stream_estimate = estimate_intermediate_bytes(fqs=[self.fq], intermediate_codec='gzip', stream_mapping=True)
+        self.assertGreater(gzip_estimate, INDEX_BYTES)
+        self.assertGreater(none_estimate, gzip_estimate)
+        self.assertLess(stream_estimate, gzip_estimate)
+
+    def test_disk(self):
+        self.assertEqual('disk', self.resolve(backend='disk', memory_budget=2 ** 40, memory_root=self.memory_root))
+
+    def test_memory(self):
+        self.assertEqual('memory', self.resolve(backend='memory', memory_budget=2 ** 30, memory_root=self.memory_root))
+
+    def test_memory_over_budget(self):
+        self.assertEqual('scratch', self.resolve(backend='memory', memory_budget=2 ** 20, memory_root=self.memory_root))
+
+    def test_memory_root_not_exist(self):
+        self.assertEqual('scratch', self.resolve(backend='memory', memory_budget=2 ** 30, memory_root=f'{self.workdir}/not_exist'))
+
+    def test_scratch_root_not_exist(self):
+        self.assertEqual('disk', self.resolve(
+            backend='memory', memory_budget=2 ** 20, memory_root=self.memory_root, scratch_root=f'{self.workdir}/not_exist'))
+
+
+class FailingMain(Main):
+
+    def execute(self):
+        raise RuntimeError
+
+
+class TestReleaseMemory(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.fq = f'{self.workdir}/reads.fq.gz'
+        with gzip.open(self.fq, 'wt') as fh:
+            fh.write(f'@read\n{"ACGT" * 25}\n+\n{"F" * 100}\n')
+
+    def tearDown(self):
+        self.tear_down()
+
+    def run_failing(self, workdir_backend: str) -> Main:
+        main = FailingMain()
+        with self.assertRaises(RuntimeError):
+            main.main(
+                fq1=self.fq, fq2='None', outdir=self.outdir, tolerate_missing=0.1, target_coverage=float('inf'),
+                single_pass_sampling=False, sampling_scheme='v1', depth_normalization=False, unordered_input=False,
+                intermediate_codec='gzip', compression_level=None, threads=1, stream_mapping=False, calling_regions=1,
+                variant_caller='bcftools', thread_profile='None', index_cache_dir='None', workdir_backend=workdir_backend,
+                memory_budget=1.0, workdir='None', resume=False, debug=False)
+        return main
+
+    def test_memory(self):
+        main = self.run_failing(workdir_backend='memory')
+        if main.settings.workdir_backend != 'memory':
+            self.skipTest('/dev/shm is not available')
+        self.assertFalse(os.path.exists(main.settings.workdir))
+
+    def test_disk(self):
+        main = self.run_failing(workdir_backend='disk')
+        self.assertTrue(os.path.isdir(main.settings.workdir))  # kept for inspection
+        os.rmdir(main.settings.workdir)
+
+
+class TestWorkdirUsage(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_bytes_written(self):
+        pipeline = VariantCallingPipeline(self.settings)
+        pipeline.gbk = f'{os.path.dirname(self.indir)}/test_pipeline/NC_045512.2.gb'
+        pipeline.bytes_written = {}
+
+        pipeline.checkpoint(stage=pipeline.write_fna, inputs=['gbk'], outputs=['fna'])
+        pipeline.write_workdir_usage()
+
+        self.assertEqual(os.path.getsize(pipeline.fna), pipeline.bytes_written['write_fna'])
+        self.assertTrue(os.path.exists(f'{self.outdir}/workdir_usage.json'))